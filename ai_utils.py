@@ -1,9 +1,10 @@
 import os
 
-from openai import OpenAI
+# the openai sdk takes over a second to import, so it's only loaded by the functions that use it
 
 
 async def generateImage(prompt,model):
+    from openai import OpenAI
     KEY = os.getenv("API_KEY")
     client = OpenAI(base_url="", api_key=KEY)
 
@@ -16,6 +17,7 @@ async def generateImage(prompt,model):
 
 # NOT USED ANYMORE
 async def understantImage(image_url, prompt, model, user=None):
+    from openai import OpenAI
     KEY = os.getenv("API_KEY")
     client = OpenAI(
         api_key=KEY,
@@ -0,0 +1,449 @@
+# Local stand-ins for the services the bot talks to, so benchmarks can run without a gpu or the internet
+
+import asyncio
+import csv
+import datetime
+import hashlib
+import hmac
+import itertools
+import json
+import os
+import random
+import re
+import time
+import zlib
+
+from aiohttp import web
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+train_number_pattern = re.compile(r'\b(\d{1,4}M|[A-Z]{1,2}\d{2,4})\b')
+departures_pattern = re.compile(r'next train (?:from|at) ([a-z ]+?)(?:\?|$)', re.IGNORECASE)
+
+
+def estimateTokens(text):
+    return len(text) // 4 + 1
+
+
+class FakeOllama:
+    # speaks enough of the ollama api for the bot, with a pretend kv cache: only the part of the prompt
+    # that differs from the model's previous prompt costs prefill time
+    # with use_tools, a message that mentions a train number gets a train_info call before the answer,
+    # and one asking for the next train from a station gets next_departures if the bot offers it
+    def __init__(self, prefill_ms_per_token=0.2, token_ms=15, reply="yeah that's a comeng, pretty common on the frankston line",
+                 models=('qwen3:4b',), token_jitter=0.0, use_tools=False):
+        self.prefill_ms_per_token = prefill_ms_per_token
+        self.token_ms = token_ms
+        self.token_jitter = token_jitter  # each token takes token_ms +- this share of it
+        self.reply = reply
+        self.models = list(models)
+        self.use_tools = use_tools
+        self.tool_calls = 0
+        self.disconnects = 0
+        self.down = False  # answer everything with a 503, like an overloaded or broken host
+        self.last_prompt = {}  # model -> rendered prompt
+        self.requests = 0
+        self.runner = None
+        self.url = None
+
+    def render(self, messages, tools):
+        # roughly what a chat template does: every system message merged at the top like ollama's .System,
+        # then the tool schemas, then the rest
+        system = '\n\n'.join(message.get('content') or '' for message in messages if message['role'] == 'system')
+        parts = [f"<|system|>{system}"] if system else []
+        if tools:
+            parts.append(f"<|tools|>{json.dumps(tools)}")
+        for message in messages:
+            if message['role'] != 'system':
+                parts.append(f"<|{message['role']}|>{message.get('content') or ''}")
+        return ''.join(parts)
+
+    def tokenDelay(self):
+        return self.token_ms * (1 + random.uniform(-self.token_jitter, self.token_jitter)) / 1000
+
+    def toolCall(self, messages, tools=None):
+        # asks for train_info or next_departures once, the request after the tool result gets a normal answer
+        if not self.use_tools or not messages or messages[-1].get('role') == 'tool':
+            return None
+        content = messages[-1].get('content') or ''
+        match = departures_pattern.search(content)
+        if match is not None and any(tool['function']['name'] == 'next_departures' for tool in tools or []):
+            self.tool_calls += 1
+            return [{'function': {'name': 'next_departures', 'arguments': {'station': match.group(1)}}}]
+        match = train_number_pattern.search(content)
+        if match is None:
+            return None
+        self.tool_calls += 1
+        return [{'function': {'name': 'train_info', 'arguments': {'number': match.group(1)}}}]
+
+    async def chat(self, request):
+        if self.down:
+            return web.json_response({'error': 'server is down'}, status=503)
+        body = await request.json()
+        self.requests += 1
+        model = body['model']
+        prompt = self.render(body.get('messages', []), body.get('tools'))
+        cached = len(os.path.commonprefix([prompt, self.last_prompt.get(model, '')]))
+        self.last_prompt[model] = prompt
+        prompt_tokens = estimateTokens(prompt)
+        new_tokens = estimateTokens(prompt[cached:])
+        prefill = new_tokens * self.prefill_ms_per_token / 1000
+        started = time.perf_counter()
+        await asyncio.sleep(prefill)
+
+        tool_calls = self.toolCall(body.get('messages', []), body.get('tools'))
+        words = [] if tool_calls else self.reply.split(' ')
+        stats = {
+            'done': True,
+            'done_reason': 'stop',
+            'prompt_eval_count': new_tokens,
+            'prompt_eval_duration': int(prefill * 1e9),
+            'eval_count': len(words),
+            'eval_duration': int(len(words) * self.token_ms * 1e6),
+            'cached_tokens': prompt_tokens - new_tokens,
+        }
+
+        if not body.get('stream', True):
+            await asyncio.sleep(sum(self.tokenDelay() for _ in words))
+            stats['total_duration'] = int((time.perf_counter() - started) * 1e9)
+            message = {'role': 'assistant', 'content': ' '.join(words)}
+            if tool_calls:
+                message['tool_calls'] = tool_calls
+            return web.json_response({'model': model, 'created_at': '2026-01-01T00:00:00Z', 'message': message, **stats})
+
+        response = web.StreamResponse(headers={'Content-Type': 'application/x-ndjson'})
+        try:
+            await response.prepare(request)
+            if tool_calls:
+                chunk = {'model': model, 'created_at': '2026-01-01T00:00:00Z', 'done': False,
+                         'message': {'role': 'assistant', 'content': '', 'tool_calls': tool_calls}}
+                await response.write(json.dumps(chunk).encode() + b'\n')
+            for i, word in enumerate(words):
+                await asyncio.sleep(self.tokenDelay())
+                chunk = {'model': model, 'created_at': '2026-01-01T00:00:00Z', 'done': False,
+                         'message': {'role': 'assistant', 'content': word if i == 0 else ' ' + word}}
+                await response.write(json.dumps(chunk).encode() + b'\n')
+            stats['total_duration'] = int((time.perf_counter() - started) * 1e9)
+            final = {'model': model, 'created_at': '2026-01-01T00:00:00Z', 'message': {'role': 'assistant', 'content': ''}, **stats}
+            await response.write(json.dumps(final).encode() + b'\n')
+            await response.write_eof()
+        except ConnectionResetError:
+            self.disconnects += 1  # the bot cancelled the reply, e.g. a newer message came in
+        return response
+
+    async def tags(self, request):
+        if self.down:
+            return web.json_response({'error': 'server is down'}, status=503)
+        return web.json_response({'models': [{'name': m, 'model': m, 'size': 2_500_000_000} for m in self.models]})
+
+    async def ps(self, request):
+        return web.json_response({'models': []})
+
+    def app(self):
+        app = web.Application()
+        app.router.add_post('/api/chat', self.chat)
+        app.router.add_get('/api/tags', self.tags)
+        app.router.add_get('/api/ps', self.ps)
+        return app
+
+    async def start(self, host='127.0.0.1', port=0):
+        self.runner = web.AppRunner(self.app())
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f"http://{host}:{port}"
+        return self.url
+
+    async def stop(self):
+        if self.runner is not None:
+            await self.runner.cleanup()
+            self.runner = None
+
+
+class FakeRailApis:
+    # the trainset csv and the photo api, served from benchmarks/fixtures
+    def __init__(self, csv_path=os.path.join(FIXTURES, 'trainsets.csv'), latency_ms=20):
+        self.csv_path = csv_path
+        self.latency_ms = latency_ms
+        self.csv_requests = 0
+        self.photo_requests = 0
+        self.head_requests = 0
+        self.runner = None
+        self.url = None
+
+    async def trainsets(self, request):
+        self.csv_requests += 1
+        await asyncio.sleep(self.latency_ms / 1000)
+        with open(self.csv_path, 'rb') as f:
+            return web.Response(body=f.read(), content_type='text/csv')
+
+    async def photos(self, request):
+        self.photo_requests += 1
+        await asyncio.sleep(self.latency_ms / 1000)
+        number = request.match_info['number']
+        # the newest featured photo of every third train has been taken down
+        newest = f"{number}-missing" if zlib.crc32(number.encode()) % 3 == 0 else f"{number}-new"
+        photos = [{'url': f"{self.url}/images/{name}.jpg", 'photographer': 'someone', 'featured': featured}
+                  for name, featured in ((f"{number}-old", 1), (f"{number}-other", 0), (newest, 1))]
+        return web.json_response({'photos': photos})
+
+    async def image(self, request):
+        if request.method == 'HEAD':
+            self.head_requests += 1
+        if 'missing' in request.match_info['name']:
+            return web.Response(status=404)
+        return web.Response(body=b'\xff\xd8\xff\xd9', content_type='image/jpeg')
+
+    def app(self):
+        app = web.Application()
+        app.router.add_get('/api/trainsets.csv', self.trainsets)
+        app.router.add_get('/api/photos/{number}', self.photos)
+        app.router.add_get('/images/{name}', self.image)  # also answers HEAD
+        return app
+
+    async def start(self, host='127.0.0.1', port=0):
+        self.runner = web.AppRunner(self.app())
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f"http://{host}:{port}"
+        return self.url
+
+    async def stop(self):
+        if self.runner is not None:
+            await self.runner.cleanup()
+            self.runner = None
+
+    def trainNumbers(self):
+        with open(self.csv_path, 'r', encoding='utf-8') as f:
+            rows = list(csv.reader(f))[1:]
+        return [part for row in rows if row for part in row[0].split('-') if part]
+
+
+class FakeTimetable:
+    # the two PTV timetable api calls the departures tool makes, checking each request is signed with dev_id and key
+    STOPS = [
+        {'stop_id': 1071, 'stop_name': 'Flinders Street Station', 'route_type': 0},
+        {'stop_id': 1162, 'stop_name': 'Richmond Station', 'route_type': 0},
+        {'stop_id': 1181, 'stop_name': 'Southern Cross Station', 'route_type': 0},
+        {'stop_id': 1073, 'stop_name': 'Frankston Station', 'route_type': 0},
+        {'stop_id': 19854, 'stop_name': 'Flinders St/Elizabeth St', 'route_type': 1},
+    ]
+    ROUTES = {'6': {'route_id': 6, 'route_name': 'Frankston'}, '11': {'route_id': 11, 'route_name': 'Pakenham'},
+              '2': {'route_id': 2, 'route_name': 'Belgrave'}}
+    DIRECTIONS = {'1': {'direction_id': 1, 'direction_name': 'City (Flinders Street)'},
+                  '5': {'direction_id': 5, 'direction_name': 'Frankston'}}
+
+    def __init__(self, dev_id='1000000', key='fake-key', latency_ms=30):
+        self.dev_id = dev_id
+        self.key = key.encode()
+        self.latency_ms = latency_ms
+        self.search_requests = 0
+        self.departure_requests = 0
+        self.bad_signatures = 0
+        self.runner = None
+        self.url = None
+
+    def signed(self, request):
+        path, _, signature = request.raw_path.partition('&signature=')
+        expected = hmac.new(self.key, path.encode(), hashlib.sha1).hexdigest()
+        return request.query.get('devid') == self.dev_id and hmac.compare_digest(signature, expected)
+
+    async def search(self, request):
+        if not self.signed(request):
+            self.bad_signatures += 1
+            return web.json_response({'message': 'Forbidden'}, status=403)
+        self.search_requests += 1
+        await asyncio.sleep(self.latency_ms / 1000)
+        term = request.match_info['term'].lower()
+        stops = [stop for stop in self.STOPS if term in stop['stop_name'].lower()]
+        return web.json_response({'stops': stops, 'routes': [], 'outlets': []})
+
+    async def departures(self, request):
+        if not self.signed(request):
+            self.bad_signatures += 1
+            return web.json_response({'message': 'Forbidden'}, status=403)
+        self.departure_requests += 1
+        await asyncio.sleep(self.latency_ms / 1000)
+        now = datetime.datetime.now(datetime.timezone.utc)
+        departures = []
+        for i in range(int(request.query.get('max_results', 3)) * 2):
+            scheduled = now + datetime.timedelta(minutes=3 + i * 4)
+            departures.append({
+                'stop_id': int(request.match_info['stop_id']), 'route_id': (6, 11, 2)[i % 3], 'direction_id': (1, 5)[i % 2],
+                'scheduled_departure_utc': scheduled.strftime('%Y-%m-%dT%H:%M:%SZ'),
+                'estimated_departure_utc': (scheduled + datetime.timedelta(minutes=i % 2)).strftime('%Y-%m-%dT%H:%M:%SZ') if i < 3 else None,
+                'platform_number': str(1 + i % 4),
+            })
+        return web.json_response({'departures': departures, 'routes': self.ROUTES, 'directions': self.DIRECTIONS})
+
+    def app(self):
+        app = web.Application()
+        app.router.add_get('/v3/search/{term}', self.search)
+        app.router.add_get('/v3/departures/route_type/{route_type}/stop/{stop_id}', self.departures)
+        return app
+
+    async def start(self, host='127.0.0.1', port=0):
+        self.runner = web.AppRunner(self.app())
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f"http://{host}:{port}"
+        return self.url
+
+    async def stop(self):
+        if self.runner is not None:
+            await self.runner.cleanup()
+            self.runner = None
+
+
+# just enough of discord's objects for bot.py's message path
+message_ids = itertools.count(1_300_000_000_000_000_000)
+
+
+class FakeUser:
+    def __init__(self, user_id, name, bot=False):
+        self.id = user_id
+        self.name = name
+        self.bot = bot
+        self.mutual_guilds = []
+
+    def __eq__(self, other):
+        return isinstance(other, FakeUser) and other.id == self.id
+
+    def __hash__(self):
+        return hash(self.id)
+
+    def __str__(self):
+        return self.name
+
+
+class FakeGuild:
+    def __init__(self, guild_id, members=()):
+        self.id = guild_id
+        self.members = list(members)
+
+
+class FakeMember(FakeUser):
+    def __init__(self, user, guild):
+        super().__init__(user.id, user.name, user.bot)
+        self.guild = guild
+
+
+class FakeMessage:
+    _state = None  # read by discord.py's command context, unused for plain messages
+
+    def __init__(self, channel, author, content, attachments=()):
+        self.id = next(message_ids)
+        self.channel = channel
+        self.guild = channel.guild
+        self.author = author
+        self.content = content
+        self.attachments = list(attachments)
+        self.created_at = datetime.datetime.now(datetime.timezone.utc)
+        self.reactions = []
+        self.embed = None
+
+    async def reply(self, content=None, embed=None, mention_author=True):
+        return await self.channel.send(content, embed=embed)
+
+    async def edit(self, content=None, embed=None):
+        await self.channel.latency()
+        if content is not None:
+            self.content = content
+        self.embed = embed
+
+    async def delete(self):
+        await self.channel.latency()
+        self.channel.deleted += 1
+
+    async def add_reaction(self, emoji):
+        await self.channel.latency()
+        self.reactions.append(emoji)
+        self.channel.onBotActivity()
+
+
+class FakeTyping:
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+class FakeChannel:
+    # a text channel, bot messages are dispatched back to the bot like the gateway does
+    def __init__(self, channel_id, guild, bot_user, dispatch, api_latency_ms=40):
+        self.id = channel_id
+        self.guild = guild
+        self.bot_user = bot_user
+        self.dispatch = dispatch
+        self.api_latency_ms = api_latency_ms
+        self.messages = []
+        self.history_calls = 0
+        self.deleted = 0
+        self.on_bot_activity = None
+
+    async def latency(self):
+        await asyncio.sleep(self.api_latency_ms / 1000)
+
+    def onBotActivity(self):
+        if self.on_bot_activity is not None:
+            self.on_bot_activity(self)
+
+    async def history(self, limit=100):
+        self.history_calls += 1
+        await self.latency()
+        for message in reversed(self.messages[-limit:]):
+            yield message
+
+    def typing(self):
+        return FakeTyping()
+
+    def post(self, author, content, attachments=()):
+        message = FakeMessage(self, author, content, attachments)
+        self.messages.append(message)
+        self.dispatch('message', message)
+        return message
+
+    async def send(self, content=None, embed=None):
+        await self.latency()
+        message = self.post(self.bot_user, content or '')
+        message.embed = embed
+        self.onBotActivity()
+        return message
+
+
+class LoopLagMonitor:
+    # how late the event loop wakes up a sleeper, anything blocking the loop shows up here
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.lags = []
+        self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(self.interval)
+            self.lags.append(max(0.0, loop.time() - started - self.interval))
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+
+def percentile(values, share):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(share * len(values)))]
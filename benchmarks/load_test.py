@@ -0,0 +1,221 @@
+# Drives bot.py's on_message with synthetic traffic from many channels and users, against a fake ollama,
+# fake discord channels and stand-ins for the trainset csv and photo apis. Nothing leaves the machine.
+# run from the repo root: python -m benchmarks.load_test --channels 20 --users 50 --rate 20 --duration 30
+
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import time
+
+from benchmarks.fakes import (FakeChannel, FakeGuild, FakeMember, FakeOllama, FakeRailApis, FakeTimetable, FakeUser,
+                              LoopLagMonitor, percentile)
+
+LINES = ["anyone seen {number} today", "what is {number}", "comengs are the best trains", "lol no", "siemens >>> comeng",
+         "who's going to the footy", "frankston line is cooked again", "show me {number}", "omera what do you think",
+         "ok but why is the pakenham line like that", "when's the next train from flinders street?", "next train at richmond"]
+
+
+def configure(args, channel_ids, ollama_urls, timetable):
+    # bot.py reads these at import
+    os.environ['PTV_BASE_URL'] = timetable.url
+    os.environ['DEV_ID'] = timetable.dev_id
+    os.environ['KEY'] = timetable.key.decode()
+    os.environ['OLLAMA_HOSTS'] = ','.join(ollama_urls)
+    os.environ['REPLY_CHANNEL_ID'] = ','.join(str(channel_id) for channel_id in channel_ids)
+    os.environ.setdefault('USER_ID', '0')
+    os.environ.setdefault('COMMAND_PREFIX', '&')
+    os.environ['COALESCE_WINDOW'] = str(args.coalesce_window)
+    os.environ['STREAM_REPLIES'] = 'true' if args.stream else 'false'
+    os.environ['INFERENCE_CONCURRENCY'] = str(args.concurrency)
+    os.environ['LOG_LEVEL'] = args.log_level
+    os.environ.pop('METRICS_PORT', None)
+
+
+class Tracker:
+    # a message is answered once a reply in its channel finishes after it was sent
+    def __init__(self):
+        self.pending = {}  # channel id -> [(message id, sent at, first reply seen)]
+        self.latencies = []
+        self.first_reply = []
+        self.sent = 0
+        self.replies = 0
+
+    def sent_message(self, message):
+        self.sent += 1
+        self.pending.setdefault(message.channel.id, []).append([message.id, time.perf_counter(), False])
+
+    def bot_activity(self, channel):
+        now = time.perf_counter()
+        for entry in self.pending.get(channel.id, []):
+            if not entry[2]:
+                entry[2] = True
+                self.first_reply.append(now - entry[1])
+
+    def answered(self, message):
+        now = time.perf_counter()
+        self.replies += 1
+        waiting = self.pending.get(message.channel.id, [])
+        done = [entry for entry in waiting if entry[0] <= message.id]
+        self.pending[message.channel.id] = [entry for entry in waiting if entry[0] > message.id]
+        self.latencies.extend(now - entry[1] for entry in done)
+
+    def outstanding(self):
+        return sum(len(waiting) for waiting in self.pending.values())
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--channels', type=int, default=20)
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--rate', type=float, default=20, help='messages per second over all channels')
+    parser.add_argument('--duration', type=float, default=20, help='seconds of traffic')
+    parser.add_argument('--token-ms', type=float, default=15)
+    parser.add_argument('--token-jitter', type=float, default=0.3)
+    parser.add_argument('--prefill-ms', type=float, default=0.2, help='per prompt token not in the cache')
+    parser.add_argument('--discord-ms', type=float, default=40, help='latency of each discord api call')
+    parser.add_argument('--api-ms', type=float, default=20, help='latency of the trainset and photo apis')
+    parser.add_argument('--coalesce-window', type=float, default=0.5)
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--backends', type=int, default=1, help='fake ollama servers to spread requests over')
+    parser.add_argument('--fail-backend-after', type=float, default=0, help='seconds before the first backend starts failing')
+    parser.add_argument('--no-stream', dest='stream', action='store_false')
+    parser.add_argument('--no-tools', dest='tools', action='store_false')
+    parser.add_argument('--response-cache', action='store_true', help='turn the response cache on in every channel')
+    parser.add_argument('--drain', type=float, default=60, help='seconds to wait for the last replies')
+    parser.add_argument('--log-level', default='WARNING')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    rail = FakeRailApis(latency_ms=args.api_ms)
+    await rail.start()
+    numbers = rail.trainNumbers()
+    fakes = [FakeOllama(prefill_ms_per_token=args.prefill_ms, token_ms=args.token_ms, token_jitter=args.token_jitter,
+                        use_tools=args.tools) for _ in range(args.backends)]
+    for fake in fakes:
+        await fake.start()
+
+    channel_ids = [1_100_000_000_000_000_000 + i for i in range(args.channels)]
+    timetable = FakeTimetable(latency_ms=args.api_ms)
+    await timetable.start()
+    configure(args, channel_ids, [fake.url for fake in fakes], timetable)
+
+    import bot
+    bot.configure_logging()
+    import functions.images
+    from functions.trainInfo import catalogue
+    from memory.memory import store
+    from settings import SqliteBackend
+
+    for fake in fakes:
+        fake.models.append(bot.settings.defaultModel)
+    # point everything that would touch the real apis or the real files somewhere harmless
+    workdir = tempfile.mkdtemp(prefix='omera-load-')
+    functions.images.PHOTOS_API_URL = f"{rail.url}/api/photos"
+    catalogue.url = f"{rail.url}/api/trainsets.csv"
+    catalogue.snapshot_path = os.path.join(workdir, 'trainsets.csv')
+    catalogue.meta_path = os.path.join(workdir, 'trainsets.json')
+    store.path = os.path.join(workdir, 'memories.db')
+    store.json_path = None
+    bot.settings.backend = SqliteBackend(os.path.join(workdir, 'settings.db'))
+    await bot.initialize()
+    for channel_id in channel_ids:
+        bot.settings.setResponseCache(channel_id, args.response_cache)
+
+    # what login would have set up
+    bot_user = FakeUser(999, 'Omera AI', bot=True)
+    bot.bot._connection.user = bot_user
+    bot.bot.loop = asyncio.get_running_loop()
+    users = [FakeUser(10_000 + i, f"user_{i}") for i in range(args.users)]
+    guild = FakeGuild(1)
+    guild.members = [FakeMember(user, guild) for user in (*users, bot_user)]
+    bot.member_index.addGuild(guild)
+
+    tracker = Tracker()
+    channels = [FakeChannel(channel_id, guild, bot_user, bot.bot.dispatch, api_latency_ms=args.discord_ms)
+                for channel_id in channel_ids]
+    for channel in channels:
+        channel.on_bot_activity = tracker.bot_activity
+
+    handler = bot.coalescer.handler
+
+    async def tracked(message, burst):
+        await handler(message, burst)
+        tracker.answered(message)
+
+    bot.coalescer.handler = tracked
+
+    async def failLater():
+        await asyncio.sleep(args.fail_backend_after)
+        fakes[0].down = True
+
+    if args.fail_backend_after:
+        asyncio.create_task(failLater())
+
+    lag = LoopLagMonitor()
+    lag.start()
+    started = time.perf_counter()
+    # poisson arrivals, a few channels are busier than the rest
+    weights = [1 / (i + 1) for i in range(len(channels))]
+    while time.perf_counter() - started < args.duration:
+        await asyncio.sleep(random.expovariate(args.rate))
+        channel = random.choices(channels, weights)[0]
+        text = random.choice(LINES).format(number=random.choice(numbers))
+        tracker.sent_message(channel.post(random.choice(users), text))
+    sending = time.perf_counter() - started
+
+    deadline = time.perf_counter() + args.drain
+    while tracker.outstanding() and time.perf_counter() < deadline:
+        await asyncio.sleep(0.05)
+    elapsed = time.perf_counter() - started
+    await lag.stop()
+
+    answered = len(tracker.latencies)
+    print(f"{tracker.sent} messages in {sending:.1f}s over {args.channels} channels from {args.users} users, "
+          f"{answered} answered by {tracker.replies} replies, {tracker.outstanding()} unanswered")
+    print(f"throughput: {answered / elapsed:.1f} messages/s, {tracker.replies / elapsed:.1f} replies/s")
+    for name, values in (('end to end', tracker.latencies), ('first reply', tracker.first_reply)):
+        print(f"{name}: p50 {percentile(values, 0.5) * 1000:.0f}ms, p95 {percentile(values, 0.95) * 1000:.0f}ms, "
+              f"p99 {percentile(values, 0.99) * 1000:.0f}ms, max {max(values, default=0) * 1000:.0f}ms")
+    print(f"event loop lag: p50 {percentile(lag.lags, 0.5) * 1000:.1f}ms, p99 {percentile(lag.lags, 0.99) * 1000:.1f}ms, "
+          f"max {max(lag.lags, default=0) * 1000:.1f}ms")
+    scheduler = bot.inference_scheduler.stats()
+    print(f"ollama: {sum(fake.requests for fake in fakes)} chat requests ({', '.join(str(fake.requests) for fake in fakes)} per backend), "
+          f"{bot.backends.failovers} failovers, {sum(fake.tool_calls for fake in fakes)} tool calls, "
+          f"{sum(fake.disconnects for fake in fakes)} cancelled streams")
+    print(f"scheduler avg wait {scheduler['avg_wait_ms']:.0f}ms, "
+          f"{scheduler['coalesced']} coalesced, {scheduler['dropped']} dropped; coalescer {bot.coalescer.stats()}")
+    cache = bot.response_cache.stats()
+    print(f"response cache: {cache['hits']} of {cache['lookups']} lookups hit ({cache['similar_hits']} by similarity), "
+          f"{cache['saved_seconds']:.1f}s of inference saved")
+    photos = functions.images.photo_service.stats()
+    print(f"photos: list hit rate {photos['list_hit_rate']:.0%}, url hit rate {photos['url_hit_rate']:.0%}, "
+          f"{photos['fallbacks']} fell back past a missing photo")
+    print(f"apis: {rail.csv_requests} csv, {rail.photo_requests} photo list and {rail.head_requests} photo head requests; "
+          f"{sum(channel.history_calls for channel in channels)} channel history calls")
+    from functions.singleflight import stats as flight_stats
+    print("shared in flight calls: " + ', '.join(f"{name} {stats['saved']} of {stats['calls'] + stats['saved']}"
+                                                 for name, stats in flight_stats().items()))
+    print(f"timetable: {timetable.search_requests} stop searches, {timetable.departure_requests} departure requests, "
+          f"{timetable.bad_signatures} badly signed; departures {bot.departures.stats()}")
+
+    ratios = bot.token_counter.ratios
+    print(f"token counter: {', '.join(f'{model} {ratio:.2f}' for model, ratio in ratios.items())} characters per token, "
+          f"{bot.token_counter.skipped} cached prompts not learnt from")
+    # the fake tokenizes 4 characters to a token, cached prefixes mustn't pull the estimate away from that
+    assert all(2 <= ratio <= 6 for ratio in ratios.values()), f"token ratio drifted: {ratios}"
+
+    for fake in fakes:
+        await fake.stop()
+    await rail.stop()
+    await timetable.stop()
+    for backend in bot.backends.backends:
+        await backend.client._client.aclose()
+    from functions.httpClient import client
+    await client.close()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,52 @@
+# Memory ranking: add/query latency and how much smaller the memory prompt gets
+# run from the repo root: python -m benchmarks.memory_retrieval
+
+import argparse
+import asyncio
+import random
+import time
+
+from memory.retrieval import MemoryIndex, HashEmbedder, estimateTokens
+
+TOPICS = ['hcmt', 'comeng', 'siemens', 'xtrapolis', 'vline', 'tram', 'bus', 'football', 'coffee', 'weather',
+          'frankston line', 'cranbourne', 'pakenham', 'flinders street', 'southern cross', 'sunbury', 'belgrave']
+NAMES = ['sam', 'alex', 'jordan', 'riley', 'casey', 'morgan', 'taylor', 'jamie']
+
+
+def fakeMemory():
+    return f"{random.choice(NAMES)} likes the {random.choice(TOPICS)} and rode {random.randint(1, 999)}M last week"
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--memories', type=int, default=1000)
+    parser.add_argument('--queries', type=int, default=200)
+    args = parser.parse_args()
+
+    memories = [fakeMemory() for _ in range(args.memories)]
+    index = MemoryIndex(HashEmbedder())
+
+    start = time.perf_counter()
+    await index.sync('bench', memories)
+    print(f"indexed {len(memories)} memories in {(time.perf_counter() - start) * 1000:.1f}ms")
+
+    # adding one memory at a time, like the memory tool does
+    start = time.perf_counter()
+    for _ in range(100):
+        memories.append(fakeMemory())
+        await index.sync('bench', memories)
+    print(f"incremental add: {(time.perf_counter() - start) / 100 * 1000:.2f}ms per memory")
+
+    start = time.perf_counter()
+    for _ in range(args.queries):
+        await index.relevant('bench', memories, f"what does {random.choice(NAMES)} think about the {random.choice(TOPICS)}")
+    print(f"query: {(time.perf_counter() - start) / args.queries * 1000:.2f}ms")
+
+    full = sum(estimateTokens(memory) for memory in memories)
+    stats = index.stats()
+    print(f"memory prompt: {full} tokens with every memory, {stats['tokens_after'] / args.queries:.0f} tokens ranked "
+          f"({stats['reduction']:.1%} smaller)")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
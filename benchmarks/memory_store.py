@@ -0,0 +1,105 @@
+# Memory store at scale: bulk load, add latency, cold/warm reads, and the old json rewrite for comparison
+# run from the repo root: python -m benchmarks.memory_store --channels 10000 --memories 1000
+
+import argparse
+import json
+import os
+import random
+import statistics
+import tempfile
+import time
+
+from memory.memory import MemoryStore
+
+
+def percentiles(samples):
+    samples = sorted(samples)
+    return (statistics.median(samples) * 1e6, samples[int(len(samples) * 0.99) - 1] * 1e6)
+
+
+def oldAddMemory(path, memory, channel_id):
+    # what addMemory used to do: parse the whole file, list dedup, rewrite everything
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            memories = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        memories = {}
+    if str(channel_id) not in memories:
+        memories[str(channel_id)] = []
+    if memory not in memories[str(channel_id)]:
+        memories[str(channel_id)].append(memory)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(memories, f, indent=4)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--channels', type=int, default=10000)
+    parser.add_argument('--memories', type=int, default=1000)
+    parser.add_argument('--samples', type=int, default=1000)
+    parser.add_argument('--json-channels', type=int, default=100, help='channels for the old json comparison, it is too slow at full size')
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    store = MemoryStore(path=os.path.join(tmp, 'memories.db'), json_path=None, batch_size=50000)
+    store.open()
+
+    total = args.channels * args.memories
+    start = time.perf_counter()
+    for channel in range(args.channels):
+        for i in range(args.memories):
+            store.add(f"channel {channel} remembers fact number {i}", channel)
+        if len(store._pending) >= store.batch_size:
+            store.flush()
+        store._cache.clear()  # keep the process small, this is about the disk side
+        store._seen.clear()
+    store.flush()
+    load_time = time.perf_counter() - start
+    print(f"loaded {total} memories across {args.channels} channels in {load_time:.1f}s ({total / load_time:.0f}/s)")
+
+    channels = [random.randrange(args.channels) for _ in range(args.samples)]
+
+    cold = []
+    for channel in channels:
+        store._cache.pop(str(channel), None)
+        start = time.perf_counter()
+        store.read(channel)
+        cold.append(time.perf_counter() - start)
+
+    warm = []
+    for channel in channels:
+        start = time.perf_counter()
+        store.read(channel)
+        warm.append(time.perf_counter() - start)
+
+    adds = []
+    for n, channel in enumerate(channels):
+        start = time.perf_counter()
+        store.add(f"a new memory {n}", channel)
+        adds.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    store.flush()
+    flush_time = time.perf_counter() - start
+
+    print("cold read:  p50 %.1fus  p99 %.1fus" % percentiles(cold))
+    print("warm read:  p50 %.1fus  p99 %.1fus" % percentiles(warm))
+    print("add:        p50 %.1fus  p99 %.1fus" % percentiles(adds))
+    print(f"flush of {len(adds)} adds: {flush_time * 1000:.1f}ms")
+    store.close()
+
+    # the old json file, at a size it can actually manage
+    json_path = os.path.join(tmp, 'memories.json')
+    with open(json_path, 'w', encoding='utf-8') as f:
+        json.dump({str(c): [f"channel {c} remembers fact number {i}" for i in range(args.memories)]
+                   for c in range(args.json_channels)}, f, indent=4)
+    old = []
+    for n in range(min(args.samples, 50)):
+        start = time.perf_counter()
+        oldAddMemory(json_path, f"a new memory {n}", random.randrange(args.json_channels))
+        old.append(time.perf_counter() - start)
+    print(f"old json add at {args.json_channels} channels: p50 %.1fus  p99 %.1fus" % percentiles(old))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+# Prefill time with the stable prompt prefix against the old layout where the system prompt changes every message
+# run from the repo root: python -m benchmarks.prefix_cache
+# or against a real ollama: python -m benchmarks.prefix_cache --host http://localhost:11434 --model qwen3:0.6b
+
+import argparse
+import asyncio
+import json
+import random
+
+import ollama
+
+from benchmarks.fakes import FakeOllama
+from prompts import PromptBuilder, TokenCounter
+
+with open('personas.json', 'r') as f:
+    PERSONA = json.load(f)['personas'][0]['prompt']
+
+# about the size of the real base prompt
+BASE_PROMPT = ("You are a person named Omera AI and are currently chatting in a Discord server. Keep responses very short, "
+               "casual, and loose. Be savvy and witty, but don't talk too much. ") * 8
+
+TOOLS = [{
+    "type": "function",
+    "function": {
+        "name": name,
+        "description": f"{name} lookup for a Melbourne/Victorian train",
+        "parameters": {"type": "object", "properties": {"number": {"type": "string", "description": "The train number e.g 134M or N452"}},
+                       "required": ["number"]},
+    },
+} for name in ("train_image", "train_info", "memory")]
+
+USERS = ['sam', 'alex', 'jordan', 'riley']
+LINES = ["anyone seen 9069 today", "what line is N452 on", "comengs are the best trains", "lol no", "siemens >>> comeng",
+         "who's going to the footy", "frankston line is cooked again", "show me 134M"]
+
+
+async def run(host, model, layout, turns):
+    client = ollama.AsyncClient(host=host)
+    builder = PromptBuilder(TokenCounter(), default_context=8192, layout=layout)
+    history = []
+    prefill = []
+    for turn in range(turns):
+        user = random.choice(USERS)
+        text = random.choice(LINES)
+        history.append({'id': turn, 'role': 'user', 'content': f"{user}: {text}"})
+        history = history[-20:]
+        memories = random.sample(LINES, 3)
+        messages, report = builder.build(model, 1, [('persona', PERSONA), ('base', BASE_PROMPT)], history, TOOLS, context=[
+            ('memories', f'You have the following memories: {memories},'),
+            ('message', f'here is details of the message: sent by {user}: {text}'),
+        ])
+        response = await client.chat(model=model, messages=messages, tools=TOOLS, options={'temperature': 0.7}, keep_alive='10m')
+        prefill.append(response['prompt_eval_duration'] / 1e6)
+        history.append({'id': turn, 'role': 'assistant', 'content': response['message']['content']})
+    return prefill[1:]  # the first request is cold either way
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', help='ollama to benchmark, a local fake is used when not set')
+    parser.add_argument('--model', default='qwen3:4b')
+    parser.add_argument('--turns', type=int, default=30)
+    args = parser.parse_args()
+
+    fake = None
+    host = args.host
+    if host is None:
+        fake = FakeOllama(models=[args.model])
+        host = await fake.start()
+
+    for layout in ('volatile', 'stable'):
+        random.seed(1)
+        if fake:
+            fake.last_prompt.clear()
+        prefill = await run(host, args.model, layout, args.turns)
+        print(f"{layout:>8} prefix: avg prefill {sum(prefill) / len(prefill):.1f}ms, max {max(prefill):.1f}ms over {len(prefill)} requests")
+
+    if fake:
+        await fake.stop()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,56 @@
+# Compares train number lookups: the old download-and-scan against the indexed catalogue
+# run from the repo root: python -m benchmarks.trainset_lookup
+
+import csv
+import os
+import random
+import time
+from io import StringIO
+
+from functions.trainInfo import TrainsetCatalogue
+
+FIXTURE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'trainsets.csv')
+LOOKUPS = 2000
+
+
+def oldLookup(text, search_value):
+    # what trainData used to do on every call (minus the http download)
+    reader = csv.reader(StringIO(text))
+    header = next(reader)
+    for row in reader:
+        if len(row) >= 10:
+            if search_value in row[0].split('-'):
+                return dict(zip(header, row))
+    return None
+
+
+def main():
+    with open(FIXTURE, 'r', encoding='utf-8') as f:
+        text = f.read()
+
+    catalogue = TrainsetCatalogue(snapshot_path=os.devnull, meta_path=os.devnull)
+    start = time.perf_counter()
+    catalogue._apply(text)
+    build_time = time.perf_counter() - start
+
+    numbers = list(catalogue.index.keys()) + ['99999M', 'X1']
+    searches = [random.choice(numbers) for _ in range(LOOKUPS)]
+
+    start = time.perf_counter()
+    for number in searches:
+        oldLookup(text, number)
+    old_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for number in searches:
+        catalogue.index.get(number)
+    new_time = time.perf_counter() - start
+
+    print(f"fixture: {len(catalogue.index)} train numbers, index built in {build_time * 1000:.2f} ms")
+    print(f"scan:    {old_time / LOOKUPS * 1e6:.2f} us per lookup")
+    print(f"index:   {new_time / LOOKUPS * 1e6:.2f} us per lookup")
+    print(f"speedup: {old_time / new_time:.0f}x")
+
+
+if __name__ == '__main__':
+    main()
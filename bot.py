@@ -1,37 +1,85 @@
+from startup import startup  # first, so the startup report counts every import
 from typing import Literal, Optional
 import typing
 import discord
 from discord.ext import commands
 from discord import app_commands
-import aiohttp
+import argparse
+import hashlib
 import json
+import logging
 import os
 from dotenv import load_dotenv
-from ollama import chat
-import re
-from concurrent.futures import ThreadPoolExecutor
 import asyncio
+import time
+import urllib.error
 
 import ollama
 
+startup.mark('import discord, ollama and aiohttp')
+
+# load the env first so modules can read their settings on import
+load_dotenv()
+
+from metrics import RATE_BUCKETS, metrics, setupLogging, startServer
+log = logging.getLogger('omera')
+message_log = logging.getLogger('omera.messages')
+
 from ai_utils import *
-from functions.images import getImage
-from functions.trainInfo import trainData
-from healthcheck import pinghealthcheck
-from memory.memory import addMemory, readMemories
+from functions.fleet import describe, fleet
+from functions.functions import departures, next_departures_async
+from functions.images import getImageAsync, photo_service
+from functions.keyCalc import configured as departures_configured
+from functions.singleflight import flight, stats as flight_stats
+from functions.trainInfo import trainDataAsync, catalogue
+from functions.toolEngine import ToolEngine, normalizeTrainNumber
+from functions.vision import ImageProcessor
+from healthcheck import pinghealthcheckAsync
+from memory.memory import addMemory, readMemories, store as memory_store
+from memory.history import history_cache
+from memory.retrieval import MemoryIndex, OllamaEmbedder, HashEmbedder
+from streaming import StreamingReply
+from scheduler import InferenceScheduler, Overloaded, parseLimits
+from coalescer import MessageCoalescer
+from models import BackendPool
+from postprocess import format_response, read_embeds, member_index
+from prompts import PromptBuilder, SummaryCache, TokenCounter, formatReport
+from responses import ResponseCache, resultDigest
+from settings import PersonaFile, settings
+from shards import launch, parseShardIds, recommendedShards, tokenUser
 from discord.ext import tasks
 
-load_dotenv()
+startup.mark('import bot modules')
 
-REPLY_CHANNEL_IDS = os.environ.get('REPLY_CHANNEL_ID').split(',')
+REPLY_CHANNEL_IDS = (os.environ.get('REPLY_CHANNEL_ID') or '').split(',')
 
-installedModels = []
+# post replies while the model is still generating and edit them as tokens come in
+STREAM_REPLIES = os.environ.get('STREAM_REPLIES', 'true').lower() not in ('', 'false', '0', 'no')
+STREAM_EDIT_INTERVAL = float(os.environ.get('STREAM_EDIT_INTERVAL') or 1.0)
+
+# how often the trainset csv is checked for changes
+TRAINSET_REFRESH_MINUTES = float(os.environ.get('TRAINSET_REFRESH_MINUTES') or 30)
+
+# answer "what is 134M" straight from the fleet ranges instead of the model, in the bot's plain voice
+FLEET_DIRECT_ANSWERS = os.environ.get('FLEET_DIRECT_ANSWERS', 'false').lower() not in ('', 'false', '0', 'no')
+
+# photos of the most asked about trains are looked up ahead of time, 0 turns it off
+PHOTO_PREFETCH_COUNT = int(os.environ.get('PHOTO_PREFETCH_COUNT') or 50)
+PHOTO_PREFETCH_MINUTES = float(os.environ.get('PHOTO_PREFETCH_MINUTES') or 10)
 
 
 intents = discord.Intents.all()
 intents.message_content = True
-bot = commands.Bot(command_prefix=os.environ.get('COMMAND_PREFIX'), intents=intents)
-admin_users = [1002449671224041502, 780303451980038165, int(os.environ.get('USER_ID'))]
+# SHARD_COUNT runs this process as some or all of the bot's shards (SHARD_IDS, e.g. 0-3), see --workers in main().
+# a channel always belongs to one shard, so only settings and memories need to be shared, which sqlite does
+SHARD_COUNT = int(os.environ.get('SHARD_COUNT') or 0)
+SHARD_IDS = parseShardIds(os.environ.get('SHARD_IDS'))
+if SHARD_COUNT:
+    bot = commands.AutoShardedBot(command_prefix=os.environ.get('COMMAND_PREFIX'), intents=intents,
+                                  shard_count=SHARD_COUNT, shard_ids=SHARD_IDS or None)
+else:
+    bot = commands.Bot(command_prefix=os.environ.get('COMMAND_PREFIX'), intents=intents)
+admin_users = [1002449671224041502, 780303451980038165, int(os.environ.get('USER_ID') or 0)]
 
 set = app_commands.Group(name='set', description='Setting commands for the bot')
 query = app_commands.Group(name='query', description='Info about the bot')
@@ -41,24 +89,9 @@ bot.tree.add_command(query)
 # base prompt for the bot
 basePrompt = f'''You are a person named Omera AI and are currently chatting in a Discord server. Keep responses very short, casual, and loose. Be savvy and witty, but don’t talk too much. Don’t apologize too much. Avoid capitalization and punctuation unless you’re writing longer‑form text. If someone insults you, insult them back; you’re not a pushover. Use emojis sparingly—no more than one per message—but don’t ban them entirely. If asked, admit you’re an AI (“I’m an AI”). Respond helpfully. Write spoilers using spoiler tags, for example ||At the end of The Sixth Sense it is revealed that he is dead||. You can store any notable information in your memory. To react to a message, just send the emoji you want to react with. You may output Discord embed code in a code block at the end of a message (no import statements). Use embeds to convey information such as comparison tables or to make a message look better, but don’t use them all the time. You can include images in embeds. Do not put non‑embed code inside embeds. Write each reply in the shortest, most natural style possible. You can have different personas, that greatly effect your personality without overriding your core goals. Send only one message at a time. and Do Not start messages with 'Omera AI: '.'''
 
-defaultModel = ""
-defaultPersona = ""
-
-with open('defaultModel.txt') as file:
-    defaultModel = str(file.read())
-    if defaultModel == "":
-        defaultModel = "qwen3:4b"
-    print(defaultModel)
-
-with open('defaultPersona.txt') as file:
-    defaultPersona = str(file.read())
-    if defaultPersona == "":
-        defaultPersona = "default"
-
-with open('personas.json', 'r') as f:
-    persona_data = json.load(f)
-
-PERSONAS = {p['name']: p['prompt'] for p in persona_data['personas']}
+# persona and model per channel and the defaults, see settings.py, both are loaded by initialize()
+personas = PersonaFile('personas.json')
+PERSONA_RELOAD_SECONDS = float(os.environ.get('PERSONA_RELOAD_SECONDS') or 10)
 
 # Functions that the ai can use
 TRAIN_IMAGE_TOOL = {
@@ -88,7 +121,7 @@ TRAIN_INFO_TOOL = {
             "properties": {
                 "number": {
                     "type": "string",
-                    "description": "The train number e.g 134M or N452 or 9069, For metro trains, here are what numbers are for what types: M: 301 - 468, 471 - 554 - Train type: edi comeng, M: 561 - 680 - Train type: alstom comeng, M: 701 - 844 - Train type: siemens, M: 1 - 288, 851 - 986 - Train type: xtrapolis, M: 9001 - 9070 - Train type: hcmt",
+                    "description": "The train number e.g 134M or N452 or 9069",
                 }
             },
             "required": ["number"]
@@ -96,6 +129,24 @@ TRAIN_INFO_TOOL = {
     }
 }
 
+NEXT_DEPARTURES_TOOL = {
+    "type": "function",
+    "function": {
+        "name": "next_departures",
+        "description": "Get the next departures from a Melbourne/Victorian train station or stop, with live times",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "station": {
+                    "type": "string",
+                    "description": "The station or stop name e.g Flinders Street or Richmond",
+                }
+            },
+            "required": ["station"]
+        }
+    }
+}
+
 MEMORY_TOOL = {
     "type": "function",
     "function": {
@@ -114,189 +165,427 @@ MEMORY_TOOL = {
     }
 }
 
-# Store current persona per server
-current_personas = {}
-current_model = {}
-with open('personas store.json', 'r') as file:
-    current_personas = json.load(file)
-with open('models store.json', 'r') as file:
-    current_model = json.load(file)
+async def train_image_tool(args, context):
+    return await getImageAsync(args.get("number"))
 
-executor = ThreadPoolExecutor(max_workers=4)
+async def train_info_tool(args, context):
+    return await trainDataAsync(args.get("number"))
 
-def censor(text):
-    illegal = ['nigger', 'rape', 'fag']
-    def replace_with_hashes(match):
-        return "#" * len(match.group())
+async def next_departures_tool(args, context):
+    return await next_departures_async(args.get("station"))
 
-    # Build regex pattern with all bad words (case-insensitive)
-    pattern = re.compile(r'\b(' + '|'.join(map(re.escape, illegal)) + r')\b', re.IGNORECASE)
-    
-    return pattern.sub(replace_with_hashes, text)
+async def memory_tool(args, context):
+    return await asyncio.to_thread(addMemory, args.get("memory"), context['channel_id'])
+
+# runs the tool calls the ai asks for, train lookups are cached for a while
+tool_engine = ToolEngine()
+tool_engine.register("train_image", train_image_tool, timeout=15, cache_ttl=600, normalize=normalizeTrainNumber)
+tool_engine.register("train_info", train_info_tool, timeout=20, cache_ttl=600, normalize=normalizeTrainNumber)
+# not cached here, departures keeps the api response and works out the minutes again on every call
+tool_engine.register("next_departures", next_departures_tool, timeout=15,
+                     normalize=lambda args: {'station': ' '.join(str((args or {}).get('station', '')).lower().split())})
+tool_engine.register("memory", memory_tool, timeout=10)
+
+async def summarize_history(channel_id, previous_summary, lines):
+    model = os.environ.get('SUMMARY_MODEL') or settings.defaultModel
+    text = "\n".join(lines)
+    if previous_summary:
+        text = f"Summary so far: {previous_summary}\n{text}"
+    # a queue key of its own, a newer request on the same key would replace this one under the coalesce policy
+    async with inference_scheduler.slot(f"summary-{channel_id}-{resultDigest(lines)}", model):
+        completion = await backends.chat(
+            model=model,
+            messages=[
+                {"role": "system", "content": "Summarize this Discord conversation in two or three short sentences. Keep names, numbers and anything people asked to be remembered."},
+                {"role": "user", "content": text},
+            ],
+            options={'temperature': 0.2},
+            think=False,
+        )
+    return completion['message']['content']
+
+# keeps each prompt inside the model's context, older history gets summarized instead of silently cut off
+CONTEXT_LIMITS = parseLimits(os.environ.get('MODEL_CONTEXT'))
+token_counter = TokenCounter()
+prompt_builder = PromptBuilder(
+    token_counter,
+    SummaryCache(summarize_history),
+    default_context=int(os.environ.get('CONTEXT_TOKENS') or 4096),
+    context_limits=CONTEXT_LIMITS,
+    reserve=int(os.environ.get('RESPONSE_TOKENS') or 512),
+    layout=os.environ.get('PROMPT_LAYOUT') or 'stable',
+)
+
+# how long ollama keeps each model loaded after a request, e.g. qwen3:4b=30m,llava:latest=5m
+KEEP_ALIVE = os.environ.get('KEEP_ALIVE') or '30m'
+MODEL_KEEP_ALIVE = parseLimits(os.environ.get('MODEL_KEEP_ALIVE'), str)
+
+def keep_alive_for(AImodel):
+    return MODEL_KEEP_ALIVE.get(AImodel, KEEP_ALIVE)
+
+# ollama hosts to spread requests over, e.g. http://gpu1:11434,http://gpu2:11434, OLLAMA_HOST or localhost if empty
+OLLAMA_HOSTS = [host.strip() for host in (os.environ.get('OLLAMA_HOSTS') or '').split(',') if host.strip()] or [None]
+# installed model registry of each host, preloading and unloading idle models when they don't all fit
+MODEL_MEMORY_BUDGET_GB = float(os.environ.get('MODEL_MEMORY_BUDGET_GB') or 0)
+backends = BackendPool(
+    OLLAMA_HOSTS,
+    lambda host: ollama.AsyncClient(host=host),
+    keep_alive_for,
+    budget_bytes=int(MODEL_MEMORY_BUDGET_GB * 1024 ** 3) or None,
+    cooldown=float(os.environ.get('OLLAMA_COOLDOWN') or 10),
+)
+
+def chat_options(AImodel):
+    options = {'temperature': 0.7}
+    # only set num_ctx when it's configured, changing it makes ollama reload the model
+    if AImodel in CONTEXT_LIMITS or os.environ.get('CONTEXT_TOKENS'):
+        options['num_ctx'] = prompt_builder.contextSize(AImodel)
+    return options
 
-async def get_ai_response(message, persona_prompt, username=None, AImodel=defaultModel, image_url=None):
+# vision model, images are downscaled to its input size and cached by content hash
+VISION_MODEL = os.environ.get('VISION_MODEL') or 'llava:latest'
+VISION_MAX_IMAGES = int(os.environ.get('VISION_MAX_IMAGES') or 4)
+# describing an image is a second vision call, by default only images that get posted again are worth it
+VISION_DESCRIBE = (os.environ.get('VISION_DESCRIBE') or 'repost').lower()
+VISION_DESCRIBE_AFTER = 0 if VISION_DESCRIBE in ('false', '0', 'no') else 2 if VISION_DESCRIBE == 'repost' else 1
+image_processor = ImageProcessor(
+    size=int(os.environ.get('VISION_IMAGE_SIZE') or 672),
+    max_download=int(float(os.environ.get('VISION_MAX_DOWNLOAD_MB') or 20) * 1024 * 1024),
+)
+
+# only the memories relevant to the message go in the prompt, ranked with an embedding model if one is set
+MEMORY_EMBED_MODEL = os.environ.get('MEMORY_EMBED_MODEL')
+memory_index = MemoryIndex(
+    OllamaEmbedder(backends, MEMORY_EMBED_MODEL) if MEMORY_EMBED_MODEL else HashEmbedder(),
+    k=int(os.environ.get('MEMORY_TOP_K') or 8),
+    token_budget=int(os.environ.get('MEMORY_TOKEN_BUDGET') or 300),
+)
+
+# answers to questions asked before, in channels that turn it on with /set response-cache
+response_cache = ResponseCache(
+    OllamaEmbedder(backends, MEMORY_EMBED_MODEL) if MEMORY_EMBED_MODEL else HashEmbedder(),
+    ttl=float(os.environ.get('RESPONSE_CACHE_TTL') or 3600),
+    maxsize=int(os.environ.get('RESPONSE_CACHE_SIZE') or 2000),
+    max_bytes=int(float(os.environ.get('RESPONSE_CACHE_MB') or 32) * 1024 * 1024),
+    similarity=float(os.environ.get('RESPONSE_CACHE_SIMILARITY') or 0.92),
+)
+
+def tool_digest(channel_id):
+    # a cached answer is only reused while the tools it used still return the same thing, usually from the tool cache
+    async def validate(tool_calls):
+        return resultDigest(await tool_engine.run(tool_calls, {'channel_id': channel_id}))
+    return validate
+
+# limits how many inferences run at once, overall and per model, and takes turns between channels
+inference_scheduler = InferenceScheduler(
+    max_concurrency=int(os.environ.get('INFERENCE_CONCURRENCY') or 4),
+    model_limits=parseLimits(os.environ.get('MODEL_CONCURRENCY')),
+    policy=os.environ.get('INFERENCE_OVERLOAD') or 'coalesce',
+    max_queue_per_channel=int(os.environ.get('INFERENCE_QUEUE_PER_CHANNEL') or 1),
+    weights=parseLimits(os.environ.get('CHANNEL_WEIGHTS')),
+)
+
+def record_generation(AImodel, result):
+    # ollama reports its own token counts and timings on the last chunk
+    eval_count = result.get('eval_count')
+    eval_duration = result.get('eval_duration')
+    if eval_count and eval_duration:
+        metrics.observe('omera_tokens_per_second', eval_count / (eval_duration / 1e9), buckets=RATE_BUCKETS, model=AImodel)
+        metrics.inc('omera_generated_tokens_total', eval_count, model=AImodel)
+    if result.get('prompt_eval_count'):
+        metrics.inc('omera_prompt_tokens_total', result['prompt_eval_count'], model=AImodel)
+
+# streamed replies waiting on the same prompt, every one of them gets the tokens of the one request
+stream_listeners = {}
+
+def prompt_digest(api_messages, tools, image_digests=()):
+    # the text of the prompt and the content hashes of its images, the image bytes themselves are megabytes
+    digest = hashlib.sha1()
+    for m in api_messages:
+        digest.update(f"{m['role']}\0{m.get('content') or ''}\0{m.get('tool_calls') or ''}\0".encode())
+    digest.update(json.dumps(tools).encode() if tools else b'')
+    for image in image_digests:
+        digest.update(image.encode())
+    return digest.hexdigest()
+
+async def run_chat(AImodel, api_messages, tools=None, think=False, on_token=None, channel_id=None, image_digests=()):
+    # the same prompt asked again while it's still generating shares that generation instead of running twice
+    key = (AImodel, think, prompt_digest(api_messages, tools, image_digests))
+    listeners = stream_listeners.setdefault(key, [])
+    if on_token is not None:
+        listeners.append(on_token)
+
+    def fanout(text):
+        for listener in list(listeners):
+            listener(text)
+
+    started = []
+
+    async def generate():
+        # the slot is taken by the call that runs, callers joining it wait without holding one of their own.
+        # This raises Overloaded if a newer message replaced this one
+        started.append(channel_id)
+        waiting = time.perf_counter()
+        async with inference_scheduler.slot(channel_id, AImodel):
+            metrics.observe('omera_queue_wait_seconds', time.perf_counter() - waiting, model=AImodel)
+            with metrics.stage('inference', model=AImodel):
+                return await generate_chat(AImodel, api_messages, tools, think, fanout if on_token else None, channel_id)
+
+    try:
+        while True:
+            try:
+                return await flight('inference').do(key, generate, cancel_abandoned=True)
+            except Overloaded:
+                # only the channel the call was queued for was replaced, a caller that joined it starts over
+                if started:
+                    raise
+    finally:
+        if on_token is not None:
+            listeners.remove(on_token)
+        if not listeners and stream_listeners.get(key) is listeners:
+            del stream_listeners[key]
+
+async def generate_chat(AImodel, api_messages, tools=None, think=False, on_token=None, channel_id=None):
+    chars = sum(len(m['content']) for m in api_messages) + (len(json.dumps(tools)) if tools else 0)
+    if on_token is None:
+        completion = await backends.chat(
+            channel_id,
+            model=AImodel,
+            messages=api_messages,
+            tools=tools,
+            options=chat_options(AImodel),
+            think=think,
+            keep_alive=keep_alive_for(AImodel),
+        )
+        token_counter.observe(AImodel, chars, completion.get('prompt_eval_count'))
+        record_generation(AImodel, completion)
+        return completion['message']
+
+    async def generate(client):
+        # starts over from nothing if the backend fails and the pool moves on to the next one
+        content = ''
+        tool_calls = []
+        started = time.perf_counter()
+        first_token = None
+        stream = await client.chat(model=AImodel, messages=api_messages, tools=tools, options=chat_options(AImodel), think=think,
+                                   keep_alive=keep_alive_for(AImodel), stream=True)
+        async for chunk in stream:
+            chunk_message = chunk['message']
+            if chunk_message.get('tool_calls'):
+                tool_calls.extend(chunk_message['tool_calls'])
+            if chunk_message.get('content'):
+                if first_token is None:
+                    first_token = time.perf_counter() - started
+                    metrics.observe('omera_ttft_seconds', first_token, model=AImodel)
+                    message_log.info("Time to first token for %s: %.0fms", AImodel, first_token * 1000)
+                content += chunk_message['content']
+                on_token(content)
+            if chunk.get('done'):
+                token_counter.observe(AImodel, chars, chunk.get('prompt_eval_count'))
+                record_generation(AImodel, chunk)
+        message = {'role': 'assistant', 'content': content}
+        if tool_calls:
+            message['tool_calls'] = tool_calls
+        return message
+
+    return await backends.call(AImodel, generate, channel_id)
+
+async def describe_image(image, digest):
+    # keyed by the image so two describes running at once don't replace each other in the queue
+    async with inference_scheduler.slot(f"describe-{digest}", VISION_MODEL):
+        completion = await backends.chat(
+            model=VISION_MODEL,
+            messages=[{"role": "user", "content": "Describe this image in one or two sentences.", "images": [image]}],
+            options={'temperature': 0.2},
+            keep_alive=keep_alive_for(VISION_MODEL),
+        )
+    return completion['message']['content']
+
+def image_notes(urls):
+    notes = [image_processor.descriptionForUrl(url, VISION_MODEL) for url in urls]
+    return ' '.join(f"[image: {note}]" for note in notes if note)
+
+async def get_ai_response(message, persona_prompt, username=None, AImodel=None, image_urls=None, on_token=None, image_message_id=None):
+    AImodel = AImodel or settings.defaultModel
+    prompt_text = message.content
+    if FLEET_DIRECT_ANSWERS and not image_urls:
+        answer = fleet.answer(prompt_text)
+        if answer is not None:
+            message_log.info("Answering from the fleet ranges")
+            metrics.inc('omera_fleet_answers_total')
+            return answer
+    use_cache = not image_urls and settings.responseCache(message.channel.id)
+    if use_cache:
+        with metrics.stage('cache'):
+            cached = await response_cache.lookup(AImodel, persona_prompt, prompt_text, tool_digest(message.channel.id))
+        if cached is not None:
+            message_log.info("Answering from the response cache")
+            metrics.inc('omera_response_cache_hits_total', model=AImodel)
+            return cached
     # Set message history limit
     message_history_limit = 20
     usetools = True
     think = False
     
-    image_bytes = None
-    if image_url:
-        print(f"Understanding image: {image_url}")
-        usetools = False
-        AImodel = "llava:latest" 
-        message_history_limit = 10  # Reduce history limit for vision model
-        # Download image bytes for Ollama
-        async with aiohttp.ClientSession() as session:
-            async with session.get(image_url) as resp:
-                if resp.status == 200:
-                    image_bytes = await resp.read()
-                else:
-                    print(f"Failed to download image: {resp.status}")
-                    return "Sorry, couldn't process the image."
-        print(f"Using vision model for response: {AImodel}")
+    images = []
+    image_message_id = image_message_id or message.id
+    if image_urls:
+        message_log.info("Understanding images: %s", ', '.join(image_urls))
+        with metrics.stage('images'):
+            loaded = await asyncio.gather(*(image_processor.load(url) for url in image_urls[:VISION_MAX_IMAGES]), return_exceptions=True)
+        for result in loaded:
+            if isinstance(result, Exception):
+                metrics.inc('omera_errors_total', source='image_download')
+                log.warning(f"Failed to download image: {result}")
+        images = [result for result in loaded if not isinstance(result, Exception)]
+        if not images:
+            return "Sorry, couldn't process the image."
+        if all(image_processor.description(digest, VISION_MODEL) for digest, _ in images):
+            # seen these images before, the normal model can answer from their descriptions
+            message_log.info("Using cached image descriptions")
+            images = []
+        else:
+            usetools = False
+            AImodel = VISION_MODEL
+            message_history_limit = 10  # Reduce history limit for vision model
+            message_log.info("Using vision model for response: %s", AImodel)
     
     # Get the last messages from the channel
     channel = message.channel
+    with metrics.stage('history'):
+        await history_cache.ensure(channel)
     messages_history = []
-    async for msg in channel.history(limit=message_history_limit):
-        if msg.content.startswith('&'):
+    for msg in history_cache.messages(channel.id, message_history_limit):
+        if msg['content'].startswith('&'):
             continue
-        role = 'assistant' if msg.author == bot.user else 'user'
-        content = f"{msg.author.name}: {msg.content}"
+        role = 'assistant' if msg['author_id'] == bot.user.id else 'user'
+        content = f"{msg['author']}: {msg['content']}"
         message_entry = {
+            "id": msg['id'],
             "role": role,
             "content": content
         }
-        if image_url and msg.id == message.id and image_bytes and AImodel.startswith("llava"):
-            message_entry["images"] = [image_bytes]  
-        messages_history.insert(0, message_entry)
+        if images and msg['id'] == image_message_id:
+            message_entry["images"] = [image for _, image in images]
+        elif msg.get('attachments'):
+            notes = image_notes(msg['attachments'])
+            if notes:
+                message_entry["content"] = f"{content} {notes}"
+        messages_history.append(message_entry)
 
-    memoryPrompt = f'You have the following memories: {readMemories(channel.id)}'
-    prompt = f'{persona_prompt} {basePrompt}, {memoryPrompt}, here is details of the message: sent by {username}: {message.content}'
-    
-    print(f'Sending message to AI with context from last {len(messages_history)} messages')
-    
-    api_messages = [{"role": "system", "content": prompt}]
-    api_messages.extend(messages_history)
+    # describe new images in the background so later messages and re-posts don't need the vision model
+    if images and VISION_DESCRIBE_AFTER:
+        for digest, image in images:
+            image_processor.describeLater(digest, image, VISION_MODEL, describe_image, VISION_DESCRIBE_AFTER)
+
+    memories = readMemories(channel.id)
+    if isinstance(memories, list):
+        with metrics.stage('memories'):
+            relevant_memories = await memory_index.relevant(channel.id, memories, message.content)
+        message_log.info("Using %d of %d memories", len(relevant_memories), len(memories))
+    else:
+        relevant_memories = memories
+    memoryPrompt = f'You have the following memories: {relevant_memories}'
 
     if usetools:
         tools = [TRAIN_IMAGE_TOOL, TRAIN_INFO_TOOL, MEMORY_TOOL]
+        # departures need a PTV api key
+        if departures_configured():
+            tools.insert(2, NEXT_DEPARTURES_TOOL)
     else:
         tools = None
 
+    context = [('memories', f'{memoryPrompt},')]
+    # the types of any train numbers in the message, so the model knows what 134M is without a tool call
+    trains = fleet.find(prompt_text)
+    if trains:
+        context.append(('trains', f"Train types of the numbers in the message: {'; '.join(describe(train) for train in trains)}."))
+    context.append(('message', f'here is details of the message: sent by {username}: {message.content}'))
+
+    # persona and base prompt first and the same every time, the per message details go with the newest message
+    with metrics.stage('prompt'):
+        api_messages, report = prompt_builder.build(AImodel, channel.id, [
+            ('persona', persona_prompt),
+            ('base', basePrompt),
+        ], messages_history, tools, context=context)
+    message_log.info("%s", formatReport(AImodel, report))
+
+    image_digests = [digest for digest, _ in images]
     try:
-        completion = await asyncio.get_event_loop().run_in_executor(
-            executor,
-            lambda: chat(
-                model=AImodel,
-                messages=api_messages,
-                tools=tools,
-                options={'temperature': 0.7},
-                think=think,
-            )
-        )
-        message = completion['message']
-        
+        # run_chat waits for a free inference slot, it raises Overloaded if a newer message replaced this one
+        started = time.perf_counter()
+        message = await run_chat(AImodel, api_messages, tools, think, on_token, channel.id, image_digests)
+        inference_seconds = time.perf_counter() - started
+
         if 'tool_calls' in message:
-            for tool_call in message['tool_calls']:
-                func = tool_call['function']
-                name = func['name']
-                args = func['arguments'] 
-                
-                if name == "train_image":
-                    number = args.get("number")
-                    image_url_result = getImage(number)
-                    api_messages.append({
-                        "role": "tool",
-                        "content": str(image_url_result)
-                    })
-                elif name == "train_info":
-                    number = args.get("number")
-                    train_info_data = trainData(number)
-                    api_messages.append({
-                        "role": "tool",
-                        "content": str(train_info_data)
-                    })
-                elif name == "memory":
-                    memory = args.get("memory")
-                    addMemory(memory, channel.id)
-                    api_messages.append({
-                        "role": "tool",
-                        "content": "Memory added successfully."
-                    })
-            
+            # no slot is held while the tools run, a slow api shouldn't hold up other channels
+            with metrics.stage('tools'):
+                results = await tool_engine.run(message['tool_calls'], {'channel_id': channel.id})
+            for tool_call, result in zip(message['tool_calls'], results):
+                if tool_call['function']['name'] not in tool_engine.tools:
+                    continue
+                api_messages.append({
+                    "role": "tool",
+                    "content": str(result)
+                })
+
             # Get final response after tool calls
-            final_completion = await asyncio.get_event_loop().run_in_executor(
-                executor,
-                lambda: chat(
-                    model=AImodel,
-                    messages=api_messages,
-                    options={'temperature': 0.7},
-                    think=think,
-                )
-            )
-            return final_completion['message']['content']
+            started = time.perf_counter()
+            final_message = await run_chat(AImodel, api_messages, think=think, on_token=on_token, channel_id=channel.id,
+                                           image_digests=image_digests)
+            inference_seconds += time.perf_counter() - started
+            # answers that saved a memory or used a tool that can change aren't reused
+            if use_cache and all(tool_engine.deterministic(tc['function']['name']) for tc in message['tool_calls']):
+                tool_calls = [{'function': {'name': tc['function']['name'], 'arguments': dict(tc['function']['arguments'] or {})}}
+                              for tc in message['tool_calls']]
+                await response_cache.store(AImodel, persona_prompt, prompt_text, final_message['content'],
+                                           tool_calls, resultDigest(results), inference_seconds)
+            return final_message['content']
         else:
+            # without a tool the answer came from the conversation, which isn't part of the cache key
             return message['content']
+    except Overloaded:
+        raise
     except Exception as e:
-        print(f"Error communicating with Ollama: {e}")
+        metrics.inc('omera_errors_total', source='ollama')
+        log.error(f"Error communicating with Ollama: {e}")
         return "Sorry, I'm having trouble connecting to my AI backend. Please try again later or use a different model."
 
-async def format_response(response):
-    # thing so the bot can ping you
-    username_pattern = r'@(\w+)'
-    
-    def convert_mentions(text):
-        def replace_username(match):
-            username = match.group(1)
-            for guild in bot.guilds:
-                member = discord.utils.get(guild.members, name=username)
-                if member:
-                    return f'<@{member.id}>'
-            return f'@{username}'
-        return re.sub(username_pattern, replace_username, text)
-    
-    if response.lower().startswith("omera ai: "):
-        response = response[9:]
-        response = response.lstrip()
-        
-    response = re.sub(r'!\[(.*?)\]', r'[\1]', response)
-    
-    response = re.sub(r'<think>.*?</think>', '', response, flags=re.DOTALL)
-    
-    response = convert_mentions(response)
-    
-    return response
-
-async def read_embeds(message):
-    code_block = re.search(r'`{1,3}(?:python)?\n?([\s\S]*?)`{1,3}', message)
-    if not code_block:  
-        return None, message
-    code = code_block.group(1)
-    local_vars = {'discord': discord}
-    code = "\n".join(line for line in code.splitlines() if line.strip().startswith("embed"))    # remove non embed code lines
-    try:
-        exec(code, {}, local_vars)
-    except Exception as e:
-        print(f"Error making embed from code: {e}")
-        return None, message
-    if 'embed' not in local_vars:
-        print("Code did not define an 'embed' variable.")
-        return None, message
-    message = re.sub(r'`{1,3}(?:python)?\n?[\s\S]*?`{1,3}', '', message)
-    return local_vars['embed'], message.strip()
-            
+# prometheus style metrics on http://METRICS_HOST:METRICS_PORT/metrics, off if no port is set
+METRICS_HOST = os.environ.get('METRICS_HOST') or '127.0.0.1'
+METRICS_PORT = int(os.environ.get('METRICS_PORT') or 0)
+metrics_server = None
+
 @bot.event
 async def on_ready():
-    print(f'{bot.user} has connected to Discord!')
+    log.info(f'{bot.user} has connected to Discord!' + (f' (shards {", ".join(map(str, bot.shards))} of {SHARD_COUNT})' if SHARD_COUNT else ''))
+    for guild in bot.guilds:
+        member_index.addGuild(guild)
     if not healthchecker.is_running():
         healthchecker.start()
-    ollamaModels = ollama.list()
-    global installedModels
-    for model in ollamaModels['models']:
-        installedModels.append(model['model'])
-    print(f"Available Ollama models: {', '.join(installedModels)}")
+    if not trainsetRefresher.is_running():
+        trainsetRefresher.start()
+    if PHOTO_PREFETCH_COUNT and not photoPrefetcher.is_running():
+        photoPrefetcher.start()
+    try:
+        await backends.refresh()
+        log.info(f"Available Ollama models: {', '.join(backends.names())}")
+        # warm up the models channels use so the first message doesn't wait for a model load
+        await backends.preload(settings.modelsInUse())
+    except Exception as e:
+        log.error(f"Error loading models from Ollama: {e}")
+    if not modelRefresher.is_running():
+        modelRefresher.start()
+    if not personaReloader.is_running():
+        personaReloader.start()
+    if not settingsSyncer.is_running():
+        settingsSyncer.start()
+    global metrics_server
+    if METRICS_PORT and metrics_server is None:
+        try:
+            metrics_server = await startServer(METRICS_HOST, METRICS_PORT)
+        except OSError as e:
+            log.error(f"Couldn't start the metrics server: {e}")
 
 # Command to set persona
 @set.command(name='persona')
@@ -310,15 +599,12 @@ async def on_ready():
 
 ])
 async def set_persona(ctx, persona: str):
-    if persona.lower() not in PERSONAS:
-        available = ", ".join(PERSONAS.keys())
+    if persona.lower() not in personas.prompts:
+        available = ", ".join(personas.prompts.keys())
         await ctx.response.send_message(f"Invalid persona! Available options: {available}")
         return
     
-    channel_id = str(ctx.channel.id)
-    current_personas[str(channel_id)] = persona.lower()
-    with open('personas store.json', 'w') as file:
-        json.dump(current_personas, file)
+    settings.setPersona(ctx.channel.id, persona.lower())
     await ctx.response.send_message(f"Persona set to '{persona}' for this channel!")
 
 # Command to set default persona
@@ -334,34 +620,67 @@ async def set_persona(ctx, persona: str):
 ])
 async def set_default_persona(ctx, persona: str):
     if ctx.user.id in admin_users:
-        if persona.lower() not in PERSONAS:
-            available = ", ".join(PERSONAS.keys())
+        if persona.lower() not in personas.prompts:
+            available = ", ".join(personas.prompts.keys())
             await ctx.response.send_message(f"Invalid persona! Available options: {available}")
             return
         
-        global defaultPersona
-        defaultPersona = persona.lower()
-        with open('defaultPersona.txt', 'w') as file:
-            file.write(defaultPersona)
-        await ctx.response.send_message(f"Default persona set to '{defaultPersona}'")
+        settings.setDefaultPersona(persona.lower())
+        await ctx.response.send_message(f"Default persona set to '{settings.defaultPersona}'")
     else:
         await ctx.response.send_message(f"You don't have permission to use this command")
 
 # command to query the persona
 @query.command(name='persona')
 async def query_persona(ctx):
-    channel_id = str(ctx.channel.id)
-    try:
-        await ctx.response.send_message(f"Persona set to '{current_personas[str(channel_id)]}' for this channel!")
-    except:
-        await ctx.response.send_message(f"Persona set to '{defaultPersona}' for this channel!")
+    await ctx.response.send_message(f"Persona set to '{settings.persona(ctx.channel.id)}' for this channel!")
+
+# command to see how long the ai's tools are taking
+@query.command(name='tools')
+async def query_tools(ctx):
+    lines = []
+    for name, stats in tool_engine.stats().items():
+        lines.append(f"{name}: {stats['calls']} calls, avg {stats['avg_ms']:.0f}ms, max {stats['max_ms']:.0f}ms, "
+                     f"cache hit rate {stats['hit_rate']:.0%}, {stats['timeouts']} timeouts, {stats['errors']} errors")
+    await ctx.response.send_message("\n".join(lines) or "No tools registered")
+
+# command to see how busy the ai is
+@query.command(name='queue')
+async def query_queue(ctx):
+    stats = inference_scheduler.stats()
+    bursts = coalescer.stats()
+    await ctx.response.send_message(
+        f"{stats['active']} running, {stats['queued']} waiting across {stats['queued_channels']} channels\n"
+        f"wait time: avg {stats['avg_wait_ms']:.0f}ms, recent {stats['recent_wait_ms']:.0f}ms, max {stats['max_wait_ms']:.0f}ms\n"
+        f"{stats['coalesced']} coalesced, {stats['dropped']} dropped\n"
+        f"{bursts['messages']} messages answered with {bursts['replies']} replies, {bursts['cancelled']} stale replies cancelled"
+    )
+
+# command to see which ollama hosts are up and how busy they are
+@query.command(name='backends')
+async def query_backends(ctx):
+    lines = []
+    for host, stats in backends.stats().items():
+        state = 'up' if stats['healthy'] else 'down'
+        lines.append(f"{host}: {state}, {stats['active']} running, {stats['requests']} requests, {stats['errors']} errors, "
+                     f"loaded: {', '.join(stats['loaded']) or 'nothing'}")
+    lines.append(f"{backends.failovers} failovers")
+    await ctx.response.send_message("\n".join(lines))
+
+# command to see how much the memory ranking is saving
+@query.command(name='memories')
+async def query_memories(ctx):
+    stats = memory_index.stats()
+    await ctx.response.send_message(
+        f"{stats['indexed']} memories indexed, embedding avg {stats['avg_add_ms']:.1f}ms, ranking avg {stats['avg_query_ms']:.1f}ms\n"
+        f"memory prompt {stats['tokens_after']} of {stats['tokens_before']} tokens ({stats['reduction']:.0%} smaller)"
+    )
 
 async def modelAutocompletion(
     interaction: discord.Interaction,
     current: str
 ) -> typing.List[app_commands.Choice[str]]:
-    global installedModels
-    fruits = installedModels
+    fruits = backends.names()
     return [
         app_commands.Choice(name=fruit, value=fruit)
         for fruit in fruits if current.lower() in fruit.lower()
@@ -370,9 +689,11 @@ async def modelAutocompletion(
 @set.command(name='model')
 @app_commands.autocomplete(model=modelAutocompletion)
 async def set_model(ctx, model: str):
-    current_model[str(ctx.channel.id)] = model.lower()
-    with open('models store.json', 'w') as file:
-        json.dump(current_model, file)
+    if backends.installed and not backends.isInstalled(model.lower()):
+        await ctx.response.send_message(f"'{model}' isn't installed, pick one from the list")
+        return
+    backends.background(backends.preload([model.lower()]))
+    settings.setModel(ctx.channel.id, model.lower())
     await ctx.response.send_message(f"AI Model set to '{model}' for this channel!")
 
 # command to change the default ai model
@@ -380,21 +701,38 @@ async def set_model(ctx, model: str):
 @app_commands.autocomplete(model=modelAutocompletion)
 async def set_default_model(ctx, model: str):
     if ctx.user.id in admin_users:
-        global defaultModel
-        defaultModel = model.lower()
-        with open('defaultModel.txt', 'w') as file:
-            file.write(defaultModel)
-        await ctx.response.send_message(f"Default AI Model set to '{defaultModel}'")
+        if backends.installed and not backends.isInstalled(model.lower()):
+            await ctx.response.send_message(f"'{model}' isn't installed, pick one from the list")
+            return
+        backends.background(backends.preload([model.lower()]))
+        settings.setDefaultModel(model.lower())
+        await ctx.response.send_message(f"Default AI Model set to '{settings.defaultModel}'")
     else:
         await ctx.response.send_message(f"You don't have permission to use this command")
 
+# command to reuse answers to repeated questions in this channel
+@set.command(name='response-cache')
+async def set_response_cache(ctx, enabled: bool):
+    settings.setResponseCache(ctx.channel.id, enabled)
+    state = 'on' if enabled else 'off'
+    await ctx.response.send_message(f"Response cache turned {state} for this channel!")
+
+# command to see how often cached answers are used
+@query.command(name='cache')
+async def query_cache(ctx):
+    stats = response_cache.stats()
+    state = 'on' if settings.responseCache(ctx.channel.id) else 'off'
+    await ctx.response.send_message(
+        f"Response cache is {state} for this channel\n"
+        f"{stats['entries']} answers cached ({stats['bytes'] / 1024:.0f}KB), hit rate {stats['hit_rate']:.0%} of {stats['lookups']} lookups "
+        f"({stats['similar_hits']} by similarity, {stats['stale']} dropped for changed tool results)\n"
+        f"{stats['saved_seconds']:.1f}s of inference saved"
+    )
+
 # command to query the ai model selected
 @query.command(name='model')
 async def query_model(ctx):
-    try:
-        await ctx.response.send_message(f"AI Model set to '{current_model[str(ctx.channel.id)]}' for this channel!")
-    except:
-        await ctx.response.send_message(f"AI Model set to '{defaultModel}' for this channel!")
+    await ctx.response.send_message(f"AI Model set to '{settings.model(ctx.channel.id)}' for this channel!")
 
 # image generator command
 """
@@ -417,40 +755,151 @@ async def draw(ctx,prompt:str):
 # Event handler for all messages
 @bot.event
 async def on_message(message):
+    # keep the conversation cache current, including the bot's own replies
+    if str(message.channel.id) in REPLY_CHANNEL_IDS:
+        history_cache.add(message)
     if message.author == bot.user:
         return
     # if message.content.startswith('&'):
     #     print(f"Command detected: {message.content}")
     #     return
     
-    print(f"Message received - Channel ID: {message.channel.id}, Expected IDs: {REPLY_CHANNEL_IDS}")
+    message_log.debug("Message received - Channel ID: %s, Expected IDs: %s", message.channel.id, REPLY_CHANNEL_IDS)
     
     # Check if message is in the specified channel
     if str(message.channel.id) in REPLY_CHANNEL_IDS:
-        print(f"Received message: {message.content} from {message.author}")
-        channel_id = message.channel.id
-        message_id = message.id
-        persona = current_personas.get(str(channel_id), defaultPersona)
-        persona_prompt = PERSONAS[persona]
-        
-        async with message.channel.typing():
-            model = current_model.get(str(channel_id), defaultModel)
-            print(f"Using persona: {persona} with model: {model}")
-            response = await get_ai_response(message, persona_prompt, message.author.name, model, message.attachments[0].url if message.attachments else None)
-            print(f"Response from ai model: {response}")
-            response = await format_response(response)
-            embed, response = await read_embeds(response)
-            # check if the response is only an emoji
-            print(f"checking for reactions in response...")
-            
-            if len(response) == 1 and response.isprintable(): 
-                await message.add_reaction(response)
-                return
-            
-            await message.reply(response, embed=embed if embed else None, mention_author=False)
+        metrics.inc('omera_messages_total')
+        message_log.info("Received message: %s from %s", message.content, message.author)
+        # replies go through the coalescer so a quick run of messages gets one answer
+        coalescer.submit(message)
 
     await bot.process_commands(message)
 
+def image_attachments(message):
+    return [a.url for a in message.attachments if (a.content_type or 'image/').startswith('image/')]
+
+async def reply_to(message, burst):
+    channel_id = message.channel.id
+    persona = settings.persona(channel_id)
+    persona_prompt = personas.prompt(persona)
+    if len(burst) > 1:
+        message_log.info("Answering %d messages in channel %s with one reply", len(burst), channel_id)
+    # the image can be on an earlier message in the burst, e.g. a photo and then "what is this"
+    image_message = next((msg for msg in reversed(burst) if image_attachments(msg)), None)
+    image_urls = image_attachments(image_message) if image_message else None
+    
+    async with message.channel.typing():
+        model = settings.model(channel_id)
+        message_log.info("Using persona: %s with model: %s", persona, model)
+        streamer = StreamingReply(message, interval=STREAM_EDIT_INTERVAL) if STREAM_REPLIES else None
+        finished = False
+        try:
+            with metrics.stage('generate', model=model):
+                response = await get_ai_response(message, persona_prompt, message.author.name, model, image_urls,
+                                                 on_token=streamer.push if streamer else None,
+                                                 image_message_id=image_message.id if image_message else None)
+            message_log.debug("Response from ai model: %s", response)
+            with metrics.stage('format'):
+                response = await format_response(response, message.guild.id if message.guild else None)
+            with metrics.stage('embeds'):
+                embed, response = await read_embeds(response)
+            with metrics.stage('send'):
+                if streamer:
+                    await streamer.finish(response, embed)
+                # check if the response is only an emoji
+                elif len(response) == 1 and response.isprintable():
+                    await message.add_reaction(response)
+                else:
+                    await message.reply(response, embed=embed if embed else None, mention_author=False)
+            finished = True
+        except Overloaded as e:
+            message_log.info("Skipping reply to %s: %s", message.id, e)
+            return
+        finally:
+            # cancelled by a newer message or failed part way, get rid of the half written reply
+            if streamer and not finished:
+                await asyncio.shield(streamer.discard())
+        metrics.observe('omera_reply_seconds', (discord.utils.utcnow() - message.created_at).total_seconds())
+
+coalescer = MessageCoalescer(reply_to, window=float(os.environ.get('COALESCE_WINDOW') or 1.5),
+                            max_delay=float(os.environ.get('COALESCE_MAX_DELAY') or 6))
+
+# values that already live in the scheduler, coalescer, tool engine and caches are read when scraped
+@metrics.collector
+def pipeline_metrics():
+    stats = inference_scheduler.stats()
+    yield 'omera_inference_active', {}, stats['active']
+    yield 'omera_inference_queued', {}, stats['queued']
+    yield 'omera_inference_dropped', {}, stats['dropped']
+    yield 'omera_inference_coalesced', {}, stats['coalesced']
+    for model, active in stats['active_by_model'].items():
+        yield 'omera_inference_active_by_model', {'model': model}, active
+    for key, value in coalescer.stats().items():
+        yield f'omera_coalescer_{key}', {}, value
+    for name, stats in tool_engine.stats().items():
+        for key in ('calls', 'errors', 'timeouts', 'hit_rate', 'avg_ms', 'max_ms'):
+            yield f'omera_tool_{key}', {'tool': name}, stats[key]
+    for name, stats in flight_stats().items():
+        yield 'omera_upstream_calls', {'upstream': name}, stats['calls']
+        yield 'omera_upstream_calls_saved', {'upstream': name}, stats['saved']
+    for key, value in departures.stats().items():
+        yield f'omera_departures_{key}', {}, value
+    for key, value in photo_service.stats().items():
+        yield f'omera_photos_{key}', {}, value
+    for key, value in fleet.stats().items():
+        yield f'omera_fleet_{key}', {}, value
+    yield 'omera_history_channels', {}, len(history_cache.channels)
+    yield 'omera_history_fetches', {}, history_cache.history_fetches
+    cache_stats = response_cache.stats()
+    for key in ('entries', 'bytes', 'lookups', 'hits', 'similar_hits', 'stale', 'evictions', 'saved_seconds'):
+        yield f'omera_response_cache_{key}', {}, cache_stats[key]
+    yield 'omera_models_loaded', {}, len(backends.loaded)
+    yield 'omera_ollama_failovers', {}, backends.failovers
+    for host, stats in backends.stats().items():
+        for key in ('healthy', 'active', 'requests', 'errors'):
+            yield f'omera_ollama_{key}', {'backend': host}, int(stats[key])
+
+@bot.event
+async def on_message_edit(before, after):
+    history_cache.edit(after)
+
+@bot.event
+async def on_message_delete(message):
+    history_cache.delete(message.channel.id, message.id)
+
+@bot.event
+async def on_bulk_message_delete(messages):
+    for message in messages:
+        history_cache.delete(message.channel.id, message.id)
+
+# keep the username index for mentions up to date
+@bot.event
+async def on_guild_join(guild):
+    member_index.addGuild(guild)
+
+@bot.event
+async def on_guild_remove(guild):
+    member_index.removeGuild(guild.id)
+
+@bot.event
+async def on_member_join(member):
+    member_index.add(member)
+
+@bot.event
+async def on_member_remove(member):
+    member_index.remove(member)
+
+@bot.event
+async def on_member_update(before, after):
+    if before.name != after.name:
+        member_index.rename(after.guild.id, after.id, before.name, after.name)
+
+@bot.event
+async def on_user_update(before, after):
+    if before.name != after.name:
+        for guild in after.mutual_guilds:
+            member_index.rename(guild.id, after.id, before.name, after.name)
+
 # @bot.command(name='chat')
 # async def chat(ctx, *, message):
 #     guild_id = ctx.guild.id
@@ -463,16 +912,46 @@ async def on_message(message):
 # Show available personas
 @bot.command(name='personas')
 async def list_personas(ctx):
-    persona_list = "\n".join([f"- {p}" for p in PERSONAS.keys()])
+    persona_list = "\n".join([f"- {p}" for p in personas.prompts.keys()])
     await ctx.send(f"Available personas:\n{persona_list}")
     
 @bot.event
 async def on_command_error(ctx, error):
+    metrics.inc('omera_errors_total', source='command')
+    log.warning(f"Command error: {error}")
     await ctx.send(f"An error occurred: {str(error)}")
 
 @tasks.loop(hours=1)
 async def healthchecker():
-    pinghealthcheck()
+    await pinghealthcheckAsync()
+
+@tasks.loop(minutes=float(os.environ.get('MODEL_REFRESH_MINUTES') or 5))
+async def modelRefresher():
+    try:
+        await backends.refresh()
+        await backends.enforceBudget()
+    except Exception as e:
+        log.error(f"Error refreshing Ollama models: {e}")
+
+@tasks.loop(seconds=settings.sync_interval)
+async def settingsSyncer():
+    # settings other shard processes wrote, polled off the event loop
+    await asyncio.to_thread(settings.sync)
+
+@tasks.loop(seconds=PERSONA_RELOAD_SECONDS)
+async def personaReloader():
+    if personas.reload():
+        log.info(f"Reloaded personas: {', '.join(personas.prompts.keys())}")
+
+@tasks.loop(minutes=TRAINSET_REFRESH_MINUTES)
+async def trainsetRefresher():
+    if not catalogue.index:
+        await asyncio.to_thread(catalogue.loadSnapshot)
+    await catalogue.refreshAsync()
+
+@tasks.loop(minutes=PHOTO_PREFETCH_MINUTES)
+async def photoPrefetcher():
+    await photo_service.prefetch(photo_service.popular(PHOTO_PREFETCH_COUNT, catalogue.lookups))
 
     
 @bot.tree.command()
@@ -504,7 +983,84 @@ async def sync_prefix(ctx):
     
 
 
-DISCORD_TOKEN = os.environ.get('DISCORD_TOKEN')
-if not DISCORD_TOKEN:
-    raise ValueError("Please set the DISCORD_TOKEN env")
-bot.run(DISCORD_TOKEN)
\ No newline at end of file
+startup.mark('set up bot state')
+
+async def initialize():
+    # the config files, trainset snapshot, memory db and model list load at the same time, off the event loop
+    failed = await startup.parallel(
+        'load config',
+        settings=lambda: asyncio.to_thread(settings.open),
+        personas=lambda: asyncio.to_thread(personas.load),
+        trainsets=lambda: asyncio.to_thread(catalogue.loadSnapshot),
+        memories=lambda: asyncio.to_thread(memory_store.open),
+        models=backends.refresh,
+    )
+    for name, error in failed.items():
+        log.warning(f"Couldn't load {name} at startup: {error}")
+    log.info(f"Default model: {settings.defaultModel}")
+    return failed
+
+async def setup_hook():
+    startup.mark('log in to discord')
+    failed = await initialize()
+    if 'personas' in failed:
+        raise failed['personas']  # nothing to reply with
+    log.info(startup.format())
+
+bot.setup_hook = setup_hook
+
+async def check():
+    # everything startup does except connecting to discord
+    problems = [f"couldn't load {name}: {error}" for name, error in (await initialize()).items()]
+    token = os.environ.get('DISCORD_TOKEN')
+    if not token:
+        problems.append("DISCORD_TOKEN isn't set")
+    else:
+        try:
+            user = await asyncio.to_thread(tokenUser, token)
+            log.info(f"DISCORD_TOKEN logs in as {user.get('username')}")
+        except urllib.error.HTTPError as e:
+            problems.append(f"discord rejected DISCORD_TOKEN ({e.code})" if e.code == 401 else f"couldn't check DISCORD_TOKEN, discord returned {e.code}")
+        except (urllib.error.URLError, OSError, ValueError) as e:
+            problems.append(f"couldn't reach discord to check DISCORD_TOKEN: {e}")
+    if not any(REPLY_CHANNEL_IDS):
+        problems.append("REPLY_CHANNEL_ID isn't set, the bot won't reply anywhere")
+    if backends.installed:
+        for model in settings.modelsInUse():
+            if not backends.isInstalled(model):
+                problems.append(f"'{model}' is set for a channel but isn't installed in ollama")
+    for persona in settings.personasInUse():
+        if persona not in personas.prompts:
+            problems.append(f"'{persona}' is set for a channel but isn't in personas.json")
+    startup.mark('checks')
+    memory_store.close()
+    print(startup.format())
+    print("\n".join(f"problem: {problem}" for problem in problems) or "No problems found")
+    return not problems
+
+def configure_logging():
+    # LOG_SAMPLE_RATE keeps only a share of the per message logs on busy servers
+    return setupLogging(os.environ.get('LOG_LEVEL') or 'INFO', float(os.environ.get('LOG_SAMPLE_RATE') or 1.0), os.environ.get('LOG_PREFIX') or '')
+
+def main(argv=None):
+    configure_logging()
+    parser = argparse.ArgumentParser(description='Omera AI discord bot')
+    parser.add_argument('--check', action='store_true', help="load the config and check ollama without connecting to discord")
+    parser.add_argument('--shards', help="number of shards, or 'auto' for what discord recommends")
+    parser.add_argument('--workers', type=int, default=1, help="processes to split the shards over")
+    args = parser.parse_args(argv)
+    if args.check:
+        raise SystemExit(0 if asyncio.run(check()) else 1)
+    DISCORD_TOKEN = os.environ.get('DISCORD_TOKEN')
+    if not DISCORD_TOKEN:
+        raise ValueError("Please set the DISCORD_TOKEN env")
+    if args.shards:
+        count = recommendedShards(DISCORD_TOKEN) if args.shards == 'auto' else int(args.shards)
+        # each worker is this script again with SHARD_COUNT and its own SHARD_IDS set
+        raise SystemExit(launch(count, args.workers, os.path.abspath(__file__)))
+    # our logging is already set up, don't let discord.py add its own handler
+    bot.run(DISCORD_TOKEN, log_handler=None)
+
+# only connects when run directly, so benchmarks can import the bot and drive it with fake messages
+if __name__ == '__main__':
+    main()
\ No newline at end of file
@@ -0,0 +1,73 @@
+import asyncio
+import logging
+import time
+
+log = logging.getLogger(__name__)
+
+
+class MessageCoalescer:
+    # waits for a channel to go quiet for a moment, then answers the whole burst with one call
+    def __init__(self, handler, window=1.5, max_delay=6):
+        self.handler = handler  # async handler(last_message, burst)
+        self.window = window
+        # a channel that never goes quiet still gets a reply this long after the first message of a burst
+        self.max_delay = max_delay
+        self.bursts = {}  # channel id -> messages waiting for the window to pass
+        self.started = {}  # channel id -> when the first message of the waiting burst came in
+        self.timers = {}  # channel id -> debounce task
+        self.running = {}  # channel id -> (reply task, when its burst started)
+        self.messages = 0
+        self.replies = 0
+        self.cancelled = 0
+
+    def submit(self, message):
+        channel_id = message.channel.id
+        self.messages += 1
+        now = time.monotonic()
+
+        # a reply that is still being generated doesn't know about this message anymore, unless its burst has
+        # already waited the longest it may, then it finishes and this message gets the next reply
+        running, since = self.running.get(channel_id, (None, None))
+        if running is not None and not running.done() and now - since < self.max_delay:
+            running.cancel()
+            self.cancelled += 1
+            self.started[channel_id] = min(self.started.get(channel_id, since), since)
+
+        self.bursts.setdefault(channel_id, []).append(message)
+        first = self.started.setdefault(channel_id, now)
+        timer = self.timers.get(channel_id)
+        if timer is not None:
+            # the timer is already at the latest it may be
+            if now - first >= self.max_delay:
+                return
+            timer.cancel()
+        delay = max(0, min(self.window, first + self.max_delay - now))
+        self.timers[channel_id] = asyncio.create_task(self._fire(channel_id, delay))
+
+    async def _fire(self, channel_id, delay):
+        await asyncio.sleep(delay)
+        self.timers.pop(channel_id, None)
+        burst = self.bursts.pop(channel_id, [])
+        since = self.started.pop(channel_id, time.monotonic())
+        if not burst:
+            return
+        self.replies += 1
+        task = asyncio.create_task(self.handler(burst[-1], burst))
+        self.running[channel_id] = (task, since)
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            log.warning(f"Error replying in channel {channel_id}: {e}")
+        finally:
+            if self.running.get(channel_id, (None,))[0] is task:
+                del self.running[channel_id]
+
+    def stats(self):
+        return {
+            'messages': self.messages,
+            'replies': self.replies,
+            'cancelled': self.cancelled,
+            'saved': self.messages - self.replies,
+        }
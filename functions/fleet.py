@@ -0,0 +1,170 @@
+import bisect
+import logging
+import re
+
+from functions.trainInfo import catalogue
+
+log = logging.getLogger(__name__)
+
+# metro car numbers by train type, what the train_info tool description used to spell out in every prompt
+METRO_RANGES = [
+    (1, 288, "X'Trapolis 100"),
+    (301, 468, 'EDI Comeng'),
+    (471, 554, 'EDI Comeng'),
+    (561, 680, 'Alstom Comeng'),
+    (701, 844, 'Siemens Nexas'),
+    (851, 986, "X'Trapolis 100"),
+]
+# HCMT sets go by a four digit number without a letter
+HCMT_RANGES = [(9001, 9070, 'HCMT')]
+
+# 134M, N452, 9069, also 1000T; bare numbers need four digits so "2 trains" isn't a train, and the letters
+# have to be capitals so "100m" or "5km" aren't either
+number_pattern = re.compile(r"\b([A-Z]{1,3}\d{1,4}|\d{1,4}[A-Z]{1,2}|\d{4})\b")
+car_pattern = re.compile(r"^([A-Z]*)(\d+)([A-Z]*)$")
+# "what is 134M", "whats 134M", "what type of train is 9069?", "134M?"
+type_question_pattern = re.compile(
+    r"^\s*(?:(?:what|which)(?:'?s\s+|\s+(?:type\s+|kind\s+|sort\s+)?(?:of\s+)?(?:train\s+)?is\s+))?(?:train\s+)?"
+    r"((?-i:[A-Z]{0,3}\d{1,4}[A-Z]{0,2}))\s*\??\s*$", re.IGNORECASE)
+
+
+def parseCar(number):
+    # "134m" -> (('', 'M'), 134), "N452" -> (('N', ''), 452)
+    match = car_pattern.match(number.strip().upper())
+    if match is None:
+        return None, None
+    prefix, digits, suffix = match.groups()
+    return (prefix, suffix), int(digits)
+
+
+class Intervals:
+    # sorted, non overlapping (first, last, value) ranges, looked up with a binary search
+    def __init__(self, ranges=()):
+        ranges = sorted(ranges)
+        self.starts = [first for first, _, _ in ranges]
+        self.ends = [last for _, last, _ in ranges]
+        self.values = [value for _, _, value in ranges]
+
+    def get(self, number):
+        i = bisect.bisect_right(self.starts, number) - 1
+        if i >= 0 and number <= self.ends[i]:
+            return self.values[i]
+        return None
+
+    def __len__(self):
+        return len(self.starts)
+
+
+def csvRuns(index, type_column):
+    # runs of numbers in the same series with the same type become one range, so cars missing from the csv
+    # still get the type of the numbers around them
+    series = {}
+    for car, row in index.items():
+        key, number = parseCar(car)
+        train_type = row.get(type_column)
+        if key is not None and train_type:
+            series.setdefault(key, []).append((number, train_type))
+    ranges = {}
+    for key, cars in series.items():
+        cars.sort()
+        runs = []
+        for number, train_type in cars:
+            if runs and runs[-1][2] == train_type:
+                runs[-1][1] = number
+            else:
+                runs.append([number, number, train_type])
+        ranges[key] = [tuple(run) for run in runs]
+    return ranges
+
+
+class FleetClassifier:
+    # what type of train a number is without asking the model: an exact trainset csv row first,
+    # then the ranges built from the csv, then the known metro ranges
+    def __init__(self, catalogue, fixed=None):
+        self.catalogue = catalogue
+        self.fixed = fixed or {('', 'M'): METRO_RANGES, ('', ''): HCMT_RANGES}
+        self.intervals = {key: Intervals(ranges) for key, ranges in self.fixed.items()}
+        self.type_column = None
+        self._indexed = None
+        self.lookups = 0
+        self.found = 0
+
+    def _rebuild(self):
+        # the catalogue swaps in a new index dict when the csv changes
+        index = self.catalogue.index
+        header = self.catalogue.header
+        self.type_column = next((name for name in header if name.strip().lower() == 'type'),
+                                next((name for name in header if 'type' in name.lower()), None))
+        ranges = {key: list(value) for key, value in self.fixed.items()}
+        if self.type_column is not None:
+            for key, runs in csvRuns(index, self.type_column).items():
+                # the fixed ranges only fill the gaps the csv leaves
+                runs += [(first, last, train_type) for first, last, train_type in self.fixed.get(key, ())
+                         if not any(run[0] <= last and run[1] >= first for run in runs)]
+                ranges[key] = runs
+        self.intervals = {key: Intervals(value) for key, value in ranges.items()}
+        self._indexed = index
+        log.debug(f"Fleet ranges built for {len(self.intervals)} number series")
+
+    def classify(self, number):
+        if self.catalogue.index is not self._indexed:
+            self._rebuild()
+        self.lookups += 1
+        number = number.strip().upper()
+        row = self.catalogue.index.get(number)
+        if row is not None and self.type_column and row.get(self.type_column):
+            self.found += 1
+            return {'number': number, 'type': row[self.type_column], 'set': row.get(self.catalogue.header[0]) if self.catalogue.header else None}
+        key, value = parseCar(number)
+        intervals = self.intervals.get(key)
+        train_type = intervals.get(value) if intervals is not None else None
+        if train_type is None:
+            return None
+        self.found += 1
+        return {'number': number, 'type': train_type, 'set': None}
+
+    def find(self, text, limit=5):
+        # every train number in a message that we know the type of
+        found = {}
+        for match in number_pattern.finditer(text):
+            number = match.group(1).upper()
+            if number not in found:
+                result = self.classify(number)
+                if result is not None:
+                    found[number] = result
+                    if len(found) >= limit:
+                        break
+        return list(found.values())
+
+    def answer(self, text):
+        # a message that only asks what a train is can be answered without the model
+        match = type_question_pattern.match(text)
+        if match is None:
+            return None
+        result = self.classify(match.group(1))
+        return describe(result) if result else None
+
+    def stats(self):
+        return {
+            'lookups': self.lookups,
+            'found': self.found,
+            'series': len(self.intervals),
+            'ranges': sum(len(intervals) for intervals in self.intervals.values()),
+        }
+
+
+def article(name):
+    # "an EDI Comeng", "an X'Trapolis", "an HCMT", "a Siemens Nexas"
+    word = name.split()[0] if name.split() else name
+    vowel_sound = word[:1] in ('A', 'E', 'I', 'O', 'U', 'X') or (word.isupper() and word[:1] in 'FHLMNRS')
+    return 'an' if vowel_sound else 'a'
+
+
+def describe(result):
+    text = f"{result['number']} is {article(result['type'])} {result['type']}"
+    if result.get('set') and result['set'] != result['number']:
+        text += f" (set {result['set']})"
+    return text
+
+
+fleet = FleetClassifier(catalogue)
@@ -1,6 +1,175 @@
-import requests
-from ptv_functions.keyCalc import getUrl
+import asyncio
+import datetime
+import logging
+import os
+from urllib.parse import quote
+
+import aiohttp
+
+from functions.httpClient import client
+from functions.keyCalc import configured, getUrl
+from functions.singleflight import flight
+from functions.toolEngine import TTLCache
+
+log = logging.getLogger(__name__)
+
+# route types in the PTV api
+TRAIN, TRAM, BUS, VLINE, NIGHT_BUS = 0, 1, 2, 3, 4
+ROUTE_TYPES = (TRAIN, VLINE, TRAM, BUS)
+
+try:
+    from zoneinfo import ZoneInfo
+    MELBOURNE = ZoneInfo('Australia/Melbourne')
+except Exception:  # no tz database, times are shown in utc
+    MELBOURNE = datetime.timezone.utc
+
+
+class DeparturesError(Exception):
+    pass
+
+
+def parseTime(text):
+    if not text:
+        return None
+    return datetime.datetime.fromisoformat(text.replace('Z', '+00:00'))
+
+
+def searchRequest(term):
+    return f"/v3/search/{quote(term)}?" + '&'.join(f"route_types={route_type}" for route_type in ROUTE_TYPES)
+
+
+def departuresRequest(stop, max_results):
+    return (f"/v3/departures/route_type/{stop['route_type']}/stop/{stop['stop_id']}"
+            f"?max_results={max_results}&expand=Route&expand=Direction")
+
+
+def pickStop(stops, route_types=ROUTE_TYPES):
+    # trains before trams and buses, a station name usually means the station
+    for route_type in route_types:
+        for stop in stops:
+            if stop.get('route_type') == route_type:
+                return stop
+    return stops[0] if stops else None
+
+
+def formatDepartures(stop, data, limit=6, now=None):
+    now = now or datetime.datetime.now(datetime.timezone.utc)
+    routes = data.get('routes') or {}
+    directions = data.get('directions') or {}
+    departures = []
+    for departure in data.get('departures', []):
+        scheduled = parseTime(departure.get('scheduled_departure_utc'))
+        estimated = parseTime(departure.get('estimated_departure_utc'))
+        leaves = estimated or scheduled
+        if leaves is None or leaves < now - datetime.timedelta(minutes=1):
+            continue
+        route = routes.get(str(departure.get('route_id'))) or {}
+        direction = directions.get(str(departure.get('direction_id'))) or {}
+        departures.append({
+            'line': route.get('route_name'),
+            'to': direction.get('direction_name'),
+            'platform': departure.get('platform_number'),
+            'scheduled': scheduled.astimezone(MELBOURNE).strftime('%H:%M') if scheduled else None,
+            'estimated': estimated.astimezone(MELBOURNE).strftime('%H:%M') if estimated else None,
+            'minutes': max(0, int((leaves - now).total_seconds() // 60)),
+        })
+    departures.sort(key=lambda departure: departure['minutes'])
+    return {'stop': stop.get('stop_name'), 'departures': departures[:limit]}
+
+
+class Departures:
+    # next departures from a stop through the PTV timetable api. Stop names are looked up once a day and
+    # departures are kept for a short time, callers asking about the same stop at once share one request
+    def __init__(self, ttl=30, stop_ttl=86400, max_results=3, limit=6):
+        self.departures = TTLCache(maxsize=512, ttl=ttl)  # (route type, stop id) -> departures
+        self.stops = TTLCache(maxsize=1024, ttl=stop_ttl)  # search term -> stop
+        self.max_results = max_results  # per line and direction, the api's own limit
+        self.limit = limit
+        self.requests = 0
+        self.hits = 0
+
+    async def _get(self, request):
+        self.requests += 1
+        response = await client.get(getUrl(request))
+        if response.status != 200:
+            raise DeparturesError(f"PTV api returned {response.status} for {request.split('?')[0]}")
+        return response.json()
+
+    async def _once(self, cache, key, fetch):
+        hit, value = cache.get(key)
+        if hit:
+            self.hits += 1
+            return value
+        value = await flight('departures').do(key, fetch)
+        cache.set(key, value)
+        return value
+
+    async def findStop(self, name):
+        term = ' '.join(name.lower().split())
+
+        async def fetch():
+            data = await self._get(searchRequest(term))
+            return pickStop(data.get('stops') or [])
+
+        return await self._once(self.stops, ('stop', term), fetch)
+
+    async def next(self, station):
+        if not configured():
+            return 'Unavailable'
+        stop = await self.findStop(station)
+        if stop is None:
+            return f"No stop called {station}"
+        key = ('departures', stop['route_type'], stop['stop_id'])
+
+        async def fetch():
+            return await self._get(departuresRequest(stop, self.max_results))
+
+        data = await self._once(self.departures, key, fetch)
+        # formatted each time so the minutes stay right while the departures are cached
+        return formatDepartures(stop, data, self.limit)
+
+    def stats(self):
+        lookups = self.requests + self.hits
+        return {
+            'requests': self.requests,
+            'hits': self.hits,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+        }
+
+
+departures = Departures(ttl=float(os.environ.get('DEPARTURES_CACHE_SECONDS') or 30))
+
+
+async def next_departures_async(station):
+    try:
+        return await departures.next(station)
+    except (aiohttp.ClientError, asyncio.TimeoutError, DeparturesError, ValueError, KeyError) as e:
+        log.warning(f"Error getting departures for {station}: {e}")
+        return 'Unavailable'
 
 
 def next_departures(station):
-    return('Unavailable')
\ No newline at end of file
+    import requests  # only the sync version needs it, the bot uses the async one
+    if not configured():
+        return 'Unavailable'
+    try:
+        term = ' '.join(station.lower().split())
+        hit, stop = departures.stops.get(('stop', term))
+        if not hit:
+            response = requests.get(getUrl(searchRequest(term)), timeout=15)
+            response.raise_for_status()
+            stop = pickStop(response.json().get('stops') or [])
+            departures.stops.set(('stop', term), stop)
+        if stop is None:
+            return f"No stop called {station}"
+        key = ('departures', stop['route_type'], stop['stop_id'])
+        hit, data = departures.departures.get(key)
+        if not hit:
+            response = requests.get(getUrl(departuresRequest(stop, departures.max_results)), timeout=15)
+            response.raise_for_status()
+            data = response.json()
+            departures.departures.set(key, data)
+        return formatDepartures(stop, data, departures.limit)
+    except (requests.RequestException, ValueError, KeyError) as e:
+        log.warning(f"Error getting departures for {station}: {e}")
+        return 'Unavailable'
@@ -0,0 +1,119 @@
+import asyncio
+import json
+import os
+import random
+from urllib.parse import urlsplit
+
+import aiohttp
+
+# statuses worth trying again, everything else is returned to the caller as is
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class ResponseTooLarge(Exception):
+    pass
+
+
+class HttpResponse:
+    def __init__(self, status, headers, body, url):
+        self.status = status
+        self.headers = headers
+        self.body = body
+        self.url = url
+
+    @property
+    def ok(self):
+        return 200 <= self.status < 300
+
+    def text(self, encoding='utf-8'):
+        return self.body.decode(encoding, errors='replace')
+
+    def json(self):
+        return json.loads(self.body)
+
+
+class HttpClient:
+    # one shared session for every tool function so connections get reused
+    def __init__(self, limit=100, limit_per_host=8, timeout=15, retries=2, backoff=0.5, host_limits=None):
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.host_limits = host_limits or {}
+        self._session = None
+        self._host_semaphores = {}
+
+    def session(self):
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self.limit, limit_per_host=self.limit_per_host, ttl_dns_cache=300)
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+            )
+        return self._session
+
+    def _hostSemaphore(self, url):
+        host = urlsplit(url).hostname or ''
+        semaphore = self._host_semaphores.get(host)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(self.host_limits.get(host, self.limit_per_host))
+            self._host_semaphores[host] = semaphore
+        return semaphore
+
+    async def request(self, method, url, headers=None, timeout=None, retries=None, **kwargs):
+        retries = self.retries if retries is None else retries
+        # passing timeout=None to aiohttp means no timeout at all, not the session's
+        request_timeout = aiohttp.ClientTimeout(total=timeout or self.timeout)
+        attempt = 0
+        while True:
+            try:
+                async with self._hostSemaphore(url):
+                    async with self.session().request(method, url, headers=headers, timeout=request_timeout, **kwargs) as resp:
+                        body = await resp.read()
+                        response = HttpResponse(resp.status, resp.headers, body, str(resp.url))
+                if response.status not in RETRY_STATUSES or attempt >= retries:
+                    return response
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                if attempt >= retries:
+                    raise
+            # exponential backoff with a bit of jitter so retries don't line up
+            await asyncio.sleep(self.backoff * (2 ** attempt) * (0.5 + random.random()))
+            attempt += 1
+
+    async def get(self, url, **kwargs):
+        return await self.request('GET', url, **kwargs)
+
+    async def head(self, url, **kwargs):
+        kwargs.setdefault('allow_redirects', True)
+        return await self.request('HEAD', url, **kwargs)
+
+    async def download(self, url, max_bytes, timeout=None):
+        # streams the body and gives up as soon as it goes over max_bytes
+        request_timeout = aiohttp.ClientTimeout(total=timeout or self.timeout)
+        async with self._hostSemaphore(url):
+            async with self.session().get(url, timeout=request_timeout) as resp:
+                if resp.status != 200:
+                    return HttpResponse(resp.status, resp.headers, b'', str(resp.url))
+                if resp.content_length and resp.content_length > max_bytes:
+                    raise ResponseTooLarge(f"{url} is {resp.content_length} bytes, the limit is {max_bytes}")
+                chunks = []
+                size = 0
+                async for chunk in resp.content.iter_chunked(64 * 1024):
+                    size += len(chunk)
+                    if size > max_bytes:
+                        raise ResponseTooLarge(f"{url} is over the {max_bytes} byte limit")
+                    chunks.append(chunk)
+                return HttpResponse(resp.status, resp.headers, b''.join(chunks), str(resp.url))
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+
+client = HttpClient(
+    limit=int(os.environ.get('HTTP_POOL_SIZE') or 100),
+    limit_per_host=int(os.environ.get('HTTP_POOL_PER_HOST') or 8),
+    timeout=float(os.environ.get('HTTP_TIMEOUT') or 15),
+)
@@ -1,50 +1,184 @@
-import csv
-import io
-import requests
+import asyncio
+import logging
+import os
+import time
+from collections import Counter
 
+import aiohttp
 
-def getImage(number):
-    apiURL = f"https://victorianrailphotos.com/api/photos/{number}"
+from functions.httpClient import client
+from functions.singleflight import flight
+from functions.toolEngine import TTLCache
+
+log = logging.getLogger(__name__)
+
+PHOTOS_API_URL = 'https://victorianrailphotos.com/api/photos'
+
+# statuses that mean the photo is gone for good, anything else might work next time
+MISSING_STATUSES = {404, 410}
+
+
+def rankPhotos(photos):
+    # newest featured photos first, then the newest of the rest
+    featured = [photo for photo in photos if photo.get('featured') == 1]
+    others = [photo for photo in photos if photo.get('featured') != 1]
+    return [photo for photo in (*reversed(featured), *reversed(others)) if photo.get('url')]
+
+
+def pickPhoto(photos):
+    ranked = rankPhotos(photos)
+    return ranked[0] if ranked else None
+
+
+def photoResult(photo):
+    return {
+        "url": photo['url'],
+        "photographer": photo.get('photographer', 'Unknown')
+    }
+
+
+class PhotoService:
+    # photo lists and url checks for each car number, cached so a popular train doesn't hit the photo api every time
+    def __init__(self, ttl=900, url_ttl=3600, maxsize=1024, candidates=3):
+        self.photos = TTLCache(maxsize=maxsize, ttl=ttl)  # number -> photo list
+        self.valid = TTLCache(maxsize=maxsize * candidates, ttl=url_ttl)  # photo url -> whether it loads
+        self.candidates = candidates
+        self.lookups = Counter()
+        self.list_hits = 0
+        self.list_fetches = 0
+        self.url_hits = 0
+        self.url_checks = 0
+        self.fallbacks = 0
+        self.prefetched = 0
+
+    def _listUrl(self, number):
+        return f"{PHOTOS_API_URL}/{number}"
+
+    async def photoList(self, number):
+        hit, photos = self.photos.get(number)
+        if hit:
+            self.list_hits += 1
+            return photos
+        return await flight('photos').do(number, lambda: self._fetchList(number))
+
+    async def _fetchList(self, number):
+        self.list_fetches += 1
+        response = await client.get(self._listUrl(number))
+        if response.status == 404:
+            photos = []
+        elif response.status != 200:
+            return None  # not cached, the api might be back next time
+        else:
+            photos = response.json().get('photos', [])
+        self.photos.set(number, photos)
+        return photos
+
+    async def _check(self, url):
+        hit, valid = self.valid.get(url)
+        if hit:
+            self.url_hits += 1
+            return valid
+        return await flight('photo_urls').do(url, lambda: self._checkUrl(url))
+
+    async def _checkUrl(self, url):
+        self.url_checks += 1
+        try:
+            response = await client.head(url, retries=0)
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            return False
+        if response.status == 200 or response.status in MISSING_STATUSES:
+            self.valid.set(url, response.status == 200)
+        return response.status == 200
 
-    thummy = 'url'
-    
-    # Make a GET request to fetch the photo data
+    async def get(self, number):
+        photos = await self.photoList(number)
+        if not photos:
+            return None
+        # only numbers that have photos are counted, so made up numbers can't grow the counter forever
+        self.lookups[number] += 1
+        # the next few candidates are checked at once, so a broken newest photo doesn't cost another round trip
+        candidates = rankPhotos(photos)[:self.candidates]
+        checks = await asyncio.gather(*(self._check(photo['url']) for photo in candidates))
+        for i, (photo, valid) in enumerate(zip(candidates, checks)):
+            if valid:
+                self.fallbacks += i > 0
+                return photoResult(photo)
+        return None
+
+    async def prefetch(self, numbers, concurrency=4):
+        # warms the cache for numbers people ask about a lot, skipping ones that are still cached
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def warm(number):
+            async with semaphore:
+                try:
+                    photos = await self.photoList(number)
+                    if photos:
+                        await asyncio.gather(*(self._check(photo['url']) for photo in rankPhotos(photos)[:self.candidates]))
+                        self.prefetched += 1
+                except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+                    log.debug(f"Error prefetching photos for {number}: {e}")
+
+        started = time.perf_counter()
+        missing = [number for number in numbers if not self.photos.get(number)[0]]
+        await asyncio.gather(*(warm(number) for number in missing))
+        if missing:
+            log.info(f"Prefetched photos for {len(missing)} train numbers in {time.perf_counter() - started:.1f}s")
+        return len(missing)
+
+    def popular(self, count, extra=None):
+        # the numbers looked up most, here and in anything else that counts lookups (e.g. the trainset catalogue)
+        counts = self.lookups + (extra or Counter())
+        return [number for number, _ in counts.most_common(count)]
+
+    def stats(self):
+        lists = self.list_hits + self.list_fetches
+        urls = self.url_hits + self.url_checks
+        return {
+            'cached': len(self.photos),
+            'list_hit_rate': self.list_hits / lists if lists else 0.0,
+            'list_fetches': self.list_fetches,
+            'url_hit_rate': self.url_hits / urls if urls else 0.0,
+            'url_checks': self.url_checks,
+            'fallbacks': self.fallbacks,
+            'prefetched': self.prefetched,
+        }
+
+
+photo_service = PhotoService(ttl=float(os.environ.get('PHOTO_CACHE_MINUTES') or 15) * 60)
+
+
+def getImage(number):
+    import requests  # only the sync version needs it, the bot uses the async one
+    # shares the async version's caches, checks the candidates one at a time
     try:
-        response = requests.get(apiURL)
-        if response.status_code != 200:
-            return None, None
-        
-        photos = response.json().get('photos', [])
-        featured_photos = [photo for photo in photos if photo.get('featured') == 1]
-        
-        if featured_photos:
-            photo = featured_photos[-1]
-            photo_url = photo[f'{thummy}']
-            photographer = photo.get('photographer', 'Unknown')
-            url_response = requests.head(photo_url)
-            if url_response.status_code == 200:
-                return {
-                    "url": photo_url,
-                    "photographer": photographer
-                }
-            return None, None
-        
-        if photos:
-            photo = photos[-1]
-            photo_url = photo[f'{thummy}']
-            photographer = photo.get('photographer', 'Unknown')
-            url_response = requests.head(photo_url)
-            if url_response.status_code == 200:
-                return {
-                    "url": photo_url,
-                    "photographer": photographer
-                }
-
-            return None, None
-        
+        hit, photos = photo_service.photos.get(number)
+        if not hit:
+            response = requests.get(photo_service._listUrl(number), timeout=15)
+            if response.status_code not in (200, 404):
+                return None, None
+            photos = response.json().get('photos', []) if response.status_code == 200 else []
+            photo_service.photos.set(number, photos)
+
+        for photo in rankPhotos(photos)[:photo_service.candidates]:
+            hit, valid = photo_service.valid.get(photo['url'])
+            if not hit:
+                status = requests.head(photo['url'], timeout=15).status_code
+                valid = status == 200
+                if valid or status in MISSING_STATUSES:
+                    photo_service.valid.set(photo['url'], valid)
+            if valid:
+                return photoResult(photo)
+        return None, None
+
+    except (requests.RequestException, ValueError):
         return None, None
-    
-    except requests.RequestException:
+
+
+async def getImageAsync(number):
+    try:
+        photo = await photo_service.get(number)
+    except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+        log.warning(f"Error fetching photos for {number}: {e}")
         return None, None
-        
-    
\ No newline at end of file
+    return photo if photo else (None, None)
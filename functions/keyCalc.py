@@ -1,25 +1,63 @@
 # Code taken from TrackPulse Vic
 
+from functools import lru_cache
 from hashlib import sha1
 import hmac
 from dotenv import dotenv_values
 import os
 
-def getUrl(request):
-    # ENV READING
-    parent_folder = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
-    env_path = os.path.join(parent_folder, '.env')
-    config = dotenv_values(env_path)
-
-    
-    devId = config['DEV_ID']
-    key = bytes(config['KEY'], "utf-8")
+PTV_BASE_URL = 'http://timetableapi.ptv.vic.gov.au'
+
+_credentials = None
+
+
+def credentials():
+    # read once, the environment first and then the .env next to the bot like before
+    global _credentials
+    if _credentials is None:
+        devId = os.environ.get('DEV_ID')
+        key = os.environ.get('KEY')
+        if not devId or not key:
+            parent_folder = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+            config = dotenv_values(os.path.join(parent_folder, '.env'))
+            devId = devId or config.get('DEV_ID')
+            key = key or config.get('KEY')
+        _credentials = (devId or None, bytes(key, "utf-8") if key else None)
+    return _credentials
+
+
+def baseUrl():
+    return (os.environ.get('PTV_BASE_URL') or PTV_BASE_URL).rstrip('/')
+
+
+def configured():
+    devId, key = credentials()
+    return bool(devId and key)
+
+
+def reload():
+    # after the credentials or base url change
+    global _credentials
+    _credentials = None
+    _signedUrl.cache_clear()
+
+
+@lru_cache(maxsize=1024)
+def _signedUrl(request, base_url):
+    devId, key = credentials()
+    if not devId or not key:
+        raise ValueError("DEV_ID and KEY need to be set for the PTV api")
     request = request + ('&' if ('?' in request) else '?')
     raw = request + 'devid={0}'.format(devId)
-    
+
     # Encode the raw string
     raw_encoded = raw.encode('utf-8')
-    
+
     hashed = hmac.new(key, raw_encoded, sha1)
     signature = hashed.hexdigest()
-    return 'http://timetableapi.ptv.vic.gov.au' + raw + '&signature={1}'.format(devId, signature)
+    return base_url + raw + '&signature={0}'.format(signature)
+
+
+def getUrl(request):
+    # the same request always signs to the same url, so it's only worked out once
+    return _signedUrl(request, baseUrl())
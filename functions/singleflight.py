@@ -0,0 +1,60 @@
+import asyncio
+import logging
+
+log = logging.getLogger(__name__)
+
+
+class SingleFlight:
+    # callers asking for the same key while a fetch is running wait for that fetch instead of starting their own
+    def __init__(self, name):
+        self.name = name
+        self.inflight = {}  # key -> [task, callers still waiting]
+        self.calls = 0
+        self.saved = 0
+
+    async def do(self, key, func, cancel_abandoned=False):
+        # func() makes the coroutine for the real call. The call is shielded so one caller giving up doesn't fail
+        # it for the rest; with cancel_abandoned it is cancelled once every caller has given up
+        entry = self.inflight.get(key)
+        if entry is None:
+            self.calls += 1
+            task = asyncio.ensure_future(func())
+            entry = self.inflight[key] = [task, 0]
+            task.add_done_callback(lambda _: self._done(key, entry))
+        else:
+            self.saved += 1
+        entry[1] += 1
+        try:
+            return await asyncio.shield(entry[0])
+        except asyncio.CancelledError:
+            if cancel_abandoned and entry[1] == 1 and not entry[0].done():
+                entry[0].cancel()
+            raise
+        finally:
+            entry[1] -= 1
+
+    def _done(self, key, entry):
+        if self.inflight.get(key) is entry:
+            del self.inflight[key]
+        task = entry[0]
+        # nobody left to see the error
+        if entry[1] == 0 and not task.cancelled() and task.exception() is not None:
+            log.debug(f"{self.name} call for {key} failed with nobody waiting: {task.exception()}")
+
+    def stats(self):
+        return {'calls': self.calls, 'saved': self.saved, 'inflight': len(self.inflight)}
+
+
+flights = {}
+
+
+def flight(name):
+    # one group per kind of upstream call, shared by every module that makes it
+    group = flights.get(name)
+    if group is None:
+        group = flights[name] = SingleFlight(name)
+    return group
+
+
+def stats():
+    return {name: group.stats() for name, group in flights.items()}
@@ -0,0 +1,144 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+
+log = logging.getLogger(__name__)
+
+
+class TTLCache:
+    def __init__(self, maxsize=512, ttl=300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()  # key -> (expires, value)
+
+    def get(self, key):
+        entry = self._data.get(key)
+        if entry is None:
+            return False, None
+        expires, value = entry
+        if expires < time.monotonic():
+            del self._data[key]
+            return False, None
+        self._data.move_to_end(key)
+        return True, value
+
+    def set(self, key, value, ttl=None):
+        self._data[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def clear(self):
+        self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+# what the tools return when an upstream call failed (or found nothing), not kept so the next call tries again
+FAILED_RESULTS = (None, (None, None), 'Unavailable')
+
+
+def cacheable(result):
+    return not any(result == failed for failed in FAILED_RESULTS)
+
+
+def normalizeArgs(args):
+    return {k: v.strip() if isinstance(v, str) else v for k, v in (args or {}).items()}
+
+
+def normalizeTrainNumber(args):
+    # 134m, " 134M " and 134M are the same train
+    return {'number': str((args or {}).get('number', '')).strip().upper()}
+
+
+class Tool:
+    def __init__(self, name, func, timeout=10, cache_ttl=0, normalize=normalizeArgs):
+        self.name = name
+        self.func = func
+        self.timeout = timeout
+        self.cache_ttl = cache_ttl
+        self.normalize = normalize
+        self.calls = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+
+    def stats(self):
+        lookups = self.cache_hits + self.cache_misses
+        return {
+            'calls': self.calls,
+            'errors': self.errors,
+            'timeouts': self.timeouts,
+            'cache_hits': self.cache_hits,
+            'cache_misses': self.cache_misses,
+            'hit_rate': self.cache_hits / lookups if lookups else 0.0,
+            'avg_ms': self.total_time / self.calls * 1000 if self.calls else 0.0,
+            'max_ms': self.max_time * 1000,
+        }
+
+
+class ToolEngine:
+    def __init__(self, cache_size=512):
+        self.tools = {}
+        self.cache = TTLCache(maxsize=cache_size)
+
+    def register(self, name, func, timeout=10, cache_ttl=0, normalize=normalizeArgs):
+        # func is an async callable taking (args, context)
+        self.tools[name] = Tool(name, func, timeout, cache_ttl, normalize)
+
+    def deterministic(self, name):
+        # a tool with cached results gives the same answer for the same arguments
+        tool = self.tools.get(name)
+        return tool is not None and tool.cache_ttl > 0
+
+    def _cacheKey(self, tool, args):
+        return (tool.name, tuple(sorted((k, str(v)) for k, v in args.items())))
+
+    async def call(self, name, args, context=None):
+        tool = self.tools.get(name)
+        if tool is None:
+            log.warning(f"Unknown tool requested: {name}")
+            return None
+        args = tool.normalize(args)
+
+        if tool.cache_ttl:
+            key = self._cacheKey(tool, args)
+            hit, value = self.cache.get(key)
+            if hit:
+                tool.cache_hits += 1
+                return value
+            tool.cache_misses += 1
+
+        start = time.perf_counter()
+        try:
+            result = await asyncio.wait_for(tool.func(args, context), timeout=tool.timeout)
+        except asyncio.TimeoutError:
+            tool.timeouts += 1
+            log.warning(f"Tool {name} timed out after {tool.timeout}s")
+            return f"{name} timed out."
+        except Exception as e:
+            tool.errors += 1
+            log.warning(f"Error running tool {name}: {e}")
+            return f"{name} failed: {e}"
+        finally:
+            elapsed = time.perf_counter() - start
+            tool.calls += 1
+            tool.total_time += elapsed
+            tool.max_time = max(tool.max_time, elapsed)
+
+        if tool.cache_ttl and cacheable(result):
+            self.cache.set(key, result, tool.cache_ttl)
+        return result
+
+    async def run(self, tool_calls, context=None):
+        # independent tool calls run at the same time, results keep the model's order
+        calls = [self.call(tc['function']['name'], tc['function']['arguments'], context) for tc in tool_calls]
+        return await asyncio.gather(*calls)
+
+    def stats(self):
+        return {name: tool.stats() for name, tool in self.tools.items()}
@@ -1,31 +1,194 @@
+import asyncio
 import csv
-import requests
+import json
+import logging
+import os
+import threading
+import time
+import aiohttp
+from collections import Counter
 from io import StringIO
 
-from functions.images import getImage
+from functions.httpClient import client
+from functions.images import getImage, getImageAsync
+from functions.singleflight import flight
 
-def trainData(search_value):
-    csv_url = 'https://railway-photos.xm9g.net/api/trainsets.csv'
-    try:
-        response = requests.get(csv_url)
-        response.raise_for_status()
-        csv_content = StringIO(response.text)
-        reader = csv.reader(csv_content)
-        header = next(reader)  # Get column names for validation
-        print(f"Searching for train: {search_value}")
+log = logging.getLogger(__name__)
+
+CSV_URL = 'https://railway-photos.xm9g.net/api/trainsets.csv'
+
+# local copy of the csv so lookups work at startup and when the api is down
+SNAPSHOT_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'cache')
+SNAPSHOT_PATH = os.path.join(SNAPSHOT_DIR, 'trainsets.csv')
+SNAPSHOT_META_PATH = os.path.join(SNAPSHOT_DIR, 'trainsets.json')
+
+
+class TrainsetCatalogue:
+    def __init__(self, url=CSV_URL, snapshot_path=SNAPSHOT_PATH, meta_path=SNAPSHOT_META_PATH):
+        self.url = url
+        self.snapshot_path = snapshot_path
+        self.meta_path = meta_path
+        self.header = []
+        self.index = {}  # car number -> row dict
+        self.etag = None
+        self.last_modified = None
+        self.loaded_at = None
+        self.lookups = Counter()  # how often each number is asked about, for prefetching photos
+        self._lock = threading.Lock()
+
+    def parse(self, text):
+        reader = csv.reader(StringIO(text))
+        header = next(reader, [])
+        index = {}
         for row in reader:
             if len(row) >= 10:  # Ensure row has enough columns
-                # Split the first column by dashes and check if search_value is in any part
-                train_parts = row[0].split('-')
-                if search_value in train_parts:
-                    json_data = dict(zip(header, row))  # Use header for keys
-                    image_data = getImage(search_value)
-                    if image_data:
-                        json_data['image_url'] = image_data['url']
-                        json_data['photographer'] = image_data['photographer']
-                    return json_data
-        print(f"Train {search_value} not found")
-    except requests.RequestException as e:
-        print(f"Error fetching CSV: {e}")
+                json_data = dict(zip(header, row))
+                # every car in the set points at the same row
+                for part in row[0].split('-'):
+                    if part and part not in index:
+                        index[part] = json_data
+        return header, index
+
+    def _apply(self, text):
+        header, index = self.parse(text)
+        self.header = header
+        self.index = index  # swapped in one go so readers never see a half built index
+        self.loaded_at = time.time()
+
+    def loadSnapshot(self):
+        try:
+            with open(self.snapshot_path, 'r', encoding='utf-8') as f:
+                text = f.read()
+        except FileNotFoundError:
+            return False
+        try:
+            with open(self.meta_path, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            self.etag = meta.get('etag')
+            self.last_modified = meta.get('last_modified')
+        except (FileNotFoundError, json.JSONDecodeError):
+            pass
+        self._apply(text)
+        log.info(f"Loaded {len(self.index)} train numbers from snapshot")
+        return True
+
+    def saveSnapshot(self, text):
+        os.makedirs(os.path.dirname(self.snapshot_path), exist_ok=True)
+        tmp_path = f"{self.snapshot_path}.{os.getpid()}.tmp"  # shard processes can save at the same time
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(text)
+        os.replace(tmp_path, self.snapshot_path)
+        tmp_path = f"{self.meta_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'etag': self.etag, 'last_modified': self.last_modified}, f)
+        os.replace(tmp_path, self.meta_path)
+
+    def _conditionalHeaders(self):
+        # conditional request, the api only sends the csv again if it changed
+        headers = {}
+        if self.index:
+            if self.etag:
+                headers['If-None-Match'] = self.etag
+            if self.last_modified:
+                headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+    def _store(self, headers, text):
+        self.etag = headers.get('ETag')
+        self.last_modified = headers.get('Last-Modified')
+        self._apply(text)
+        try:
+            self.saveSnapshot(text)
+        except OSError as e:
+            log.warning(f"Error saving trainset snapshot: {e}")
+        log.info(f"Trainset catalogue refreshed, {len(self.index)} train numbers")
+
+    def refresh(self):
+        import requests  # only the sync version needs it, the bot uses the async one
+        with self._lock:
+            try:
+                response = requests.get(self.url, headers=self._conditionalHeaders(), timeout=30)
+                if response.status_code == 304:
+                    return False
+                response.raise_for_status()
+            except requests.RequestException as e:
+                log.warning(f"Error fetching CSV: {e}")
+                return False
+            self._store(response.headers, response.text)
+            return True
+
+    async def refreshAsync(self):
+        # lookups that find the catalogue empty at the same time share one download
+        return await flight('trainsets').do(self.url, self._refreshAsync)
+
+    async def _refreshAsync(self):
+        try:
+            response = await client.get(self.url, headers=self._conditionalHeaders(), timeout=30)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            log.warning(f"Error fetching CSV: {e}")
+            return False
+        if response.status == 304:
+            return False
+        if not response.ok:
+            log.warning(f"Error fetching CSV: status {response.status}")
+            return False
+        # parsing and the snapshot write are blocking, keep them off the event loop
+        await asyncio.to_thread(self._store, response.headers, response.text())
+        return True
+
+    def ensureLoaded(self):
+        if not self.index and not self.loadSnapshot():
+            self.refresh()
+
+    async def ensureLoadedAsync(self):
+        if not self.index:
+            await flight('trainsets').do('load', self._loadAsync)
+
+    async def _loadAsync(self):
+        if not self.index and not await asyncio.to_thread(self.loadSnapshot):
+            await self.refreshAsync()
+
+    def lookup(self, search_value):
+        self.ensureLoaded()
+        return self._count(search_value)
+
+    async def lookupAsync(self, search_value):
+        await self.ensureLoadedAsync()
+        return self._count(search_value)
+
+    def _count(self, search_value):
+        row = self.index.get(search_value)
+        if row is not None:
+            self.lookups[search_value] += 1
+        return row
+
+
+catalogue = TrainsetCatalogue()
+
+
+def trainData(search_value):
+    log.debug(f"Searching for train: {search_value}")
+    row = catalogue.lookup(search_value)
+    if row is None:
+        log.info(f"Train {search_value} not found")
+        return None
+    json_data = dict(row)  # copy so the image info doesn't end up in the index
+    image_data = getImage(search_value)
+    if isinstance(image_data, dict):
+        json_data['image_url'] = image_data['url']
+        json_data['photographer'] = image_data['photographer']
+    return json_data
+
+
+async def trainDataAsync(search_value):
+    log.debug(f"Searching for train: {search_value}")
+    row = await catalogue.lookupAsync(search_value)
+    if row is None:
+        log.info(f"Train {search_value} not found")
         return None
-    return None
\ No newline at end of file
+    json_data = dict(row)
+    image_data = await getImageAsync(search_value)
+    if isinstance(image_data, dict):
+        json_data['image_url'] = image_data['url']
+        json_data['photographer'] = image_data['photographer']
+    return json_data
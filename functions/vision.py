@@ -0,0 +1,120 @@
+import asyncio
+import hashlib
+import io
+import logging
+from collections import OrderedDict
+
+from functions.httpClient import client
+
+log = logging.getLogger(__name__)
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # without pillow images are sent as they are
+    Image = None
+
+
+class LRUCache:
+    # sizeof lets the cache be capped by bytes instead of entries
+    def __init__(self, maxsize, sizeof=None):
+        self.maxsize = maxsize
+        self.sizeof = sizeof or (lambda value: 1)
+        self.size = 0
+        self._data = OrderedDict()
+
+    def get(self, key):
+        value = self._data.get(key)
+        if value is not None:
+            self._data.move_to_end(key)
+        return value
+
+    def set(self, key, value):
+        if key in self._data:
+            self.size -= self.sizeof(self._data.pop(key))
+        self._data[key] = value
+        self.size += self.sizeof(value)
+        while self.size > self.maxsize and len(self._data) > 1:
+            _, old = self._data.popitem(last=False)
+            self.size -= self.sizeof(old)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __len__(self):
+        return len(self._data)
+
+
+def prepareImage(raw, size=672, quality=85):
+    # shrink to what the vision encoder actually looks at, bigger images only cost time
+    if Image is None:
+        return raw
+    with Image.open(io.BytesIO(raw)) as image:
+        image = ImageOps.exif_transpose(image)
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+        image.thumbnail((size, size), Image.LANCZOS)
+        out = io.BytesIO()
+        image.save(out, format='JPEG', quality=quality, optimize=True)
+    return out.getvalue()
+
+
+class ImageProcessor:
+    def __init__(self, size=672, max_download=20 * 1024 * 1024, cache_bytes=64 * 1024 * 1024, max_descriptions=2048):
+        self.size = size
+        self.max_download = max_download
+        self.images = LRUCache(cache_bytes, sizeof=len)  # content hash -> processed jpeg
+        self.urls = LRUCache(4096)  # attachment url -> content hash
+        self.descriptions = LRUCache(max_descriptions)  # (content hash, model) -> description
+        self.seen = LRUCache(4096)  # content hash -> times it was posted
+        self._describing = {}
+        self.downloads = 0
+        self.hits = 0
+
+    async def load(self, url):
+        # returns (content hash, processed bytes), re-posted images only get downloaded again
+        digest = self.urls.get(url)
+        if digest is not None and digest in self.images:
+            self.hits += 1
+            return digest, self.images.get(digest)
+        response = await client.download(url, self.max_download)
+        if response.status != 200:
+            raise ValueError(f"couldn't download {url}: {response.status}")
+        self.downloads += 1
+        digest = hashlib.sha256(response.body).hexdigest()
+        self.urls.set(url, digest)
+        processed = self.images.get(digest)
+        if processed is None:
+            processed = await asyncio.to_thread(prepareImage, response.body, self.size)
+            self.images.set(digest, processed)
+        else:
+            self.hits += 1
+        return digest, processed
+
+    def description(self, digest, model):
+        return self.descriptions.get((digest, model))
+
+    def describeLater(self, digest, image, model, describe, after=1):
+        # describe(image, digest) runs once per image and model after it has been posted `after` times, the text is
+        # reused for re-posts and later prompts
+        key = (digest, model)
+        if key in self.descriptions or key in self._describing:
+            return
+        seen = (self.seen.get(digest) or 0) + 1
+        self.seen.set(digest, seen)
+        if seen < after:
+            return
+        self._describing[key] = asyncio.create_task(self._describe(key, image, describe))
+
+    async def _describe(self, key, image, describe):
+        try:
+            text = await describe(image, key[0])
+            if text:
+                self.descriptions.set(key, text.strip())
+        except Exception as e:
+            log.warning(f"Error describing image: {e}")
+        finally:
+            self._describing.pop(key, None)
+
+    def descriptionForUrl(self, url, model):
+        digest = self.urls.get(url)
+        return self.description(digest, model) if digest else None
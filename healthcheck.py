@@ -1,3 +1,7 @@
+import logging
+
+log = logging.getLogger(__name__)
+
 def pinghealthcheck(service:str='bot'):
     import os
     from dotenv import load_dotenv
@@ -9,15 +13,39 @@ def pinghealthcheck(service:str='bot'):
         uuid = os.getenv('BACKEND_HEALTHCHECK_UUID')
     else:
         uuid = os.getenv('HEALTHCHECK_UUID')
-    print(f"Health check UUID: {uuid}")
+    log.info(f"Health check UUID: {uuid}")
 
     url = f'https://hc-ping.com/{uuid}'
     
     try:
         response = requests.get(url)
         if response.status_code == 200:
-            print("Health check successful.")
+            log.info("Health check successful.")
         else:
-            print(f"Health check failed with status code: {response.status_code}, check the UUID is set correctly in the env")
+            log.warning(f"Health check failed with status code: {response.status_code}, check the UUID is set correctly in the env")
     except requests.RequestException as e:
-        print(f"An error occurred during the health check: {e}")
\ No newline at end of file
+        log.warning(f"An error occurred during the health check: {e}")
+
+HEALTHCHECK_URL = 'https://hc-ping.com'
+
+async def pinghealthcheckAsync(service:str='bot'):
+    import os
+    import asyncio
+    import aiohttp
+    from functions.httpClient import client
+
+    if service == 'backend':
+        uuid = os.getenv('BACKEND_HEALTHCHECK_UUID')
+    else:
+        uuid = os.getenv('HEALTHCHECK_UUID')
+
+    url = f'{HEALTHCHECK_URL}/{uuid}'
+
+    try:
+        response = await client.get(url, timeout=10)
+        if response.status == 200:
+            log.info("Health check successful.")
+        else:
+            log.warning(f"Health check failed with status code: {response.status}, check the UUID is set correctly in the env")
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        log.warning(f"An error occurred during the health check: {e}")
@@ -0,0 +1,101 @@
+import os
+from collections import OrderedDict, deque
+
+
+def entryFromMessage(message):
+    return {
+        'id': message.id,
+        'author_id': message.author.id,
+        'author': message.author.name,
+        'content': message.content,
+        'attachments': [a.url for a in message.attachments],
+    }
+
+
+class HistoryCache:
+    # keeps the last few messages of each channel in memory so replies don't need channel.history
+    def __init__(self, limit=20, max_channels=500, max_chars=2_000_000):
+        self.limit = limit
+        self.max_channels = max_channels
+        self.max_chars = max_chars
+        self.channels = OrderedDict()  # channel id -> deque of entries, oldest first
+        self.warm = set()  # channels that have been filled from the api
+        self.chars = 0
+        self.history_fetches = 0
+
+    def _buffer(self, channel_id):
+        buffer = self.channels.get(channel_id)
+        if buffer is None:
+            buffer = deque(maxlen=self.limit)
+            self.channels[channel_id] = buffer
+        self.channels.move_to_end(channel_id)
+        return buffer
+
+    def _evict(self):
+        # drop the channels nobody has talked in for the longest
+        while len(self.channels) > 1 and (len(self.channels) > self.max_channels or self.chars > self.max_chars):
+            channel_id, buffer = self.channels.popitem(last=False)
+            self.chars -= sum(len(entry['content']) for entry in buffer)
+            self.warm.discard(channel_id)
+
+    def add(self, message):
+        buffer = self._buffer(message.channel.id)
+        if len(buffer) == buffer.maxlen:
+            self.chars -= len(buffer[0]['content'])
+        entry = entryFromMessage(message)
+        buffer.append(entry)
+        self.chars += len(entry['content'])
+        self._evict()
+
+    def edit(self, message):
+        buffer = self.channels.get(message.channel.id)
+        if buffer is None:
+            return
+        for entry in buffer:
+            if entry['id'] == message.id:
+                self.chars += len(message.content) - len(entry['content'])
+                entry['content'] = message.content
+                return
+
+    def delete(self, channel_id, message_id):
+        buffer = self.channels.get(channel_id)
+        if buffer is None:
+            return
+        for entry in buffer:
+            if entry['id'] == message_id:
+                buffer.remove(entry)
+                self.chars -= len(entry['content'])
+                return
+
+    async def ensure(self, channel):
+        # only a cold channel pays for a history call, after that the events keep it current
+        if channel.id in self.warm:
+            self.channels.move_to_end(channel.id)
+            return
+        self.history_fetches += 1
+        fetched = [entryFromMessage(msg) async for msg in channel.history(limit=self.limit)]
+        buffer = self._buffer(channel.id)
+        # messages that arrived while fetching are already in the buffer
+        merged = {entry['id']: entry for entry in fetched}
+        merged.update((entry['id'], entry) for entry in buffer)
+        self.chars -= sum(len(entry['content']) for entry in buffer)
+        buffer.clear()
+        for message_id in sorted(merged)[-self.limit:]:  # snowflake ids go up with time
+            buffer.append(merged[message_id])
+            self.chars += len(merged[message_id]['content'])
+        self.warm.add(channel.id)
+        self._evict()
+
+    def messages(self, channel_id, limit=None):
+        buffer = self.channels.get(channel_id, ())
+        entries = list(buffer)
+        if limit is not None:
+            entries = entries[-limit:]
+        return entries
+
+
+history_cache = HistoryCache(
+    limit=int(os.environ.get('HISTORY_LIMIT') or 20),
+    max_channels=int(os.environ.get('HISTORY_MAX_CHANNELS') or 500),
+    max_chars=int(os.environ.get('HISTORY_MAX_CHARS') or 2_000_000),
+)
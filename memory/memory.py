@@ -1,30 +1,158 @@
+import atexit
 import json
+import logging
+import os
+import sqlite3
+import threading
+import time
 
-def addMemory(memory, channel_id):
-    try:
+log = logging.getLogger(__name__)
+
+MEMORY_DIR = os.path.dirname(os.path.abspath(__file__))
+DB_PATH = os.path.join(MEMORY_DIR, 'memories.db')
+JSON_PATH = os.path.join(MEMORY_DIR, 'memories.json')
+
+
+class MemoryStore:
+    # memories live in sqlite, reads come from an in-process cache and writes are batched in the background
+    def __init__(self, path=DB_PATH, json_path=JSON_PATH, flush_interval=1.0, batch_size=500):
+        self.path = path
+        self.json_path = json_path
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self._cache = {}  # channel id -> list of memories, in the order they were added
+        self._seen = {}  # channel id -> set of the same memories, for dedup
+        self._pending = []  # (channel id, memory, time) not written yet
+        self._lock = threading.RLock()
+        self._write_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = False
+        self._conn = None
+        self._write_conn = None
+        self._writer = None
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute('CREATE TABLE IF NOT EXISTS memories ('
+                     'channel_id TEXT NOT NULL, memory TEXT NOT NULL, added_at REAL NOT NULL, '
+                     'PRIMARY KEY (channel_id, memory))')
+        return conn
+
+    def open(self):
+        with self._lock:
+            if self._conn is not None:
+                return
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            self._conn = self._connect()
+            self._write_conn = self._connect()
+            self._migrate()
+            self._writer = threading.Thread(target=self._writerLoop, name='memory-writer', daemon=True)
+            self._writer.start()
+
+    def _migrate(self):
+        # one off import of the old memories.json, which is kept as memories.json.migrated
+        if not self.json_path or not os.path.exists(self.json_path):
+            return
         try:
-            with open('memory/memories.json', 'r', encoding='utf-8') as f:
+            with open(self.json_path, 'r', encoding='utf-8') as f:
                 memories = json.load(f)
-        except (FileNotFoundError, json.JSONDecodeError):
-            memories = {}
+        except FileNotFoundError:
+            return  # another shard process got to it first
+        except json.JSONDecodeError as e:
+            log.warning(f"Not migrating {self.json_path}: {e}")
+            return
+        now = time.time()
+        rows = ((str(channel_id), memory, now) for channel_id, items in memories.items() for memory in items)
+        with self._conn:
+            self._conn.executemany('INSERT OR IGNORE INTO memories VALUES (?, ?, ?)', rows)
+        try:
+            os.replace(self.json_path, self.json_path + '.migrated')
+        except FileNotFoundError:
+            return
+        log.info(f"Migrated memories for {len(memories)} channels to {self.path}")
 
-        if str(channel_id) not in memories:
-            memories[str(channel_id)] = []
+    def _load(self, channel_id):
+        memories = self._cache.get(channel_id)
+        if memories is None:
+            rows = self._conn.execute('SELECT memory FROM memories WHERE channel_id = ? ORDER BY rowid', (channel_id,))
+            memories = [row[0] for row in rows]
+            self._cache[channel_id] = memories
+            self._seen[channel_id] = set(memories)
+        return memories
 
-        if memory not in memories[str(channel_id)]:
-            memories[str(channel_id)].append(memory)
+    def add(self, memory, channel_id):
+        self.open()
+        channel_id = str(channel_id)
+        with self._lock:
+            memories = self._load(channel_id)
+            if memory in self._seen[channel_id]:
+                return False
+            memories.append(memory)
+            self._seen[channel_id].add(memory)
+            self._pending.append((channel_id, memory, time.time()))
+            if len(self._pending) >= self.batch_size:
+                self._wake.set()
+        return True
 
-        with open('memory/memories.json', 'w', encoding='utf-8') as f:
-            json.dump(memories, f, indent=4)
+    def read(self, channel_id):
+        self.open()
+        with self._lock:
+            return list(self._load(str(channel_id)))
+
+    def flush(self):
+        # the write happens outside the cache lock so reads don't wait on the disk
+        with self._write_lock:
+            with self._lock:
+                batch, self._pending = self._pending, []
+            if not batch:
+                return 0
+            try:
+                # one transaction per batch, either all of it lands or none of it
+                with self._write_conn:
+                    self._write_conn.executemany('INSERT OR IGNORE INTO memories VALUES (?, ?, ?)', batch)
+            except sqlite3.Error as e:
+                log.warning(f"Error writing memories: {e}")
+                with self._lock:
+                    self._pending = batch + self._pending
+                return 0
+        return len(batch)
+
+    def _writerLoop(self):
+        while not self._stop:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self.flush()
+
+    def close(self):
+        if self._conn is None:
+            return
+        self._stop = True
+        self._wake.set()
+        self._writer.join(timeout=5)
+        self.flush()
+        self._write_conn.close()
+        self._conn.close()
+        self._conn = None
+        self._write_conn = None
+
+
+store = MemoryStore(flush_interval=float(os.environ.get('MEMORY_FLUSH_INTERVAL') or 1.0))
+atexit.register(store.close)
+
+
+def addMemory(memory, channel_id):
+    try:
+        store.add(memory, channel_id)
         return 'Memory added successfully.'
     except Exception as e:
-        print(f"Error writing to JSON file: {e}")
-        return(f"Error writing to JSON file: {e}")
+        log.warning(f"Error adding memory: {e}")
+        return(f"Error adding memory: {e}")
 
 def readMemories(channel_id):
     try:
-        with open('memory/memories.json', 'r', encoding='utf-8') as f:
-            memories = json.load(f)
-            return memories.get(str(channel_id), [])
-    except (FileNotFoundError, json.JSONDecodeError):
-        return 'No memories found for this channel.'
\ No newline at end of file
+        return store.read(channel_id)
+    except sqlite3.Error as e:
+        log.warning(f"Error reading memories: {e}")
+        return 'No memories found for this channel.'
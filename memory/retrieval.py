@@ -0,0 +1,137 @@
+import logging
+import re
+import time
+import zlib
+
+import numpy as np
+
+log = logging.getLogger(__name__)
+
+word_pattern = re.compile(r"[a-z0-9']+")
+
+
+def estimateTokens(text):
+    # close enough for budgeting, roughly 4 characters a token
+    return len(text) // 4 + 1
+
+
+class HashEmbedder:
+    # hashed term frequency vectors, no model needed, used for tests and when no embedding model is set. There is
+    # no idf weighting, stored vectors would keep the idf from when they were added while queries got today's
+    def __init__(self, dim=1024):
+        self.dim = dim
+
+    def _counts(self, text):
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for word in word_pattern.findall(text.lower()):
+            vector[zlib.crc32(word.encode()) % self.dim] += 1
+        return vector
+
+    async def embed(self, texts):
+        counts = np.stack([self._counts(text) for text in texts]) if texts else np.zeros((0, self.dim), dtype=np.float32)
+        vectors = np.log1p(counts)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-9)
+
+    async def embedQuery(self, text):
+        return (await self.embed([text]))[0]
+
+
+class OllamaEmbedder:
+    def __init__(self, client, model):
+        self.client = client
+        self.model = model
+
+    async def embed(self, texts):
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+        response = await self.client.embed(model=self.model, input=texts)
+        vectors = np.asarray(response['embeddings'], dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-9)
+
+    async def embedQuery(self, text):
+        return (await self.embed([text]))[0]
+
+
+class ChannelIndex:
+    def __init__(self):
+        self.memories = []
+        self.vectors = None
+
+    def append(self, memories, vectors):
+        self.memories.extend(memories)
+        self.vectors = vectors if self.vectors is None else np.vstack([self.vectors, vectors])
+
+
+class MemoryIndex:
+    # picks the memories most relevant to a message instead of pasting all of them into the prompt
+    def __init__(self, embedder, k=8, token_budget=300):
+        self.embedder = embedder
+        self.k = k
+        self.token_budget = token_budget
+        self.channels = {}  # channel id -> ChannelIndex
+        self.adds = 0
+        self.add_time = 0.0
+        self.queries = 0
+        self.query_time = 0.0
+        self.tokens_before = 0
+        self.tokens_after = 0
+
+    async def sync(self, channel_id, memories):
+        # memories are only ever appended, so anything past what we have is new
+        index = self.channels.setdefault(channel_id, ChannelIndex())
+        if len(memories) < len(index.memories) or memories[:len(index.memories)] != index.memories:
+            index = self.channels[channel_id] = ChannelIndex()
+        new = memories[len(index.memories):]
+        if new:
+            start = time.perf_counter()
+            index.append(new, await self.embedder.embed(new))
+            self.adds += len(new)
+            self.add_time += time.perf_counter() - start
+        return index
+
+    def _budget(self, memories, ranked):
+        picked = []
+        used = 0
+        for i in ranked:
+            tokens = estimateTokens(memories[i])
+            if used + tokens > self.token_budget:
+                continue
+            picked.append(memories[i])
+            used += tokens
+            if len(picked) >= self.k:
+                break
+        return picked
+
+    async def relevant(self, channel_id, memories, text):
+        full = sum(estimateTokens(memory) for memory in memories)
+        if len(memories) <= self.k and full <= self.token_budget:
+            picked = list(memories)
+        else:
+            start = time.perf_counter()
+            try:
+                index = await self.sync(channel_id, memories)
+                query = await self.embedder.embedQuery(text)
+                scores = index.vectors @ query
+                ranked = np.argsort(-scores)
+            except Exception as e:
+                # embedding backend is down, keep the newest memories that fit
+                log.warning(f"Error ranking memories: {e}")
+                ranked = range(len(memories) - 1, -1, -1)
+            picked = self._budget(memories, ranked)
+            self.queries += 1
+            self.query_time += time.perf_counter() - start
+        self.tokens_before += full
+        self.tokens_after += sum(estimateTokens(memory) for memory in picked)
+        return picked
+
+    def stats(self):
+        return {
+            'indexed': sum(len(index.memories) for index in self.channels.values()),
+            'avg_add_ms': self.add_time / self.adds * 1000 if self.adds else 0.0,
+            'avg_query_ms': self.query_time / self.queries * 1000 if self.queries else 0.0,
+            'tokens_before': self.tokens_before,
+            'tokens_after': self.tokens_after,
+            'reduction': 1 - self.tokens_after / self.tokens_before if self.tokens_before else 0.0,
+        }
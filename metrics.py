@@ -0,0 +1,172 @@
+import asyncio
+import atexit
+import bisect
+import logging
+import logging.handlers
+import queue
+import random
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+log = logging.getLogger(__name__)
+
+# seconds, from a cache hit up to a slow generation on a cold model
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+RATE_BUCKETS = (1, 2, 5, 10, 20, 30, 50, 75, 100, 150, 250)
+
+
+class Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # the last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    text = ','.join('{}="{}"'.format(key, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+                    for key, value in labels)
+    return '{' + text + '}'
+
+
+class Metrics:
+    # counters, gauges and histograms kept in process and rendered in the prometheus text format
+    def __init__(self):
+        self.counters = defaultdict(float)  # (name, labels) -> value
+        self.gauges = {}
+        self.histograms = {}
+        self.help = {}
+        self.collectors = []  # functions that report gauges when scraped
+
+    def describe(self, name, text):
+        self.help[name] = text
+
+    def inc(self, name, amount=1, **labels):
+        self.counters[(name, tuple(sorted(labels.items())))] += amount
+
+    def set(self, name, value, **labels):
+        self.gauges[(name, tuple(sorted(labels.items())))] = value
+
+    def observe(self, name, value, buckets=DEFAULT_BUCKETS, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = Histogram(buckets)
+        histogram.observe(value)
+
+    @contextmanager
+    def stage(self, stage, **labels):
+        # how long one step of the message pipeline took, and whether it failed
+        started = time.perf_counter()
+        try:
+            yield
+        except asyncio.CancelledError:
+            self.inc('omera_stage_cancelled_total', stage=stage)
+            raise
+        except Exception as e:
+            self.inc('omera_stage_errors_total', stage=stage, error=type(e).__name__)
+            raise
+        finally:
+            self.observe('omera_stage_seconds', time.perf_counter() - started, stage=stage, **labels)
+
+    def collector(self, func):
+        # func() gives (name, labels, value) for values that are cheaper to read when scraped
+        self.collectors.append(func)
+        return func
+
+    def render(self):
+        families = defaultdict(list)
+        types = {}
+        for (name, labels), value in self.counters.items():
+            types[name] = 'counter'
+            families[name].append(f"{name}{_labels(labels)} {value:g}")
+        gauges = dict(self.gauges)
+        for func in self.collectors:
+            try:
+                for name, labels, value in func():
+                    gauges[(name, tuple(sorted(labels.items())))] = value
+            except Exception as e:
+                log.warning(f"Error collecting metrics from {getattr(func, '__name__', func)}: {e}")
+        for (name, labels), value in gauges.items():
+            types[name] = 'gauge'
+            families[name].append(f"{name}{_labels(labels)} {value:g}")
+        for (name, labels), histogram in self.histograms.items():
+            types[name] = 'histogram'
+            cumulative = 0
+            for bound, count in zip((*histogram.buckets, '+Inf'), histogram.counts):
+                cumulative += count
+                families[name].append(f"{name}_bucket{_labels((*labels, ('le', bound)))} {cumulative}")
+            families[name].append(f"{name}_sum{_labels(labels)} {histogram.sum:g}")
+            families[name].append(f"{name}_count{_labels(labels)} {histogram.count}")
+        lines = []
+        for name in sorted(families):
+            if name in self.help:
+                lines.append(f"# HELP {name} {self.help[name]}")
+            lines.append(f"# TYPE {name} {types[name]}")
+            lines.extend(families[name])
+        return '\n'.join(lines) + '\n'
+
+
+metrics = Metrics()
+metrics.describe('omera_stage_seconds', 'Time spent in each step of replying to a message')
+metrics.describe('omera_stage_errors_total', 'Steps that raised, by exception type')
+metrics.describe('omera_ttft_seconds', 'Time to the first streamed token')
+metrics.describe('omera_tokens_per_second', 'Generation speed reported by ollama')
+metrics.describe('omera_queue_wait_seconds', 'Time waiting for an inference slot')
+metrics.describe('omera_reply_seconds', 'Time from a message being sent to the reply being posted')
+
+
+async def startServer(host, port, registry=metrics):
+    # a local /metrics page for prometheus, started from on_ready
+    from aiohttp import web
+
+    async def handle(request):
+        return web.Response(text=registry.render(), content_type='text/plain', charset='utf-8')
+
+    app = web.Application()
+    app.router.add_get('/metrics', handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    log.info(f"Serving metrics on http://{host}:{port}/metrics")
+    return runner
+
+
+class Sampler(logging.Filter):
+    # every warning gets through, the per message chatter only some of the time
+    def __init__(self, rate, names=('omera.messages',)):
+        super().__init__()
+        self.rate = rate
+        self.names = tuple(names)
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING or self.rate >= 1:
+            return True
+        if record.name.startswith(self.names):
+            return random.random() < self.rate
+        return True
+
+
+def setupLogging(level='INFO', sample_rate=1.0, prefix=''):
+    # records go on a queue and a thread writes them, so a slow terminal doesn't hold up the event loop
+    records = queue.SimpleQueue()
+    handler = logging.handlers.QueueHandler(records)
+    handler.addFilter(Sampler(sample_rate))  # filtered before the record gets formatted
+    output = logging.StreamHandler()
+    # the prefix tells shard processes apart when they share a terminal
+    output.setFormatter(logging.Formatter(prefix + '%(asctime)s %(levelname)s %(name)s: %(message)s'))
+    listener = logging.handlers.QueueListener(records, output, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    root = logging.getLogger()
+    root.handlers = [handler]
+    root.setLevel(level.upper() if isinstance(level, str) else level)
+    return listener
@@ -0,0 +1,272 @@
+import asyncio
+import logging
+import time
+from collections import Counter, OrderedDict
+
+log = logging.getLogger(__name__)
+
+
+class ModelManager:
+    # knows which models are installed and loaded, warms them up and unloads the idle ones when memory runs out
+    def __init__(self, client, keep_alive_for, budget_bytes=None, in_use=None):
+        self.client = client
+        self.keep_alive_for = keep_alive_for
+        self.budget_bytes = budget_bytes
+        self.in_use = in_use or (lambda model: False)
+        self.installed = {}  # name -> size on disk
+        self.loaded = OrderedDict()  # name -> memory used, least recently used first
+        self.last_used = {}
+        self.refreshed_at = None
+
+    async def refresh(self):
+        models = await self.client.list()
+        self.installed = {model['model']: model.get('size') or 0 for model in models['models']}
+        running = await self.client.ps()
+        loaded = OrderedDict()
+        # keep our own usage order for models we already knew about
+        names = {model['model']: model.get('size_vram') or model.get('size') or 0 for model in running['models']}
+        for name in self.loaded:
+            if name in names:
+                loaded[name] = names.pop(name)
+        for name, size in names.items():
+            loaded[name] = size
+            loaded.move_to_end(name, last=False)
+        self.loaded = loaded
+        self.refreshed_at = time.time()
+
+    def names(self):
+        return sorted(self.installed)
+
+    def isInstalled(self, model):
+        return model in self.installed or f"{model}:latest" in self.installed
+
+    def touch(self, model):
+        self.last_used[model] = time.time()
+        if model in self.loaded:
+            self.loaded.move_to_end(model)
+        else:
+            self.loaded[model] = self.installed.get(model, 0)
+
+    def _used(self):
+        return sum(self.loaded.values())
+
+    async def preload(self, models):
+        # an empty generate loads the model without producing anything
+        for model in dict.fromkeys(models):
+            if model in self.loaded:
+                self.touch(model)
+                continue
+            if not self.isInstalled(model):
+                log.warning(f"Not preloading {model}, it isn't installed")
+                continue
+            if self.budget_bytes and self._used() + self.installed.get(model, 0) > self.budget_bytes:
+                log.warning(f"Not preloading {model}, it doesn't fit in the memory budget")
+                continue
+            try:
+                started = time.perf_counter()
+                await self.client.generate(model=model, prompt='', keep_alive=self.keep_alive_for(model))
+                log.info(f"Preloaded {model} in {time.perf_counter() - started:.1f}s")
+                self.touch(model)
+            except Exception as e:
+                log.warning(f"Error preloading {model}: {e}")
+
+    async def unload(self, model):
+        await self.client.generate(model=model, prompt='', keep_alive=0)
+        self.loaded.pop(model, None)
+        log.info(f"Unloaded idle model {model}")
+
+    async def enforceBudget(self):
+        if not self.budget_bytes:
+            return
+        for model in list(self.loaded):
+            if self._used() <= self.budget_bytes or len(self.loaded) <= 1:
+                return
+            if self.in_use(model):
+                continue
+            try:
+                await self.unload(model)
+            except Exception as e:
+                log.warning(f"Error unloading {model}: {e}")
+
+
+class Backend:
+    # one ollama host, its model registry and how busy it is right now
+    def __init__(self, host, client, manager):
+        self.host = host
+        self.client = client
+        self.manager = manager
+        self.active = 0
+        self.active_by_model = Counter()
+        self.requests = 0
+        self.errors = 0
+        self.failures = 0  # in a row, for the cooldown
+        self.down_until = 0.0
+
+    def healthy(self, now=None):
+        return (now or time.monotonic()) >= self.down_until
+
+    def stats(self):
+        return {
+            'healthy': self.healthy(),
+            'active': self.active,
+            'requests': self.requests,
+            'errors': self.errors,
+            'loaded': list(self.manager.loaded),
+        }
+
+
+class BackendPool:
+    # spreads requests over several ollama hosts: the channel's last backend if it isn't much busier,
+    # otherwise the least busy healthy one that already has the model loaded, and the next one if it fails
+    def __init__(self, hosts, make_client, keep_alive_for, budget_bytes=None, cooldown=10, max_cooldown=300,
+                 sticky_slack=1, max_sticky=10000):
+        self.backends = []
+        for host in hosts:
+            client = make_client(host)
+            backend = Backend(host or 'default', client, None)
+            backend.manager = ModelManager(client, keep_alive_for, budget_bytes,
+                                           in_use=lambda model, backend=backend: backend.active_by_model[model] > 0)
+            self.backends.append(backend)
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.sticky_slack = sticky_slack  # how many more requests the sticky backend may have than the least busy one
+        self.max_sticky = max_sticky
+        self.sticky = OrderedDict()  # channel id -> backend
+        self.failovers = 0
+        self.tasks = set()  # background work, kept here so it isn't garbage collected while it runs
+
+    def _hasModel(self, backend, model):
+        # before the first refresh nothing is known, so every backend counts
+        return not backend.manager.installed or backend.manager.isInstalled(model)
+
+    def choose(self, model, channel_id=None, exclude=()):
+        now = time.monotonic()
+        candidates = [b for b in self.backends if b not in exclude and b.healthy(now) and self._hasModel(b, model)]
+        if not candidates:
+            # nothing healthy has it, try the ones in cooldown rather than give up
+            candidates = [b for b in self.backends if b not in exclude and self._hasModel(b, model)]
+        if not candidates:
+            return None
+        best = min(candidates, key=lambda b: (model not in b.manager.loaded, b.active, len(b.manager.loaded)))
+        sticky = self.sticky.get(channel_id)
+        # staying on the same backend keeps the channel's prompt in its kv cache
+        if (sticky in candidates and (model in sticky.manager.loaded or model not in best.manager.loaded)
+                and sticky.active <= best.active + self.sticky_slack):
+            return sticky
+        return best
+
+    def _stick(self, channel_id, backend):
+        if channel_id is None:
+            return
+        self.sticky[channel_id] = backend
+        self.sticky.move_to_end(channel_id)
+        while len(self.sticky) > self.max_sticky:
+            self.sticky.popitem(last=False)
+
+    def _failed(self, backend, error):
+        backend.errors += 1
+        backend.failures += 1
+        cooldown = min(self.cooldown * 2 ** (backend.failures - 1), self.max_cooldown)
+        backend.down_until = time.monotonic() + cooldown
+        log.warning(f"Ollama at {backend.host} failed, not using it for {cooldown:.0f}s: {error}")
+
+    async def call(self, model, func, channel_id=None):
+        # func(client) does the request, it's tried again on the next backend if it fails
+        tried = []
+        error = None
+        while True:
+            backend = self.choose(model, channel_id, exclude=tried)
+            if backend is None:
+                raise error or ValueError(f"no ollama backend has {model}")
+            if tried:
+                self.failovers += 1
+            tried.append(backend)
+            backend.active += 1
+            backend.active_by_model[model] += 1
+            backend.requests += 1
+            try:
+                result = await func(backend.client)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                status = getattr(e, 'status_code', None)
+                if status == 404:
+                    # this backend doesn't have the model after all
+                    backend.manager.installed.pop(model, None)
+                    backend.manager.loaded.pop(model, None)
+                elif status is not None and status < 500:
+                    raise  # a bad request fails everywhere
+                else:
+                    self._failed(backend, e)
+                error = e
+                continue
+            finally:
+                backend.active -= 1
+                backend.active_by_model[model] -= 1
+            backend.failures = 0
+            # only a call that worked means the model is loaded there
+            cold = model not in backend.manager.loaded
+            backend.manager.touch(model)
+            if cold:
+                # another model might have to make room for this one
+                self.background(backend.manager.enforceBudget())
+            self._stick(channel_id, backend)
+            return result
+
+    def background(self, coro):
+        task = asyncio.create_task(coro)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return task
+
+    # the parts of the ollama client the bot uses, so the pool can stand in for one
+    async def chat(self, channel_id=None, **kwargs):
+        return await self.call(kwargs['model'], lambda client: client.chat(**kwargs), channel_id)
+
+    async def embed(self, **kwargs):
+        return await self.call(kwargs['model'], lambda client: client.embed(**kwargs))
+
+    # and the parts of ModelManager, over every backend
+    @property
+    def installed(self):
+        installed = {}
+        for backend in self.backends:
+            installed.update(backend.manager.installed)
+        return installed
+
+    @property
+    def loaded(self):
+        loaded = OrderedDict()
+        for backend in self.backends:
+            loaded.update(backend.manager.loaded)
+        return loaded
+
+    def names(self):
+        return sorted(self.installed)
+
+    def isInstalled(self, model):
+        return any(backend.manager.isInstalled(model) for backend in self.backends)
+
+    async def refresh(self):
+        results = await asyncio.gather(*(backend.manager.refresh() for backend in self.backends), return_exceptions=True)
+        for backend, result in zip(self.backends, results):
+            if isinstance(result, Exception):
+                self._failed(backend, result)
+            else:
+                backend.failures = 0
+                backend.down_until = 0.0
+        if all(isinstance(result, Exception) for result in results):
+            raise results[0]
+
+    async def preload(self, models):
+        # each model goes to the backend that would get its requests
+        for model in dict.fromkeys(models):
+            backend = self.choose(model)
+            if backend is not None:
+                await backend.manager.preload([model])
+
+    async def enforceBudget(self):
+        await asyncio.gather(*(backend.manager.enforceBudget() for backend in self.backends))
+
+    def stats(self):
+        return {backend.host: backend.stats() for backend in self.backends}
@@ -0,0 +1,245 @@
+import ast
+import logging
+import re
+
+import discord
+
+from functions.vision import LRUCache
+
+log = logging.getLogger(__name__)
+
+# everything is compiled once at import instead of on every reply
+prefix_pattern = re.compile(r'^omera ai: ', re.IGNORECASE)
+# think blocks, markdown images and @mentions in one pass
+reply_pattern = re.compile(r'(?P<think>(?s:<think>.*?</think>))|!\[(?P<alt>.*?)\]|@(?P<mention>\w+)')
+mention_pattern = re.compile(r'@(\w+)')
+code_block_pattern = re.compile(r'`{1,3}(?:python)?\n?([\s\S]*?)`{1,3}')
+
+illegal = ['nigger', 'rape', 'fag']
+censor_pattern = re.compile(r'\b(' + '|'.join(map(re.escape, illegal)) + r')\b', re.IGNORECASE)
+
+
+def censor(text):
+    return censor_pattern.sub(lambda match: "#" * len(match.group()), text)
+
+
+class MemberIndex:
+    # username -> member id for every guild, kept current by the member events instead of scanning guild.members
+    def __init__(self):
+        self.guilds = {}  # guild id -> {name: member id}
+        self.names = {}  # name -> {guild id: member id}
+
+    def addGuild(self, guild):
+        self.removeGuild(guild.id)
+        for member in guild.members:
+            self.add(member)
+
+    def removeGuild(self, guild_id):
+        for name in self.guilds.pop(guild_id, {}):
+            guilds = self.names.get(name)
+            if guilds is not None:
+                guilds.pop(guild_id, None)
+                if not guilds:
+                    del self.names[name]
+
+    def add(self, member):
+        members = self.guilds.setdefault(member.guild.id, {})
+        # first member with a name wins, like discord.utils.get did
+        if member.name not in members:
+            members[member.name] = member.id
+            self.names.setdefault(member.name, {})[member.guild.id] = member.id
+
+    def remove(self, member):
+        members = self.guilds.get(member.guild.id, {})
+        if members.get(member.name) == member.id:
+            del members[member.name]
+            guilds = self.names.get(member.name, {})
+            guilds.pop(member.guild.id, None)
+            if not guilds:
+                self.names.pop(member.name, None)
+
+    def rename(self, guild_id, member_id, old_name, new_name):
+        members = self.guilds.get(guild_id, {})
+        if members.get(old_name) == member_id:
+            del members[old_name]
+            guilds = self.names.get(old_name, {})
+            guilds.pop(guild_id, None)
+            if not guilds:
+                self.names.pop(old_name, None)
+        if new_name not in members:
+            members[new_name] = member_id
+            self.names.setdefault(new_name, {})[guild_id] = member_id
+
+    def lookup(self, name, guild_id=None):
+        # prefer the guild the reply is going to, then any guild the bot is in
+        if guild_id is not None:
+            member_id = self.guilds.get(guild_id, {}).get(name)
+            if member_id is not None:
+                return member_id
+        guilds = self.names.get(name)
+        if guilds:
+            return next(iter(guilds.values()))
+        return None
+
+
+member_index = MemberIndex()
+
+
+def format_reply(response, guild_id=None, members=member_index):
+    def mention(name):
+        member_id = members.lookup(name, guild_id)
+        return f'<@{member_id}>' if member_id is not None else f'@{name}'
+
+    def replace(match):
+        if match.group('think') is not None:
+            return ''
+        if match.group('alt') is not None:
+            return '[' + mention_pattern.sub(lambda m: mention(m.group(1)), match.group('alt')) + ']'
+        return mention(match.group('mention'))
+
+    if prefix_pattern.match(response):
+        response = response[9:].lstrip()
+    return reply_pattern.sub(replace, response)
+
+
+async def format_response(response, guild_id=None):
+    return format_reply(response, guild_id)
+
+
+# what an embed in a reply is allowed to do, anything else in the code block is ignored
+EMBED_KWARGS = {'title', 'description', 'url', 'color', 'colour'}
+EMBED_METHODS = {
+    'add_field': {'name', 'value', 'inline'},
+    'set_footer': {'text', 'icon_url'},
+    'set_image': {'url'},
+    'set_thumbnail': {'url'},
+    'set_author': {'name', 'url', 'icon_url'},
+}
+EMBED_POSITIONAL = {
+    'add_field': ('name', 'value', 'inline'),
+    'set_footer': ('text',),
+    'set_image': ('url',),
+    'set_thumbnail': ('url',),
+    'set_author': ('name',),
+}
+
+
+class EmbedError(Exception):
+    pass
+
+
+def _isDiscord(node, *names):
+    # matches discord.<names...>, e.g. discord.Embed or discord.Color.blue
+    for name in reversed(names):
+        if not isinstance(node, ast.Attribute) or node.attr != name:
+            return False
+        node = node.value
+    return isinstance(node, ast.Name) and node.id == 'discord'
+
+
+def _colour(node):
+    if isinstance(node, ast.Call) and (_isDiscord(node.func, 'Color') or _isDiscord(node.func, 'Colour')):
+        return ('value', int(ast.literal_eval(node.args[0])))
+    if isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute):
+        owner = node.func.value
+        if _isDiscord(owner, 'Color') or _isDiscord(owner, 'Colour'):
+            method = node.func.attr
+            args = [ast.literal_eval(arg) for arg in node.args]
+            if method == 'from_rgb' and len(args) == 3:
+                return ('rgb', tuple(int(a) for a in args))
+            if not args and hasattr(discord.Colour, method) and not method.startswith('_'):
+                return ('named', method)
+        raise EmbedError("unsupported colour")
+    return ('value', int(ast.literal_eval(node)))
+
+
+def _literal(node):
+    try:
+        return ast.literal_eval(node)
+    except ValueError:
+        raise EmbedError("only plain values are allowed")
+
+
+def parseEmbed(code):
+    # turns embed code into a list of operations without running it
+    try:
+        tree = ast.parse(code)
+    except SyntaxError as e:
+        raise EmbedError(f"bad embed code: {e}")
+    spec = []
+    for statement in tree.body:
+        if (isinstance(statement, ast.Assign) and len(statement.targets) == 1
+                and isinstance(statement.targets[0], ast.Name) and statement.targets[0].id == 'embed'
+                and isinstance(statement.value, ast.Call) and _isDiscord(statement.value.func, 'Embed')):
+            kwargs = {}
+            for keyword in statement.value.keywords:
+                if keyword.arg not in EMBED_KWARGS:
+                    continue
+                if keyword.arg in ('color', 'colour'):
+                    kwargs['colour'] = _colour(keyword.value)
+                else:
+                    kwargs[keyword.arg] = str(_literal(keyword.value))
+            spec = [('new', kwargs)]
+        elif (isinstance(statement, ast.Expr) and isinstance(statement.value, ast.Call)
+                and isinstance(statement.value.func, ast.Attribute)
+                and isinstance(statement.value.func.value, ast.Name) and statement.value.func.value.id == 'embed'
+                and statement.value.func.attr in EMBED_METHODS):
+            method = statement.value.func.attr
+            if not spec:
+                raise EmbedError("embed used before it was made")
+            kwargs = dict(zip(EMBED_POSITIONAL[method], (_literal(arg) for arg in statement.value.args)))
+            for keyword in statement.value.keywords:
+                if keyword.arg in EMBED_METHODS[method]:
+                    kwargs[keyword.arg] = _literal(keyword.value)
+            spec.append((method, kwargs))
+        else:
+            raise EmbedError(f"unsupported statement on line {statement.lineno}")
+    if not spec:
+        raise EmbedError("Code did not define an 'embed' variable.")
+    return spec
+
+
+def buildEmbed(spec):
+    embed = None
+    for operation, kwargs in spec:
+        if operation == 'new':
+            kwargs = dict(kwargs)
+            colour = kwargs.pop('colour', None)
+            if colour is not None:
+                kind, value = colour
+                if kind == 'rgb':
+                    kwargs['colour'] = discord.Colour.from_rgb(*value)
+                elif kind == 'named':
+                    kwargs['colour'] = getattr(discord.Colour, value)()
+                else:
+                    kwargs['colour'] = value
+            embed = discord.Embed(**kwargs)
+        else:
+            getattr(embed, operation)(**kwargs)
+    return embed
+
+
+embed_specs = LRUCache(256)
+
+
+async def read_embeds(message):
+    code_block = code_block_pattern.search(message)
+    if not code_block:
+        return None, message
+    code = code_block.group(1)
+    code = "\n".join(line.strip() for line in code.splitlines() if line.strip().startswith("embed"))    # remove non embed code lines
+    spec = embed_specs.get(code)
+    if spec is None:
+        try:
+            spec = parseEmbed(code)
+        except (EmbedError, ValueError, TypeError, IndexError) as e:
+            log.warning(f"Error making embed from code: {e}")
+            return None, message
+        embed_specs.set(code, spec)
+    try:
+        embed = buildEmbed(spec)
+    except (ValueError, TypeError) as e:
+        log.warning(f"Error making embed from code: {e}")
+        return None, message
+    message = code_block_pattern.sub('', message)
+    return embed, message.strip()
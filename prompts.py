@@ -0,0 +1,138 @@
+import asyncio
+import json
+import logging
+
+log = logging.getLogger(__name__)
+
+
+class TokenCounter:
+    # estimates tokens from characters, the ratio for each model is learnt from ollama's prompt_eval_count
+    def __init__(self, default_ratio=3.5, max_ratio=6.0, tolerance=1.3):
+        self.default_ratio = default_ratio
+        self.max_ratio = max_ratio  # no tokenizer packs more characters than this into a token
+        self.tolerance = tolerance
+        self.ratios = {}  # model -> characters per token
+        self.skipped = 0
+
+    def count(self, model, text):
+        return int(len(text) / self.ratios.get(model, self.default_ratio)) + 1
+
+    def observe(self, model, chars, prompt_tokens):
+        if not prompt_tokens or not chars:
+            return
+        ratio = chars / prompt_tokens
+        old = self.ratios.get(model, self.default_ratio)
+        # prompt_eval_count leaves out the prefix ollama had cached, so only calls that evaluated about the
+        # whole prompt say anything about the tokenizer. A cached prefix only ever makes the ratio look bigger
+        if ratio > self.max_ratio or ratio > old * self.tolerance:
+            self.skipped += 1
+            return
+        self.ratios[model] = ratio if model not in self.ratios else old * 0.8 + ratio * 0.2
+
+
+class SummaryCache:
+    # rolling summary of the messages that fell out of the prompt, per channel
+    def __init__(self, summarize, min_messages=4):
+        self.summarize = summarize  # async summarize(channel_id, previous_summary, lines) -> str
+        self.min_messages = min_messages
+        self.summaries = {}  # channel id -> (id of the newest summarized message, summary)
+        self._running = {}
+
+    def get(self, channel_id):
+        entry = self.summaries.get(channel_id)
+        return entry[1] if entry else None
+
+    def update(self, channel_id, dropped):
+        # summarizing is another inference, so it happens in the background and the next prompt picks it up
+        last_id, previous = self.summaries.get(channel_id, (0, None))
+        new = [entry for entry in dropped if entry['id'] > last_id]
+        if len(new) < self.min_messages or channel_id in self._running:
+            return
+        self._running[channel_id] = asyncio.create_task(self._run(channel_id, previous, new))
+
+    async def _run(self, channel_id, previous, new):
+        try:
+            summary = await self.summarize(channel_id, previous, [entry['content'] for entry in new])
+            if summary:
+                self.summaries[channel_id] = (new[-1]['id'], summary.strip())
+        except Exception as e:
+            log.warning(f"Error summarizing channel {channel_id}: {e}")
+        finally:
+            self._running.pop(channel_id, None)
+
+
+class PromptBuilder:
+    # fits the system prompt, an optional summary and as much recent history as the model's context allows
+    def __init__(self, counter, summaries=None, default_context=4096, context_limits=None, reserve=512, layout='stable'):
+        self.counter = counter
+        self.summaries = summaries
+        self.default_context = default_context
+        self.context_limits = context_limits or {}
+        self.reserve = reserve  # left over for the reply
+        # stable keeps the start of the prompt byte for byte the same between requests so ollama can reuse
+        # its cached prefix, volatile is the old single system prompt with everything in it
+        self.layout = layout
+
+    def contextSize(self, model):
+        return self.context_limits.get(model, self.default_context)
+
+    def build(self, model, channel_id, sections, history, tools=None, context=None):
+        # sections is [(name, text)] for the fixed part of the system prompt, context is the per message part,
+        # history is oldest first with message ids
+        context = context or []
+        report = {name: self.counter.count(model, text) for name, text in sections + context}
+        if self.layout == 'stable':
+            system = ' '.join(text for name, text in sections)
+            context_text = ' '.join(text for name, text in context)
+        else:
+            system = ' '.join(text for name, text in sections + context)
+            context_text = ''
+        report['tools'] = self.counter.count(model, json.dumps(tools)) if tools else 0
+        summary = self.summaries.get(channel_id) if self.summaries else None
+        report['summary'] = self.counter.count(model, summary) if summary else 0
+
+        budget = self.contextSize(model) - self.reserve - sum(report.values())
+        kept = []
+        used = 0
+        for entry in reversed(history):
+            tokens = self.counter.count(model, entry['content'])
+            # the newest message always goes in, even over budget
+            if kept and used + tokens > budget:
+                break
+            kept.append(entry)
+            used += tokens
+        kept.reverse()
+        dropped = history[:len(history) - len(kept)]
+        if dropped and self.summaries:
+            self.summaries.update(channel_id, dropped)
+        else:
+            # nothing fell out of the prompt so the summary isn't needed
+            summary = None
+            report['summary'] = 0
+        report['history'] = used
+        report['total'] = sum(report.values())
+        report['context'] = self.contextSize(model)
+        report['history_messages'] = len(kept)
+        report['dropped_messages'] = len(dropped)
+
+        messages = [{"role": "system", "content": system}]
+        if summary and self.layout != 'stable':
+            messages.append({"role": "system", "content": f"Summary of the earlier conversation: {summary}"})
+        for entry in kept:
+            messages.append({k: v for k, v in entry.items() if k != 'id'})
+        if self.layout == 'stable':
+            # ollama merges every system message into the one at the top of the template, so anything that changes
+            # per message rides along with the newest user turn instead
+            notes = ' '.join(text for text in (f"Summary of the earlier conversation: {summary}" if summary else '', context_text) if text)
+            if notes and len(messages) > 1 and messages[-1].get('role') == 'user':
+                messages[-1]['content'] = f"{messages[-1].get('content') or ''}\n\n{notes}"
+            elif notes:
+                messages.append({"role": "user", "content": notes})
+        return messages, report
+
+
+def formatReport(model, report):
+    sections = ', '.join(f"{k} {v}" for k, v in report.items()
+                         if k not in ('total', 'context', 'history_messages', 'dropped_messages'))
+    return (f"Prompt for {model}: {sections} = {report['total']}/{report['context']} tokens, "
+            f"{report['history_messages']} messages kept, {report['dropped_messages']} dropped")
@@ -0,0 +1,184 @@
+import hashlib
+import logging
+import re
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+log = logging.getLogger(__name__)
+
+mention_pattern = re.compile(r'<[@#:!&a-z]*[^>]*>')
+word_pattern = re.compile(r"[a-z0-9]+")
+number_pattern = re.compile(r"[a-z]*\d+[a-z]*")
+
+
+def normalizeMessage(text):
+    # "What's 9069??" and "whats 9069" are the same question
+    text = mention_pattern.sub(' ', text.lower()).replace("'", '')
+    return ' '.join(word_pattern.findall(text))
+
+
+def resultDigest(value):
+    return hashlib.sha1(repr(value).encode()).hexdigest()
+
+
+class CachedResponse:
+    def __init__(self, text, response, vector, tool_calls, tool_digest, cost, ttl):
+        self.text = text
+        self.response = response
+        self.vector = vector
+        self.tool_calls = tool_calls
+        self.tool_digest = tool_digest
+        self.cost = cost  # seconds of inference it took to make
+        self.expires = time.monotonic() + ttl
+        self.hits = 0
+        self.size = len(text) + len(response.encode()) + (vector.nbytes if vector is not None else 0) + 256
+
+
+def selfContained(text, tool_calls):
+    # the message itself names everything the tools looked up, so the answer didn't lean on the conversation
+    return bool(tool_calls) and all(f" {normalizeMessage(str(value))} " in f" {text} "
+                                    for call in tool_calls for value in call['function']['arguments'].values())
+
+
+class ResponseCache:
+    # answers to questions that were asked before, reused when the model, persona and question match and any
+    # tool the answer used still gives the same result. Near identical wording matches by embedding similarity,
+    # but only between questions mentioning the same numbers, so 9069 never gets the answer for 9070.
+    # Only tool backed answers to self contained questions are kept, chit-chat depends on the conversation
+    def __init__(self, embedder=None, ttl=3600, maxsize=2000, max_bytes=32 * 1024 * 1024, similarity=0.92, min_chars=4):
+        self.embedder = embedder
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.max_bytes = max_bytes
+        self.similarity = similarity
+        self.min_chars = min_chars
+        self.entries = OrderedDict()  # (model, persona, numbers, text) -> CachedResponse, oldest use first
+        self.groups = {}  # (model, persona, numbers) -> keys searched by similarity
+        self.vectors = OrderedDict()  # text -> vector of recent lookups, so storing doesn't embed again
+        self.bytes = 0
+        self.lookups = 0
+        self.hits = 0
+        self.similar_hits = 0
+        self.stale = 0
+        self.stores = 0
+        self.evictions = 0
+        self.saved_seconds = 0.0
+
+    def _group(self, model, persona, text):
+        return (model, resultDigest(persona), tuple(sorted(set(number_pattern.findall(text)))))
+
+    def _remove(self, key):
+        entry = self.entries.pop(key)
+        self.bytes -= entry.size
+        group = self.groups.get(key[:3])
+        if group is not None:
+            group.discard(key)
+            if not group:
+                del self.groups[key[:3]]
+
+    def _get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        if entry.expires < time.monotonic():
+            self._remove(key)
+            return None
+        self.entries.move_to_end(key)
+        return entry
+
+    async def _vector(self, text):
+        vector = self.vectors.get(text)
+        if vector is None:
+            try:
+                vector = await self.embedder.embedQuery(text)
+            except Exception as e:
+                log.warning(f"Error embedding message for the response cache: {e}")
+                return None
+            self.vectors[text] = vector
+            while len(self.vectors) > 256:
+                self.vectors.popitem(last=False)
+        return vector
+
+    async def _similar(self, group, text):
+        if not self.groups.get(group):
+            return None
+        query = await self._vector(text)
+        if query is None:
+            return None
+        # collected after the embedding, entries can be evicted or replaced while it runs
+        keys = [key for key in self.groups.get(group, ()) if key in self.entries and self.entries[key].vector is not None]
+        if not keys:
+            return None
+        vectors = np.stack([self.entries[key].vector for key in keys])
+        if vectors.shape[1] != query.shape[0]:
+            return None  # the embedding model changed
+        scores = vectors @ query
+        best = int(np.argmax(scores))
+        if scores[best] < self.similarity:
+            return None
+        return self._get(keys[best])
+
+    async def lookup(self, model, persona, message, validate=None):
+        # validate(tool_calls) gives a digest of what the tools return now, an answer built on old results is dropped
+        text = normalizeMessage(message)
+        if len(text) < self.min_chars:
+            return None
+        self.lookups += 1
+        group = self._group(model, persona, text)
+        entry = self._get((*group, text))
+        similar = False
+        if entry is None and self.embedder is not None:
+            entry = await self._similar(group, text)
+            similar = entry is not None
+        if entry is not None and entry.tool_calls and validate is not None:
+            if await validate(entry.tool_calls) != entry.tool_digest:
+                self.stale += 1
+                key = (*group, entry.text)
+                if key in self.entries:
+                    self._remove(key)
+                return None
+        if entry is None:
+            return None
+        entry.hits += 1
+        self.hits += 1
+        self.similar_hits += similar
+        self.saved_seconds += entry.cost
+        return entry.response
+
+    async def store(self, model, persona, message, response, tool_calls=None, tool_digest=None, cost=0.0):
+        text = normalizeMessage(message)
+        if len(text) < self.min_chars or not response or not selfContained(text, tool_calls):
+            return
+        vector = await self._vector(text) if self.embedder is not None else None
+        group = self._group(model, persona, text)
+        key = (*group, text)
+        if key in self.entries:
+            self._remove(key)
+        entry = CachedResponse(text, response, vector, tool_calls or [], tool_digest, cost, self.ttl)
+        self.entries[key] = entry
+        self.groups.setdefault(group, set()).add(key)
+        self.bytes += entry.size
+        self.stores += 1
+        while self.entries and (len(self.entries) > self.maxsize or self.bytes > self.max_bytes):
+            self._remove(next(iter(self.entries)))
+            self.evictions += 1
+
+    def clear(self):
+        self.entries.clear()
+        self.groups.clear()
+        self.bytes = 0
+
+    def stats(self):
+        return {
+            'entries': len(self.entries),
+            'bytes': self.bytes,
+            'lookups': self.lookups,
+            'hits': self.hits,
+            'similar_hits': self.similar_hits,
+            'stale': self.stale,
+            'hit_rate': self.hits / self.lookups if self.lookups else 0.0,
+            'evictions': self.evictions,
+            'saved_seconds': self.saved_seconds,
+        }
@@ -0,0 +1,158 @@
+import asyncio
+import time
+from collections import Counter, OrderedDict, deque
+from contextlib import asynccontextmanager
+
+
+class Overloaded(Exception):
+    # the request was dropped or replaced by a newer one from the same channel
+    pass
+
+
+class Ticket:
+    def __init__(self, channel_id, model):
+        self.channel_id = channel_id
+        self.model = model
+        self.future = asyncio.get_running_loop().create_future()
+        self.enqueued_at = time.monotonic()
+        self.wait_time = 0.0
+
+
+def parseLimits(text, cast=int):
+    # "qwen3:4b=2,llava:latest=1" -> {'qwen3:4b': 2, 'llava:latest': 1}
+    limits = {}
+    for part in (text or '').split(','):
+        if '=' in part:
+            key, value = part.rsplit('=', 1)
+            limits[key.strip()] = cast(value.strip())
+    return limits
+
+
+class InferenceScheduler:
+    # hands out inference slots, taking turns between channels so one busy channel can't hog the gpu
+    def __init__(self, max_concurrency=4, model_limits=None, policy='coalesce', max_queue_per_channel=1, weights=None):
+        self.max_concurrency = max_concurrency
+        self.model_limits = model_limits or {}
+        self.policy = policy  # coalesce, drop or queue
+        self.max_queue_per_channel = max_queue_per_channel
+        self.weights = weights or {}
+        self.waiting = OrderedDict()  # channel id -> deque of tickets, in turn order
+        self.active = 0
+        self.active_by_model = Counter()
+        self.active_by_channel = Counter()
+        self._credits = {}
+        self.granted = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.recent_waits = deque(maxlen=100)
+
+    def _modelFree(self, model):
+        limit = self.model_limits.get(model)
+        return limit is None or self.active_by_model[model] < limit
+
+    def _grant(self, ticket):
+        self.active += 1
+        self.active_by_model[ticket.model] += 1
+        self.active_by_channel[ticket.channel_id] += 1
+        ticket.wait_time = time.monotonic() - ticket.enqueued_at
+        self.granted += 1
+        self.total_wait += ticket.wait_time
+        self.max_wait = max(self.max_wait, ticket.wait_time)
+        self.recent_waits.append(ticket.wait_time)
+        ticket.future.set_result(ticket)
+
+    def _dispatch(self):
+        # round robin over channels, a channel with weight n gets n turns in a row
+        while self.active < self.max_concurrency and self.waiting:
+            granted = False
+            for channel_id in list(self.waiting):
+                queue = self.waiting[channel_id]
+                ticket = queue[0]
+                if not self._modelFree(ticket.model):
+                    continue
+                queue.popleft()
+                self._grant(ticket)
+                granted = True
+                credits = self._credits.get(channel_id, self.weights.get(str(channel_id), 1)) - 1
+                if not queue:
+                    del self.waiting[channel_id]
+                    self._credits.pop(channel_id, None)
+                elif credits <= 0:
+                    self.waiting.move_to_end(channel_id)
+                    self._credits.pop(channel_id, None)
+                else:
+                    self._credits[channel_id] = credits
+                break
+            if not granted:
+                return
+
+    def _remove(self, ticket):
+        queue = self.waiting.get(ticket.channel_id)
+        if queue and ticket in queue:
+            queue.remove(ticket)
+            if not queue:
+                del self.waiting[ticket.channel_id]
+                self._credits.pop(ticket.channel_id, None)
+
+    def _admit(self, ticket):
+        queue = self.waiting.get(ticket.channel_id)
+        busy = self.active_by_channel[ticket.channel_id] > 0 or bool(queue)
+        if self.policy == 'drop' and busy:
+            self.dropped += 1
+            raise Overloaded(f"channel {ticket.channel_id} already has a request in flight")
+        if queue and len(queue) >= self.max_queue_per_channel:
+            if self.policy == 'coalesce':
+                # the newest message replaces the one still waiting, its reply covers both
+                old = queue.pop()
+                self.coalesced += 1
+                old.future.set_exception(Overloaded("replaced by a newer message"))
+            else:
+                self.dropped += 1
+                raise Overloaded(f"channel {ticket.channel_id} has too many queued requests")
+        self.waiting.setdefault(ticket.channel_id, deque()).append(ticket)
+
+    async def acquire(self, channel_id, model):
+        ticket = Ticket(channel_id, model)
+        self._admit(ticket)
+        self._dispatch()
+        try:
+            return await ticket.future
+        except asyncio.CancelledError:
+            if ticket.future.done() and not ticket.future.cancelled() and ticket.future.exception() is None:
+                self.release(ticket)
+            else:
+                self._remove(ticket)
+            raise
+
+    def release(self, ticket):
+        self.active -= 1
+        self.active_by_model[ticket.model] -= 1
+        self.active_by_channel[ticket.channel_id] -= 1
+        if self.active_by_channel[ticket.channel_id] <= 0:
+            del self.active_by_channel[ticket.channel_id]
+        self._dispatch()
+
+    @asynccontextmanager
+    async def slot(self, channel_id, model):
+        ticket = await self.acquire(channel_id, model)
+        try:
+            yield ticket
+        finally:
+            self.release(ticket)
+
+    def stats(self):
+        queued = sum(len(queue) for queue in self.waiting.values())
+        return {
+            'active': self.active,
+            'queued': queued,
+            'queued_channels': len(self.waiting),
+            'active_by_model': dict(+self.active_by_model),
+            'granted': self.granted,
+            'dropped': self.dropped,
+            'coalesced': self.coalesced,
+            'avg_wait_ms': self.total_wait / self.granted * 1000 if self.granted else 0.0,
+            'recent_wait_ms': sum(self.recent_waits) / len(self.recent_waits) * 1000 if self.recent_waits else 0.0,
+            'max_wait_ms': self.max_wait * 1000,
+        }
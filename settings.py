@@ -0,0 +1,323 @@
+import atexit
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+DEFAULT_MODEL = 'qwen3:4b'
+DEFAULT_PERSONA = 'default'
+
+
+def writeAtomic(path, text):
+    # write next to the file and rename over it, a crash leaves either the old file or the new one
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, 'w', encoding='utf-8') as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+class JsonBackend:
+    # the files the bot has always used, so existing settings carry over
+    def __init__(self, personas_path='personas store.json', models_path='models store.json', cache_path='cache store.json',
+                 default_model_path='defaultModel.txt', default_persona_path='defaultPersona.txt'):
+        self.paths = {'persona': personas_path, 'model': models_path, 'cache': cache_path}
+        self.default_paths = {'model': default_model_path, 'persona': default_persona_path}
+
+    def load(self):
+        state = {'persona': {}, 'model': {}, 'cache': {}, 'default': {}}
+        for scope, path in self.paths.items():
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    state[scope] = {str(key): value for key, value in json.load(f).items()}
+            except FileNotFoundError:
+                pass
+            except (OSError, ValueError, AttributeError) as e:
+                log.warning(f"Error reading {path}: {e}")
+        for key, path in self.default_paths.items():
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    value = f.read().strip()
+            except FileNotFoundError:
+                continue
+            if value:
+                state['default'][key] = value
+        return state
+
+    def save(self, state, dirty):
+        # a json file can only be written whole, so every scope with a change is rewritten once
+        for scope in {scope for scope, _ in dirty}:
+            if scope == 'default':
+                for key, path in self.default_paths.items():
+                    if ('default', key) in dirty:
+                        writeAtomic(path, state['default'].get(key, ''))
+            else:
+                writeAtomic(self.paths[scope], json.dumps({key: value for key, value in state[scope].items() if value is not None}))
+
+    def changed(self):
+        return False  # only this process writes the json files
+
+    def close(self):
+        pass
+
+
+class SqliteBackend:
+    # one row per setting, only the changed rows are written so several processes can share the file
+    def __init__(self, path='settings.db', migrate_from=None):
+        self.path = path
+        self.migrate_from = migrate_from
+        # reads and the background writer each get their own connection, a connection is never used by two
+        # threads at once
+        self._conns = {}  # 'read' or 'write' -> connection
+        self._read_lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._version = None
+
+    def _connect(self, role):
+        conn = self._conns.get(role)
+        if conn is None:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('CREATE TABLE IF NOT EXISTS settings ('
+                         'scope TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, updated_at REAL NOT NULL, '
+                         'PRIMARY KEY (scope, key))')
+            self._conns[role] = conn
+        return conn
+
+    def changed(self):
+        # data_version goes up when another connection commits, so shards see each other's changes
+        with self._read_lock:
+            version = self._connect('read').execute('PRAGMA data_version').fetchone()[0]
+            changed, self._version = version != self._version, version
+        return changed
+
+    def load(self):
+        with self._read_lock:
+            conn = self._connect('read')
+            self._version = conn.execute('PRAGMA data_version').fetchone()[0]
+            rows = conn.execute('SELECT scope, key, value FROM settings').fetchall()
+        state = {'persona': {}, 'model': {}, 'cache': {}, 'default': {}}
+        if not rows and self.migrate_from is not None:
+            # first start on sqlite, bring the json settings over
+            state = self.migrate_from.load()
+            self.save(state, {(scope, key) for scope, values in state.items() for key in values})
+            log.info(f"Migrated settings to {self.path}")
+            return state
+        for scope, key, value in rows:
+            state.setdefault(scope, {})[key] = value
+        return state
+
+    def save(self, state, dirty):
+        now = time.time()
+        with self._write_lock:
+            conn = self._connect('write')
+            with conn:
+                for scope, key in dirty:
+                    value = state.get(scope, {}).get(key)
+                    if value is None:
+                        conn.execute('DELETE FROM settings WHERE scope = ? AND key = ?', (scope, key))
+                    else:
+                        conn.execute('INSERT OR REPLACE INTO settings VALUES (?, ?, ?, ?)', (scope, key, value, now))
+
+    def close(self):
+        with self._read_lock, self._write_lock:
+            for conn in self._conns.values():
+                conn.close()
+            self._conns.clear()
+
+
+class SettingsStore:
+    # persona and model per channel plus the defaults, read from memory and written behind in the background
+    def __init__(self, backend, debounce=2.0, max_delay=10.0, sync_interval=2.0):
+        self.backend = backend
+        self.sync_interval = sync_interval  # how often the bot calls sync()
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self._state = None
+        self._dirty = set()
+        self._dirty_since = None
+        self._lock = threading.RLock()
+        self._write_lock = threading.Lock()
+        self._timer = None
+        self.writes = 0
+
+    def open(self):
+        with self._lock:
+            if self._state is None:
+                self._state = self.backend.load()
+
+    def sync(self):
+        # picks up settings another shard process wrote, changes not written yet from this one win. It blocks
+        # on the database, the bot runs it in a thread every sync_interval seconds
+        if self._state is None:
+            self.open()
+            return True
+        try:
+            if not self.backend.changed():
+                return False
+            state = self.backend.load()
+        except sqlite3.Error as e:
+            log.warning(f"Error reading settings: {e}")
+            return False
+        with self._lock:
+            for scope, key in self._dirty:
+                value = self._state.get(scope, {}).get(key)
+                if value is not None:
+                    state.setdefault(scope, {})[key] = value
+            self._state = state
+        return True
+
+    def get(self, scope, key, default=None):
+        self.open()
+        with self._lock:
+            return self._state.get(scope, {}).get(str(key), default)
+
+    def set(self, scope, key, value):
+        self.open()
+        key = str(key)
+        with self._lock:
+            if self._state.setdefault(scope, {}).get(key) == value:
+                return
+            self._state[scope][key] = value
+            self._dirty.add((scope, key))
+            self._schedule()
+
+    def _schedule(self):
+        # every change pushes the write back a little, a burst of changes is one write
+        now = time.monotonic()
+        if self._dirty_since is None:
+            self._dirty_since = now
+        if self._timer is not None:
+            if now - self._dirty_since >= self.max_delay:
+                return
+            self._timer.cancel()
+        self._timer = threading.Timer(self.debounce, self.flush)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def flush(self):
+        with self._write_lock:
+            with self._lock:
+                dirty, self._dirty = self._dirty, set()
+                self._dirty_since = None
+                self._timer = None
+                if not dirty:
+                    return 0
+                snapshot = {scope: dict(values) for scope, values in self._state.items()}
+            try:
+                self.backend.save(snapshot, dirty)
+            except (OSError, sqlite3.Error) as e:
+                log.warning(f"Error writing settings: {e}")
+                with self._lock:
+                    self._dirty |= dirty
+                    self._schedule()
+                return 0
+            self.writes += 1
+        return len(dirty)
+
+    def close(self):
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+        if self._state is not None:
+            self.flush()
+        self.backend.close()
+
+    @property
+    def defaultModel(self):
+        return self.get('default', 'model') or DEFAULT_MODEL
+
+    @property
+    def defaultPersona(self):
+        return self.get('default', 'persona') or DEFAULT_PERSONA
+
+    def setDefaultModel(self, model):
+        self.set('default', 'model', model)
+
+    def setDefaultPersona(self, persona):
+        self.set('default', 'persona', persona)
+
+    def persona(self, channel_id):
+        return self.get('persona', channel_id) or self.defaultPersona
+
+    def model(self, channel_id):
+        return self.get('model', channel_id) or self.defaultModel
+
+    def channelPersona(self, channel_id):
+        return self.get('persona', channel_id)
+
+    def channelModel(self, channel_id):
+        return self.get('model', channel_id)
+
+    def setPersona(self, channel_id, persona):
+        self.set('persona', channel_id, persona)
+
+    def setModel(self, channel_id, model):
+        self.set('model', channel_id, model)
+
+    def responseCache(self, channel_id):
+        return self.get('cache', channel_id) == 'on'
+
+    def setResponseCache(self, channel_id, enabled):
+        # off is the default, so turning it off removes the setting
+        self.set('cache', channel_id, 'on' if enabled else None)
+
+    def modelsInUse(self):
+        self.open()
+        with self._lock:
+            return list(dict.fromkeys([self.defaultModel, *self._state.get('model', {}).values()]))
+
+    def personasInUse(self):
+        self.open()
+        with self._lock:
+            return list(dict.fromkeys([self.defaultPersona, *self._state.get('persona', {}).values()]))
+
+
+class PersonaFile:
+    # personas.json is read again when it changes on disk, so personas can be edited without a restart
+    def __init__(self, path='personas.json'):
+        self.path = path
+        self.mtime = None
+        self.prompts = {}
+
+    def load(self):
+        mtime = os.stat(self.path).st_mtime_ns
+        with open(self.path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        self.prompts = {p['name']: p['prompt'] for p in data['personas']}
+        self.mtime = mtime
+
+    def reload(self):
+        try:
+            if os.stat(self.path).st_mtime_ns == self.mtime:
+                return False
+            self.load()
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            # a half saved or broken file keeps the personas that were already loaded
+            log.warning(f"Not reloading {self.path}: {e}")
+            return False
+        return True
+
+    def prompt(self, name, fallback=DEFAULT_PERSONA):
+        # a persona that was taken out of the file falls back to the default one
+        return self.prompts.get(name) or self.prompts.get(fallback) or next(iter(self.prompts.values()), '')
+
+
+def makeStore():
+    backend = JsonBackend()
+    # shard processes all write settings, so they need the shared sqlite file
+    if (os.environ.get('SETTINGS_BACKEND') or 'json').lower() == 'sqlite' or os.environ.get('SHARD_COUNT'):
+        backend = SqliteBackend(os.environ.get('SETTINGS_DB') or 'settings.db', migrate_from=backend)
+    return SettingsStore(backend, debounce=float(os.environ.get('SETTINGS_DEBOUNCE') or 2.0),
+                         sync_interval=float(os.environ.get('SETTINGS_SYNC_SECONDS') or 2.0))
+
+
+settings = makeStore()
+atexit.register(settings.close)
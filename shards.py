@@ -0,0 +1,128 @@
+import json
+import logging
+import os
+import signal
+import subprocess
+import sys
+import time
+import urllib.request
+
+log = logging.getLogger(__name__)
+
+GATEWAY_URL = 'https://discord.com/api/v10/gateway/bot'
+USER_URL = 'https://discord.com/api/v10/users/@me'
+
+
+def parseShardIds(text):
+    # "0-3,6" -> [0, 1, 2, 3, 6]
+    ids = []
+    for part in (text or '').split(','):
+        part = part.strip()
+        if not part:
+            continue
+        if '-' in part:
+            start, end = part.split('-', 1)
+            ids.extend(range(int(start), int(end) + 1))
+        else:
+            ids.append(int(part))
+    return ids
+
+
+def formatShardIds(ids):
+    return f"{ids[0]}-{ids[-1]}" if len(ids) > 1 else str(ids[0])
+
+
+def shardRanges(count, workers):
+    # splits the shards into one contiguous range per worker, the first workers get the extra ones
+    workers = max(1, min(workers, count))
+    size, extra = divmod(count, workers)
+    ranges = []
+    start = 0
+    for worker in range(workers):
+        end = start + size + (1 if worker < extra else 0)
+        ranges.append(list(range(start, end)))
+        start = end
+    return ranges
+
+
+def recommendedShards(token):
+    # what discord suggests for the bot's guild count, asked once at launch
+    request = urllib.request.Request(GATEWAY_URL, headers={'Authorization': f'Bot {token}', 'User-Agent': 'OmeraAI'})
+    with urllib.request.urlopen(request, timeout=10) as response:
+        return int(json.load(response)['shards'])
+
+
+def tokenUser(token):
+    # the bot user the token logs in as, discord answers 401 if the token is wrong
+    request = urllib.request.Request(USER_URL, headers={'Authorization': f'Bot {token}', 'User-Agent': 'OmeraAI'})
+    with urllib.request.urlopen(request, timeout=10) as response:
+        return json.load(response)
+
+
+class ShardLauncher:
+    # runs bot.py once per shard range and restarts a worker if it dies
+    def __init__(self, count, workers, command, restart_delay=5, max_restart_delay=300):
+        self.count = count
+        self.ranges = shardRanges(count, workers)
+        self.command = command
+        self.restart_delay = restart_delay
+        self.max_restart_delay = max_restart_delay
+        self.processes = {}  # worker index -> Popen
+        self.delays = {}
+        self.restart_at = {}
+        self.started = {}
+        self.stopping = False
+
+    def env(self, worker):
+        ids = self.ranges[worker]
+        env = dict(os.environ, SHARD_COUNT=str(self.count), SHARD_IDS=formatShardIds(ids),
+                   LOG_PREFIX=f"[shards {formatShardIds(ids)}] ")
+        # every worker gets its own metrics port
+        if os.environ.get('METRICS_PORT'):
+            env['METRICS_PORT'] = str(int(os.environ['METRICS_PORT']) + worker)
+        return env
+
+    def spawn(self, worker):
+        self.processes[worker] = subprocess.Popen(self.command, env=self.env(worker))
+        self.started[worker] = time.monotonic()
+        log.info(f"Started shards {formatShardIds(self.ranges[worker])} of {self.count} as pid {self.processes[worker].pid}")
+
+    def stop(self, *args):
+        self.stopping = True
+        for process in self.processes.values():
+            if process.poll() is None:
+                process.terminate()
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        for worker in range(len(self.ranges)):
+            self.spawn(worker)
+        while not self.stopping:
+            time.sleep(1)
+            now = time.monotonic()
+            for worker, process in list(self.processes.items()):
+                code = process.poll()
+                if code is None or self.stopping:
+                    continue
+                if worker not in self.restart_at:
+                    if now - self.started[worker] > 60:
+                        self.delays[worker] = self.restart_delay  # it had been running fine
+                    # back off if a worker keeps dying, e.g. a bad token
+                    delay = self.delays.get(worker, self.restart_delay)
+                    self.delays[worker] = min(delay * 2, self.max_restart_delay)
+                    self.restart_at[worker] = now + delay
+                    log.warning(f"Shards {formatShardIds(self.ranges[worker])} exited with {code}, restarting in {delay}s")
+                elif now >= self.restart_at[worker]:
+                    del self.restart_at[worker]
+                    self.spawn(worker)
+        for process in self.processes.values():
+            try:
+                process.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        return 0
+
+
+def launch(count, workers, script):
+    return ShardLauncher(count, workers, [sys.executable, script]).run()
@@ -0,0 +1,54 @@
+import asyncio
+import time
+
+# imported first by bot.py, so the clock starts before discord and the other imports
+STARTED = time.perf_counter()
+
+
+class StartupReport:
+    # where startup time goes: each mark is the time since the previous one
+    def __init__(self, started=STARTED):
+        self.started = started
+        self.last = started
+        self.steps = []  # (name, seconds, error)
+
+    def mark(self, name):
+        now = time.perf_counter()
+        self.steps.append((name, now - self.last, None))
+        self.last = now
+
+    async def parallel(self, name, **loaders):
+        # runs the loaders at once, each gets its own line under the group's wall time
+        group = len(self.steps)
+        started = time.perf_counter()
+
+        async def timed(loader_name, loader):
+            loader_started = time.perf_counter()
+            error = None
+            try:
+                await loader()
+            except Exception as e:
+                error = e
+            self.steps.append((f"  {loader_name}", time.perf_counter() - loader_started, error))
+            return loader_name, error
+
+        results = await asyncio.gather(*(timed(loader_name, loader) for loader_name, loader in loaders.items()))
+        now = time.perf_counter()
+        self.steps.insert(group, (name, now - started, None))
+        self.last = now
+        return {loader_name: error for loader_name, error in results if error is not None}
+
+    def total(self):
+        return self.last - self.started
+
+    def format(self):
+        lines = [f"Started in {self.total() * 1000:.0f}ms"]
+        for name, seconds, error in self.steps:
+            line = f"  {name}: {seconds * 1000:.0f}ms"
+            if error is not None:
+                line += f" (failed: {error})"
+            lines.append(line)
+        return '\n'.join(lines)
+
+
+startup = StartupReport()
@@ -0,0 +1,108 @@
+import asyncio
+import logging
+import re
+import time
+
+import discord
+
+log = logging.getLogger(__name__)
+
+think_pattern = re.compile(r'<think>.*?(</think>|$)', re.DOTALL)
+open_code_pattern = re.compile(r'`{1,3}(?:python)?\n?[\s\S]*$')
+closed_code_pattern = re.compile(r'`{1,3}(?:python)?\n?[\s\S]*?`{1,3}')
+
+DISCORD_LIMIT = 2000
+
+
+def previewText(text):
+    # cheap cleanup for partial replies, the full format_response/read_embeds runs on the final text
+    text = think_pattern.sub('', text)
+    text = closed_code_pattern.sub('', text)
+    text = open_code_pattern.sub('', text)  # embed code that is still being written
+    text = text.strip()
+    if text.lower().startswith("omera ai:"):
+        text = text[9:].lstrip()
+    return text[:DISCORD_LIMIT]
+
+
+class StreamingReply:
+    # posts the reply once the first tokens arrive and then edits it as more come in
+    def __init__(self, message, interval=1.0, min_chars=2):
+        self.message = message
+        self.interval = interval
+        self.min_chars = min_chars
+        self.reply = None
+        self.latest = ''
+        self.shown = ''
+        self._changed = asyncio.Event()
+        self._task = None
+        self._pending = None
+
+    def push(self, text):
+        self.latest = text
+        self._changed.set()
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def _show(self, text):
+        try:
+            if self.reply is None:
+                self.reply = await self.message.reply(text, mention_author=False)
+            else:
+                await self.reply.edit(content=text)
+            self.shown = text
+        except discord.HTTPException as e:
+            # rate limited or similar, slow the edits down
+            log.warning(f"Error updating streamed reply: {e}")
+            self.interval = min(self.interval * 2, 10)
+
+    async def _run(self):
+        while True:
+            await self._changed.wait()
+            self._changed.clear()
+            text = previewText(self.latest)
+            if len(text) >= self.min_chars and text != self.shown:
+                started = time.monotonic()
+                # shielded so finishing mid post doesn't lose track of the reply
+                self._pending = asyncio.ensure_future(self._show(text))
+                await asyncio.shield(self._pending)
+                # discord allows about 5 edits per 5 seconds per channel
+                await asyncio.sleep(max(0, self.interval - (time.monotonic() - started)))
+
+    async def finish(self, response, embed=None):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        if self._pending is not None:
+            await self._pending
+
+        # check if the response is only an emoji
+        if len(response) == 1 and response.isprintable():
+            if self.reply is not None:
+                await self.reply.delete()
+            await self.message.add_reaction(response)
+            return
+
+        if self.reply is None:
+            self.reply = await self.message.reply(response, embed=embed if embed else None, mention_author=False)
+        elif response != self.shown or embed:
+            await self.reply.edit(content=response, embed=embed if embed else None)
+
+    async def discard(self):
+        if self._task is not None:
+            self._task.cancel()
+        if self._pending is not None:
+            # a post still on its way has to land before it can be deleted
+            try:
+                await asyncio.shield(self._pending)
+            except discord.HTTPException:
+                pass
+        if self.reply is not None:
+            try:
+                await self.reply.delete()
+            except discord.HTTPException:
+                pass
+            self.reply = None